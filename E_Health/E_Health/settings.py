@@ -71,6 +71,9 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'E_Health.wsgi.application'
 
+# Live status streams (/api/live/appointments/) need an ASGI server
+ASGI_APPLICATION = 'E_Health.asgi.application'
+
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
@@ -127,3 +130,114 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'authuser.User'
 
+
+
+# Clinic scheduling
+
+# Timezone of the clinic's wall clock (e.g. 'Africa/Lagos'); working hours and
+# day-based filters such as "today" are interpreted in it
+CLINIC_TIME_ZONE = TIME_ZONE
+
+# Weekly working hours by weekday (Monday=0), as clinic-local (start, end) times
+CLINIC_WORKING_HOURS = {
+    weekday: [('08:00', '12:00'), ('13:00', '17:00')] for weekday in range(5)
+}
+
+# Doctors' working hours (WorkingHours, ScheduleException) are stored as one
+# bit per grid step of the clinic day (96 bits at 15 minutes); working hours
+# must start and end on the grid. Free-time bitmaps span SCHEDULE_HORIZON_DAYS.
+SCHEDULE_GRID_MINUTES = 15
+SCHEDULE_HORIZON_DAYS = 90
+
+# Length of one bookable appointment slot
+APPOINTMENT_SLOT_MINUTES = 30
+
+# Longest appointment that can be booked (minutes); bounds every overlap scan
+APPOINTMENT_MAX_MINUTES = 240
+
+# How long a computed doctor-day of availability stays cached (seconds)
+AVAILABILITY_CACHE_TIMEOUT = 60 * 60
+
+# Longest date range one availability request may cover (days)
+AVAILABILITY_MAX_DAYS = 31
+
+# Most rooms and pieces of equipment one appointment may reserve
+APPOINTMENT_MAX_RESOURCES = 10
+
+# Largest number of appointments accepted by one bulk booking request
+BULK_BOOKING_MAX_ITEMS = 500
+
+# Longest date range one bulk reschedule may clear (days), and how far past
+# its end replacement slots are searched for (days)
+RESCHEDULE_MAX_DAYS = 31
+RESCHEDULE_SEARCH_DAYS = 31
+
+# No-show risk model (see mainapp.noshow): days of history it is fitted on,
+# fewest past visits worth fitting, L2 penalty on the weights, and rows per
+# design-matrix chunk while fitting (about 300 bytes each)
+NO_SHOW_HISTORY_DAYS = 730
+NO_SHOW_MIN_SAMPLES = 100
+NO_SHOW_L2 = 1.0
+NO_SHOW_CHUNK_SIZE = 100_000
+
+# Recurring series occurrences are written as appointments this far ahead;
+# later occurrences are virtual reservations (see materialize_series command)
+SERIES_HORIZON_DAYS = 28
+
+# How long a freed slot stays offered to a waitlisted patient (minutes)
+WAITLIST_OFFER_MINUTES = 60
+
+# How far back the doctors' iCalendar feeds reach (days), and how many rows
+# the feed streams per database fetch
+CALENDAR_FEED_PAST_DAYS = 30
+CALENDAR_FEED_CHUNK_SIZE = 2000
+
+# How long a month's per-day appointment counts stay cached (seconds). An
+# appointment change retires its month at once only in the process that made
+# it: with no CACHES configured every process has its own local-memory cache,
+# so other processes may serve the old counts until this runs out
+MONTH_CALENDAR_CACHE_TIMEOUT = 5 * 60
+
+# Most doctor-day agendas each process keeps precomputed (least recently used
+# days are evicted first), and how long one is trusted (seconds): without a
+# shared CACHES backend, changes made by other processes show after this
+AGENDA_CACHE_SIZE = 10000
+AGENDA_CACHE_TIMEOUT = 5 * 60
+
+# Live status streams: frames buffered per connection before a slow client is
+# dropped, idle seconds between keep-alive comments, and the lifetime of the
+# stream tokens handed to EventSource clients (seconds). A token is checked
+# when the stream connects, so clients fetch a fresh one for each reconnect
+LIVE_QUEUE_SIZE = 100
+LIVE_HEARTBEAT_SECONDS = 15
+LIVE_TOKEN_MAX_AGE = 5 * 60
+
+# Reminders (send_reminders command): minutes before the appointment each
+# reminder goes out, rows read and dispatched per batch, dispatch threads,
+# the transport class, and the outbox file used by the local FileTransport
+APPOINTMENT_REMINDER_MINUTES = [24 * 60, 2 * 60]
+REMINDER_BATCH_SIZE = 1000
+REMINDER_WORKERS = 4
+REMINDER_TRANSPORT = 'mainapp.reminders.FileTransport'
+REMINDER_OUTBOX = BASE_DIR / 'reminders.outbox.jsonl'
+
+# Pending appointments nobody confirmed are cancelled once this old (hours) or
+# once their time has passed (expire_pending command), in chunks of
+# SWEEP_CHUNK_SIZE rows with SWEEP_CHUNK_PAUSE seconds between them. Set
+# SWEEP_INTERVAL_SECONDS to also sweep periodically in a background thread of
+# every process that loads mainapp (started by MainappConfig.ready()).
+PENDING_EXPIRY_HOURS = 72
+SWEEP_CHUNK_SIZE = 500
+SWEEP_CHUNK_PAUSE = 0.05
+SWEEP_INTERVAL_SECONDS = None
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'mainapp': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
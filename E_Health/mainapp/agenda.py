@@ -0,0 +1,132 @@
+"""
+Precomputed per-doctor daily agenda.
+
+A doctor's day (active appointments in slot order, already serialized) is
+built with one query and kept in a bounded in-process LRU, so repeated "what
+is my day" reads cost a dictionary lookup instead of a query and a
+serializer pass. Every write path funnels through
+``signals.appointments_changed``, which drops exactly the doctor-day a change
+touches. Entries are stamped with a per-doctor-day version kept in the
+Django cache, so with a shared cache backend a change seen by one process
+also retires the copies other processes hold. The default local-memory cache
+is per process, so entries also expire after ``AGENDA_CACHE_TIMEOUT``, which
+bounds how long another process can serve an old agenda.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .clinic_time import clinic_date, day_range_filter
+from .models import Appointment
+
+
+VERSION_KEY = 'agenda:{doctor_id}:{day}:version'
+
+
+class LRUCache:
+    """
+    Thread-safe mapping that evicts the least recently used key beyond
+    ``maxsize``, and treats entries older than ``max_age`` seconds as missing
+    """
+
+    def __init__(self, maxsize, max_age=None):
+        self.maxsize = maxsize
+        self.max_age = max_age
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key, version):
+        """Return the value stored for ``key`` at ``version``, or None"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != version or (
+                self.max_age is not None and time.monotonic() - entry[2] > self.max_age
+            ):
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, version, value):
+        with self.lock:
+            self.entries[key] = (version, value, time.monotonic())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else None,
+            }
+
+
+agendas = LRUCache(settings.AGENDA_CACHE_SIZE, settings.AGENDA_CACHE_TIMEOUT)
+
+
+def version_key(doctor_id, day):
+    return VERSION_KEY.format(doctor_id=doctor_id, day=day.isoformat())
+
+
+def build(doctor_id, day):
+    """Serialize the doctor's active appointments on ``day`` with one query"""
+    from .serializers import AppointmentListSerializer
+
+    appointments = Appointment.objects.select_related('patient', 'doctor').with_flags().filter(
+        doctor_id=doctor_id,
+        status__in=Appointment.ACTIVE_STATUSES,
+        **day_range_filter(day),
+    ).order_by('date_time', 'id')
+    # is_upcoming depends on the time of the read, so it is filled in by get()
+    return tuple(
+        (appointment.date_time, data)
+        for appointment, data in zip(appointments, AppointmentListSerializer(appointments, many=True).data)
+    )
+
+
+def get(doctor_id, day, now=None):
+    """Return the doctor's agenda for ``day`` as a list of serialized appointments"""
+    key = (doctor_id, day)
+    version = cache.get(version_key(doctor_id, day), 0)
+    entries = agendas.get(key, version)
+    if entries is None:
+        entries = build(doctor_id, day)
+        agendas.set(key, version, entries)
+
+    now = now or timezone.now()
+    return [{**data, 'is_upcoming': date_time > now} for date_time, data in entries]
+
+
+def invalidate(doctor_id, date_time):
+    """Retire the agenda of the doctor-day an appointment at ``date_time`` starts on"""
+    day = clinic_date(date_time)
+    key = version_key(doctor_id, day)
+    if not cache.add(key, 1, None):
+        cache.incr(key)
+    agendas.discard((doctor_id, day))
+
+
+def clear():
+    """Drop every local agenda (e.g. after a rename shown in all of them)"""
+    agendas.clear()
@@ -1,6 +1,14 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class MainappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'mainapp'
+
+    def ready(self):
+        from . import signals  # noqa: F401  (connect signal handlers)
+
+        if settings.SWEEP_INTERVAL_SECONDS:
+            from . import sweeper
+            sweeper.start_periodic()
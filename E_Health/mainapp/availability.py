@@ -0,0 +1,219 @@
+"""
+Doctor availability engine.
+
+Free time is computed per doctor-day as the doctor's working hours (their
+weekly template and date exceptions, see ``schedule``) minus the merged
+intervals of active appointments and of virtual (not yet materialized) series
+occurrences. Each day's working windows and free intervals are cached and
+dropped by the ``Appointment`` signals in ``signals.py`` whenever a booking on
+that doctor-day changes; a series or working-hours change bumps the doctor's
+cache version instead, since it can touch any future day. A warm read costs
+no SQL and a cold read costs one range scan over the (doctor, date_time)
+index for all missing days, plus one indexed lookup each of the doctor's
+series and working hours.
+"""
+from bisect import bisect_left
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+
+from . import schedule, series
+from .clinic_time import clinic_date
+from .models import Appointment
+
+
+CACHE_KEY = 'availability:{doctor_id}:{version}:{day}'
+VERSION_KEY = 'availability:{doctor_id}:version'
+
+
+def slot_length():
+    return timedelta(minutes=settings.APPOINTMENT_SLOT_MINUTES)
+
+
+def merge_intervals(intervals):
+    """Merge overlapping or touching (start, end) intervals"""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def subtract_intervals(windows, busy):
+    """Return the parts of ``windows`` not covered by merged, sorted ``busy``"""
+    free = []
+    starts = [start for start, _ in busy]
+    for window_start, window_end in windows:
+        cursor = window_start
+        # Only busy intervals that can overlap this window need visiting
+        i = max(bisect_left(starts, window_start) - 1, 0)
+        while i < len(busy) and busy[i][0] < window_end:
+            busy_start, busy_end = busy[i]
+            if busy_end > cursor:
+                if busy_start > cursor:
+                    free.append((cursor, busy_start))
+                cursor = busy_end
+            i += 1
+        if cursor < window_end:
+            free.append((cursor, window_end))
+    return free
+
+
+def split_slots(windows, free, length):
+    """Yield slot-grid (start, end) pairs inside ``windows`` that fit in ``free``"""
+    i = 0
+    for window_start, window_end in windows:
+        start = window_start
+        while start + length <= window_end:
+            end = start + length
+            while i < len(free) and free[i][1] < end:
+                i += 1
+            if i == len(free):
+                return
+            if free[i][0] <= start:
+                yield start, end
+            start = end
+
+
+def max_duration():
+    return timedelta(minutes=settings.APPOINTMENT_MAX_MINUTES)
+
+
+def nearby_intervals(windows):
+    """
+    Return {doctor_id: sorted (start, end)} of the active appointments that
+    may overlap any of the (doctor_id, start, end) ``windows``.
+
+    No appointment outlasts ``max_duration()``, so only rows starting in
+    (start - max_duration, end) can overlap a window: each window is one
+    bounded range on the covering (doctor, date_time, status, duration)
+    index, however many rows the doctor has. Callers test the actual overlap
+    with ``collides``.
+    """
+    reach = max_duration()
+    ranges = {}
+    for doctor_id, start, end in windows:
+        ranges.setdefault(doctor_id, []).append((start - reach, end))
+    if not ranges:
+        return {}
+    # The status test sits inside every term: left outside the OR, it steers
+    # SQLite to the status index and a scan of every active row, testing each
+    # against all the ranges, instead of one index range per term
+    condition = Q()
+    for doctor_id, doctor_ranges in ranges.items():
+        for start, end in merge_intervals(doctor_ranges):
+            condition |= Q(
+                doctor_id=doctor_id, date_time__gt=start, date_time__lt=end, status__in=Appointment.ACTIVE_STATUSES
+            )
+
+    intervals = {doctor_id: [] for doctor_id in ranges}
+    rows = Appointment.objects.filter(condition).order_by().values_list('doctor_id', 'date_time', 'duration')
+    for doctor_id, date_time, minutes in rows:
+        intervals[doctor_id].append((date_time, date_time + timedelta(minutes=minutes)))
+    for doctor_intervals in intervals.values():
+        doctor_intervals.sort()
+    return intervals
+
+
+def collides(intervals, start, end, ignore_start=None):
+    """Whether sorted (start, end) ``intervals`` (any but one starting at ``ignore_start``) hold part of [start, end)"""
+    i = bisect_left(intervals, (start - max_duration(),))
+    while i < len(intervals) and intervals[i][0] < end:
+        if intervals[i][1] > start and intervals[i][0] != ignore_start:
+            return True
+        i += 1
+    return False
+
+
+def busy_intervals(doctor_id, start, end):
+    """
+    Merged busy intervals of the doctor's active appointments and virtual
+    series occurrences overlapping [start, end)
+    """
+    busy = nearby_intervals([(doctor_id, start, end)])[doctor_id]
+    busy.extend(
+        (date_time, date_time + timedelta(minutes=minutes))
+        for _, date_time, minutes in series.virtual_reservations([doctor_id], start, end)
+    )
+    return merge_intervals(busy)
+
+
+def cache_version(doctor_id):
+    return cache.get(VERSION_KEY.format(doctor_id=doctor_id), 0)
+
+
+def day_cache_key(doctor_id, day, version=None):
+    if version is None:
+        version = cache_version(doctor_id)
+    return CACHE_KEY.format(doctor_id=doctor_id, version=version, day=day.isoformat())
+
+
+def free_intervals(doctor_id, days):
+    """Return {day: (working windows, free intervals)} for ``days``, filling cache misses in one pass"""
+    version = cache_version(doctor_id)
+    keys = {day: day_cache_key(doctor_id, day, version) for day in days}
+    cached = cache.get_many(keys.values())
+    result = {day: cached[key] for day, key in keys.items() if key in cached}
+
+    missing = [day for day in days if day not in result]
+    if missing:
+        windows = schedule.working_windows(doctor_id, missing)
+        bounds = [bound for day_windows in windows.values() for window in day_windows for bound in window]
+        busy = busy_intervals(doctor_id, min(bounds), max(bounds)) if bounds else []
+
+        for day in missing:
+            result[day] = (windows[day], subtract_intervals(windows[day], busy))
+        cache.set_many(
+            {keys[day]: result[day] for day in missing},
+            settings.AVAILABILITY_CACHE_TIMEOUT,
+        )
+    return result
+
+
+def get_available_slots(doctor_id, date_from, date_to, now=None):
+    """Return bookable (start, end) slots for the doctor from ``date_from`` to ``date_to`` inclusive"""
+    now = now or timezone.now()
+    days = [date_from + timedelta(days=n) for n in range((date_to - date_from).days + 1)]
+    free = free_intervals(doctor_id, days)
+
+    slots = []
+    for day in days:
+        windows, free_day = free[day]
+        slots.extend(slot for slot in split_slots(windows, free_day, slot_length()) if slot[0] > now)
+    return slots
+
+
+def next_free_slots(doctor_id, after, count=5, days_per_scan=7):
+    """Return up to ``count`` free slots starting after ``after``, scanning a week at a time"""
+    slots = []
+    day = clinic_date(after)
+    horizon = day + timedelta(days=settings.AVAILABILITY_MAX_DAYS)
+    while len(slots) < count and day < horizon:
+        last = min(day + timedelta(days=days_per_scan - 1), horizon)
+        slots.extend(get_available_slots(doctor_id, day, last, now=after))
+        day = last + timedelta(days=1)
+    return slots[:count]
+
+
+def invalidate(doctor_id, date_time):
+    """Drop the cached availability of every day an appointment at ``date_time`` can touch"""
+    first = clinic_date(date_time)
+    last = clinic_date(date_time + max_duration() - timedelta(microseconds=1))
+    version = cache_version(doctor_id)
+    cache.delete_many([
+        day_cache_key(doctor_id, first + timedelta(days=n), version)
+        for n in range((last - first).days + 1)
+    ])
+
+
+def invalidate_doctor(doctor_id):
+    """Drop every cached day of the doctor by moving to a new cache version"""
+    key = VERSION_KEY.format(doctor_id=doctor_id)
+    if not cache.add(key, 1, None):
+        cache.incr(key)
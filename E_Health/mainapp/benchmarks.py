@@ -0,0 +1,812 @@
+"""
+Synthetic-load benchmarks for the appointment API.
+
+Scenarios run against a scratch database created by the ``benchmark``
+management command, never against the development database:
+
+    python manage.py benchmark pagination --rows 5000000
+"""
+import random
+import statistics
+import threading
+import time
+from collections import Counter
+from datetime import time as wall_time, timedelta
+from urllib.parse import parse_qs, urlparse
+
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from authuser.models import User
+from .clinic_time import clinic_datetime, clinic_today, day_range_filter
+from .models import Appointment, WaitlistEntry
+
+
+SCENARIOS = {}
+
+
+def scenario(name):
+    """Register a benchmark function under ``name``"""
+    def register(func):
+        SCENARIOS[name] = func
+        return func
+    return register
+
+
+def timed(func, repeat=5):
+    """Run ``func`` ``repeat`` times and return (median ms, last result)"""
+    samples = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples), result
+
+
+def seed_users(role, count):
+    """Create ``count`` users with ``role`` and unusable passwords, return their ids"""
+    existing = list(User.objects.filter(role=role).values_list('id', flat=True))
+    if len(existing) >= count:
+        return existing[:count]
+
+    User.objects.bulk_create(
+        [
+            User(email=f'{role}{i}@bench.local', name=f'{role.title()} {i}', role=role, password='!')
+            for i in range(len(existing), count)
+        ],
+        batch_size=5000,
+    )
+    return list(User.objects.filter(role=role).values_list('id', flat=True))
+
+
+def seed_appointments(total, doctor_ids, patient_ids, start=None,
+                      step=timedelta(minutes=15), status='confirmed',
+                      batch_size=20000, out=None):
+    """
+    Insert ``total`` appointments spread round-robin over ``doctor_ids``.
+
+    Each doctor gets consecutive ``step``-spaced slots from ``start``, so rows
+    never collide on (doctor, date_time).
+    """
+    start = start or timezone.now().replace(second=0, microsecond=0) - timedelta(days=365)
+    doctors = len(doctor_ids)
+    patients = len(patient_ids)
+
+    for offset in range(0, total, batch_size):
+        Appointment.objects.bulk_create(
+            [
+                Appointment(
+                    doctor_id=doctor_ids[i % doctors],
+                    patient_id=patient_ids[i % patients],
+                    date_time=start + step * (i // doctors),
+                    status=status,
+                )
+                for i in range(offset, min(offset + batch_size, total))
+            ],
+            batch_size=batch_size,
+        )
+        if out is not None and (offset // batch_size) % 25 == 0:
+            out(f'  seeded {min(offset + batch_size, total):,}/{total:,} appointments')
+
+
+@scenario('pagination')
+def pagination(options, out):
+    """Walk /api/appointments/ by cursor and time pages at increasing depths"""
+    from .views import AppointmentViewSet
+
+    rows = options['rows']
+    page_size = options['page_size']
+    admin = User.objects.filter(role='admin').first() or User.objects.create(
+        email='admin@bench.local', name='Bench Admin', role='admin', password='!'
+    )
+
+    if not Appointment.objects.exists():
+        out(f'Seeding {rows:,} appointments...')
+        seed_appointments(
+            rows,
+            seed_users('doctor', options['doctors']),
+            seed_users('patient', options['patients']),
+            out=out,
+        )
+
+    view = AppointmentViewSet.as_view({'get': 'list'})
+    factory = APIRequestFactory()
+
+    def fetch(cursor):
+        params = {'page_size': page_size}
+        if cursor:
+            params['cursor'] = cursor
+        request = factory.get('/api/appointments/', params)
+        force_authenticate(request, user=admin)
+        response = view(request)
+        response.render()
+        return response.data
+
+    last_page = min(options['pages'], max(rows // page_size, 1))
+    checkpoints = {page for page in (1, 10, 100, 1000, 10000, last_page) if page <= last_page}
+
+    out(f'{"page":>8} {"median ms":>10}')
+    cursor = None
+    for page in range(1, last_page + 1):
+        if page in checkpoints:
+            elapsed, data = timed(lambda: fetch(cursor))
+            out(f'{page:>8} {elapsed:>10.2f}')
+        else:
+            data = fetch(cursor)
+
+        if not data['next']:
+            break
+        cursor = parse_qs(urlparse(data['next']).query)['cursor'][0]
+
+
+@scenario('booking')
+def booking(options, out):
+    """N threads race to book the same doctor's mornings through POST /api/appointments/"""
+    from . import availability, schedule
+    from .views import AppointmentViewSet
+
+    threads = options['threads']
+    attempts = options['attempts']
+    doctor_id = seed_users('doctor', 1)[0]
+    patients = list(User.objects.filter(id__in=seed_users('patient', threads)))
+
+    # Morning slots of the next working days, starting tomorrow
+    day = clinic_today() + timedelta(days=1)
+    slots = []
+    while len(slots) < options['slots']:
+        morning = schedule.working_windows(doctor_id, [day])[day][:1]
+        slots.extend(start for start, _ in availability.split_slots(
+            morning, morning, availability.slot_length()
+        ))
+        day += timedelta(days=1)
+    slots = slots[:options['slots']]
+
+    view = AppointmentViewSet.as_view({'post': 'create'})
+    factory = APIRequestFactory()
+    outcomes = Counter()
+    lock = threading.Lock()
+    barrier = threading.Barrier(threads)
+
+    def worker(patient):
+        local = Counter()
+        rng = random.Random(patient.id)
+        barrier.wait()
+        try:
+            for _ in range(attempts):
+                request = factory.post('/api/appointments/', {
+                    'patient_id': patient.id,
+                    'doctor_id': doctor_id,
+                    'date_time': rng.choice(slots).isoformat(),
+                    'reason': 'benchmark',
+                }, format='json')
+                force_authenticate(request, user=patient)
+                local[view(request).status_code] += 1
+        finally:
+            connection.close()
+            with lock:
+                outcomes.update(local)
+
+    workers = [threading.Thread(target=worker, args=(patient,)) for patient in patients]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    total = sum(outcomes.values())
+    booked = Appointment.objects.filter(doctor_id=doctor_id).count()
+    out(f'threads={threads} attempts={total} slots={len(slots)} elapsed={elapsed:.2f}s')
+    out(f'throughput      {total / elapsed:,.0f} requests/s')
+    out(f'booked (201)    {outcomes[201]:,}')
+    out(f'conflicts (409) {outcomes[409]:,} ({outcomes[409] / total:.1%})')
+    out(f'other           {total - outcomes[201] - outcomes[409]:,} {dict(outcomes)}')
+    out(f'rows for doctor {booked:,} (must equal booked and never exceed slots)')
+
+
+@scenario('resources')
+def resource_booking(options, out):
+    """N threads, each for its own doctor, race to book procedures that need the same room and one of two machines"""
+    from . import resources
+    from .models import Resource, ResourceReservation
+    from .views import AppointmentViewSet
+
+    threads = options['threads']
+    attempts = options['attempts']
+    doctor_ids = seed_users('doctor', threads)
+    patients = list(User.objects.filter(id__in=seed_users('patient', threads)))
+    room = Resource.objects.create(name='Procedure room', kind='room')
+    machines = [Resource.objects.create(name=f'Ultrasound {n}', kind='equipment') for n in (1, 2)]
+
+    # Hour-long procedures starting on any half hour of the next working days, so bookings overlap partially
+    day = clinic_today() + timedelta(days=1)
+    starts = []
+    while len(starts) < options['slots']:
+        if day.weekday() < 5:
+            starts.extend(clinic_datetime(day, wall_time(8)) + timedelta(minutes=30 * n) for n in range(7))
+        day += timedelta(days=1)
+    starts = starts[:options['slots']]
+
+    view = AppointmentViewSet.as_view({'post': 'create'})
+    factory = APIRequestFactory()
+    outcomes = Counter()
+    lock = threading.Lock()
+    barrier = threading.Barrier(threads)
+
+    def worker(patient, doctor_id):
+        local = Counter()
+        rng = random.Random(patient.id)
+        barrier.wait()
+        try:
+            for _ in range(attempts):
+                request = factory.post('/api/appointments/', {
+                    'patient_id': patient.id,
+                    'doctor_id': doctor_id,
+                    'date_time': rng.choice(starts).isoformat(),
+                    'duration': 60,
+                    'resource_ids': [room.id, rng.choice(machines).id],
+                }, format='json')
+                force_authenticate(request, user=patient)
+                local[view(request).status_code] += 1
+        finally:
+            connection.close()
+            with lock:
+                outcomes.update(local)
+
+    workers = [
+        threading.Thread(target=worker, args=(patient, doctor_id)) for patient, doctor_id in zip(patients, doctor_ids)
+    ]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    overlaps = 0
+    for resource in [room, *machines]:
+        held = sorted(ResourceReservation.objects.filter(
+            resource=resource, appointment__status__in=Appointment.ACTIVE_STATUSES
+        ).values_list('date_time', 'duration'))
+        overlaps += sum(
+            begin + timedelta(minutes=minutes) > following
+            for (begin, minutes), (following, _) in zip(held, held[1:])
+        )
+
+    total = sum(outcomes.values())
+    out(f'threads={threads} attempts={total} starts={len(starts)} elapsed={elapsed:.2f}s')
+    out(f'throughput        {total / elapsed:,.0f} requests/s')
+    out(f'booked (201)      {outcomes[201]:,}')
+    out(f'conflicts (409)   {outcomes[409]:,} ({outcomes[409] / total:.1%})')
+    out(f'other             {total - outcomes[201] - outcomes[409]:,} {dict(outcomes)}')
+    out(f'overlapping holds {overlaps} (must be 0)')
+
+    after = clinic_datetime(clinic_today() + timedelta(days=1), wall_time(8))
+    connection.queries_log.clear()
+    with CaptureQueriesContext(connection) as queries:
+        resources.next_free([room.id, *(m.id for m in machines)], after, 60, 5, doctor_ids[0])
+    elapsed, _ = timed(lambda: resources.next_free([room.id, *(m.id for m in machines)], after, 60, 5, doctor_ids[0]))
+    out(f'common free time  {elapsed:.2f} ms for 3 resources and a doctor over '
+        f'{settings.AVAILABILITY_MAX_DAYS} days ({len(queries)} queries)')
+
+
+@scenario('waitlist')
+def waitlist(options, out):
+    """Mass-cancel a doctor's week against a deep waitlist and time the backfill"""
+    from . import transitions
+    from . import waitlist as matcher
+
+    rows = options['rows']
+    doctor_ids = seed_users('doctor', options['doctors'])
+    patient_ids = seed_users('patient', options['patients'])
+    admin = User.objects.filter(role='admin').first() or User.objects.create(
+        email='admin@bench.local', name='Bench Admin', role='admin', password='!'
+    )
+    start = timezone.now().replace(second=0, microsecond=0) + timedelta(days=1)
+    step = timedelta(minutes=30)
+    week = (7 * 24 * 60) // 30
+
+    if not Appointment.objects.exists():
+        out(f'Seeding {len(doctor_ids) * week:,} appointments and {rows:,} waitlist entries...')
+        seed_appointments(len(doctor_ids) * week, doctor_ids, patient_ids, start=start, step=step, out=out)
+        rng = random.Random(0)
+        for offset in range(0, rows, 20000):
+            entries = []
+            for i in range(offset, min(offset + 20000, rows)):
+                earliest = start + step * rng.randrange(week)
+                entries.append(WaitlistEntry(
+                    patient_id=patient_ids[i % len(patient_ids)],
+                    doctor_id=doctor_ids[i % len(doctor_ids)],
+                    earliest=earliest,
+                    latest=earliest + step * rng.randint(1, 48),
+                    auto_book=(i // len(doctor_ids)) % 2 == 0,
+                ))
+            WaitlistEntry.objects.bulk_create(entries, batch_size=20000)
+
+    doctor_id = doctor_ids[0]
+    ids = list(Appointment.objects.filter(
+        doctor_id=doctor_id, status__in=Appointment.ACTIVE_STATUSES
+    ).values_list('id', flat=True))
+    waiting = WaitlistEntry.objects.filter(doctor_id=doctor_id, status='waiting').count()
+
+    started = time.perf_counter()
+    moved, _ = transitions.bulk_transition(
+        Appointment.objects.all(), admin, ids, 'cancelled', backfill=False
+    )
+    cancelled = time.perf_counter() - started
+
+    slots = list(Appointment.objects.filter(id__in=moved).values_list('doctor_id', 'date_time', 'duration'))
+    started = time.perf_counter()
+    placed = matcher.backfill(slots)
+    elapsed = time.perf_counter() - started
+
+    booked = sum(1 for entry, _ in placed if entry.status == 'booked')
+    out(f'cancelled {len(moved):,} slots in {cancelled * 1000:.1f} ms ({waiting:,} entries waiting for the doctor)')
+    out(f'backfill  {elapsed * 1000:>10.1f} ms')
+    out(f'booked    {booked:>10,}')
+    out(f'offered   {len(placed) - booked:>10,}')
+
+
+@scenario('overlap')
+def overlap(options, out):
+    """Time the interval-overlap conflict check against --rows appointments (e.g. 1,000,000)"""
+    from . import availability
+
+    rows = options['rows']
+    doctor_ids = seed_users('doctor', options['doctors'])
+    patient_ids = seed_users('patient', options['patients'])
+    start = timezone.now().replace(second=0, microsecond=0) - timedelta(days=180)
+    step = timedelta(minutes=30)
+    if not Appointment.objects.exists():
+        out(f'Seeding {rows:,} appointments...')
+        seed_appointments(rows, doctor_ids, patient_ids, start=start, step=step, out=out)
+
+    per_doctor = rows // len(doctor_ids)
+    rng = random.Random(0)
+    probes = [
+        (rng.choice(doctor_ids), start + step * rng.randrange(per_doctor) + timedelta(minutes=rng.choice((0, 15))))
+        for _ in range(options['attempts'] * 20)
+    ]
+
+    def check(doctor_id, probe):
+        end = probe + timedelta(minutes=45)
+        return availability.collides(availability.nearby_intervals([(doctor_id, probe, end)])[doctor_id], probe, end)
+
+    elapsed, _ = timed(lambda: [check(doctor_id, probe) for doctor_id, probe in probes])
+    conflicts = sum(check(doctor_id, probe) for doctor_id, probe in probes)
+    connection.queries_log.clear()  # Full after the timed loop when DEBUG is on
+    with CaptureQueriesContext(connection) as queries:
+        check(*probes[0])
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + queries[0]['sql'])
+        plan = ' '.join(row[-1] for row in cursor.fetchall())
+    out(f'rows={Appointment.objects.count():,} doctors={len(doctor_ids)} (~{per_doctor:,} each)')
+    out(f'overlap check {elapsed * 1000 / len(probes):>8.1f} us/lookup ({conflicts}/{len(probes)} probes conflict)')
+    out(f'plan          {plan}')
+
+
+@scenario('schedule')
+def schedule_bitmaps(options, out):
+    """Build --doctors free-time bitmaps over the horizon and time slot lookups on them"""
+    import sys
+    from . import schedule
+
+    doctor_ids = seed_users('doctor', options['doctors'])
+    patient_ids = seed_users('patient', options['patients'])
+    days = settings.SCHEDULE_HORIZON_DAYS
+    first = clinic_today()
+    start = timezone.now().replace(minute=0, second=0, microsecond=0)
+    if not Appointment.objects.exists():
+        rows = options['rows']
+        out(f'Seeding {rows:,} appointments...')
+        # Spread each doctor's share evenly over the horizon
+        step = timedelta(days=days) * len(doctor_ids) / rows
+        seed_appointments(rows, doctor_ids, patient_ids, start=start, step=step, out=out)
+        # Half the doctors also work Saturday mornings
+        weekly = {weekday: schedule.encode(hours) for weekday, hours in settings.CLINIC_WORKING_HOURS.items()}
+        weekly[5] = schedule.encode([('09:00', '13:00')])
+        for doctor_id in doctor_ids[::2]:
+            schedule.save_hours(doctor_id, weekly)
+
+    connection.queries_log.clear()  # Full after seeding when DEBUG is on
+    with CaptureQueriesContext(connection) as queries:
+        build, free = timed(lambda: schedule.free_time(doctor_ids, first, days), repeat=3)
+    footprint = sum(sys.getsizeof(doctor.bits) for doctor in free.values())
+
+    rng = random.Random(0)
+    probes = [
+        (free[rng.choice(doctor_ids)], start + timedelta(minutes=15 * rng.randrange(days * 96)))
+        for _ in range(options['attempts'] * 200)
+    ]
+    check, _ = timed(lambda: [doctor.is_free(probe, probe + timedelta(minutes=30)) for doctor, probe in probes])
+    scan, _ = timed(lambda: [doctor.next_free(probe, 30, count=5) for doctor, probe in probes])
+    out(f'doctors={len(doctor_ids)} days={days} rows={Appointment.objects.count():,}')
+    out(f'build      {build:>10.1f} ms for all doctors ({len(queries) // 3} queries each run)')
+    out(f'memory     {footprint / 1024:>10.1f} KB ({footprint / len(doctor_ids):.0f} B/doctor)')
+    out(f'is_free    {check * 1000 / len(probes):>10.1f} us/lookup')
+    out(f'next 5 free{scan * 1000 / len(probes):>10.1f} us/lookup')
+
+
+@scenario('earliest')
+def earliest(options, out):
+    """Search the earliest free slots of a specialty in a --doctors hospital whose next week is 90% booked"""
+    from . import availability, schedule
+    from .models import DoctorProfile
+    from .views import DoctorViewSet
+
+    doctor_ids = seed_users('doctor', options['doctors'])
+    patient_ids = seed_users('patient', options['patients'])
+    specialties = ['cardiology', 'dermatology', 'neurology', 'paediatrics', 'general practice']
+    if not DoctorProfile.objects.exists():
+        DoctorProfile.objects.bulk_create([
+            DoctorProfile(user_id=doctor_id, specialty=specialties[i % len(specialties)])
+            for i, doctor_id in enumerate(doctor_ids)
+        ])
+    first = clinic_today() + timedelta(days=1)
+    if not Appointment.objects.exists():
+        out('Seeding a 90% booked week...')
+        rng = random.Random(0)
+        appointments = []
+        for doctor_id in doctor_ids:
+            windows = schedule.working_windows(doctor_id, [first + timedelta(days=n) for n in range(7)])
+            for day_windows in windows.values():
+                for slot, _ in availability.split_slots(day_windows, day_windows, availability.slot_length()):
+                    if rng.random() < 0.9:
+                        appointments.append(Appointment(
+                            doctor_id=doctor_id, patient_id=rng.choice(patient_ids), date_time=slot,
+                        ))
+        Appointment.objects.bulk_create(appointments, batch_size=20000)
+
+    view = DoctorViewSet.as_view({'get': 'earliest'})
+    factory = APIRequestFactory()
+    patient = User.objects.get(id=patient_ids[0])
+    after = clinic_datetime(first, wall_time(8))
+
+    def search(specialty, count):
+        request = factory.get('/api/doctors/earliest/', {
+            'specialty': specialty, 'count': count, 'after': after.isoformat(),
+        })
+        force_authenticate(request, user=patient)
+        response = view(request)
+        response.render()
+        return response.data
+
+    out(f'doctors={len(doctor_ids)} ({len(doctor_ids) // len(specialties)} per specialty) '
+        f'rows={Appointment.objects.count():,}')
+    out(f'{"count":>6} {"median ms":>10} {"queries":>8}')
+    for count in (1, 5, 20, 50):
+        connection.queries_log.clear()
+        with CaptureQueriesContext(connection) as queries:
+            search(specialties[0], count)
+        elapsed, data = timed(lambda: search(specialties[0], count))
+        out(f'{count:>6} {elapsed:>10.2f} {len(queries):>8}')
+    elapsed, slots = timed(lambda: schedule.earliest(doctor_ids, after, 30, 20, 31))
+    out(f'all {len(doctor_ids)} doctors, 20 slots: {elapsed:.2f} ms')
+
+
+@scenario('reschedule')
+def bulk_reschedule(options, out):
+    """Clear a fully booked doctor's next two weeks in one request, against one PUT per appointment"""
+    from django.db import transaction
+    from . import availability, reschedule, schedule
+    from .models import DoctorProfile
+    from .serializers import AppointmentSerializer
+    from .views import DoctorViewSet
+
+    doctor_ids = seed_users('doctor', options['doctors'])
+    patient_ids = seed_users('patient', options['patients'])
+    admin = User.objects.filter(role='admin').first() or User.objects.create(
+        email='admin@bench.local', name='Bench Admin', role='admin', password='!'
+    )
+    specialties = ['cardiology', 'dermatology', 'neurology', 'paediatrics', 'general practice']
+    if not DoctorProfile.objects.exists():
+        DoctorProfile.objects.bulk_create([
+            DoctorProfile(user_id=doctor_id, specialty=specialties[i % len(specialties)])
+            for i, doctor_id in enumerate(doctor_ids)
+        ])
+    first = clinic_today() + timedelta(days=1)
+    last = first + timedelta(days=13)
+    leaving = doctor_ids[0]
+    if not Appointment.objects.exists():
+        out('Seeding two weeks, the leaving doctor fully booked and colleagues 70%...')
+        rng = random.Random(0)
+        appointments = []
+        for doctor_id in doctor_ids[::len(specialties)]:
+            windows = schedule.working_windows(doctor_id, [first + timedelta(days=n) for n in range(14)])
+            for day_windows in windows.values():
+                for slot, _ in availability.split_slots(day_windows, day_windows, availability.slot_length()):
+                    if doctor_id == leaving or rng.random() < 0.7:
+                        appointments.append(Appointment(
+                            doctor_id=doctor_id, patient_id=rng.choice(patient_ids), date_time=slot,
+                        ))
+        Appointment.objects.bulk_create(appointments, batch_size=20000)
+
+    view = DoctorViewSet.as_view({'post': 'reschedule'})
+    factory = APIRequestFactory()
+
+    def post(mode, dry_run):
+        request = factory.post(f'/api/doctors/{leaving}/reschedule/', {
+            'start_date': first.isoformat(), 'end_date': last.isoformat(), 'mode': mode, 'dry_run': dry_run,
+        }, format='json')
+        force_authenticate(request, user=admin)
+        response = view(request, pk=leaving)
+        response.render()
+        return response.data
+
+    def rolled_back(func):
+        with transaction.atomic():
+            result = func()
+            transaction.set_rollback(True)
+        return result
+
+    def put_each(moves):
+        # What staff do today: one serializer round trip per appointment
+        for move in moves:
+            serializer = AppointmentSerializer(move.appointment, data={
+                'patient_id': move.appointment.patient_id, 'doctor_id': move.doctor_id,
+                'date_time': move.date_time.isoformat(),
+            }, partial=True)
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+
+    colleagues = DoctorProfile.objects.filter(specialty=specialties[0]).exclude(user_id=leaving).count()
+    out(f'doctors={len(doctor_ids)} ({colleagues} colleagues) rows={Appointment.objects.count():,} '
+        f'leaving doctor has {Appointment.objects.filter(doctor_id=leaving).count()} in {first} to {last}')
+    out(f'{"mode":>9} {"moved":>6} {"unplaced":>8} {"dry-run ms":>10} {"queries":>8} '
+        f'{"apply ms":>9} {"queries":>8} {"PUTs ms":>8} {"queries":>8}')
+    for mode in ('shift', 'reassign'):
+        connection.queries_log.clear()
+        with CaptureQueriesContext(connection) as planned:
+            data = post(mode, True)
+        dry, _ = timed(lambda: post(mode, True), repeat=3)
+        connection.queries_log.clear()
+        with CaptureQueriesContext(connection) as applied:
+            apply, _ = timed(lambda: rolled_back(lambda: post(mode, False)), repeat=1)
+
+        colleague_ids = None
+        if mode == 'reassign':
+            colleague_ids = DoctorProfile.objects.filter(specialty=specialties[0]).exclude(
+                user_id=leaving
+            ).values_list('user_id', flat=True)
+        moves, _ = reschedule.plan(leaving, first, last, colleague_ids)
+        connection.queries_log.clear()
+        with CaptureQueriesContext(connection) as puts:
+            each, _ = timed(lambda: rolled_back(lambda: put_each(moves)), repeat=1)
+        out(f'{mode:>9} {data["moved"]:>6} {len(data["unplaced"]):>8} {dry:>10.1f} {len(planned):>8} '
+            f'{apply:>9.1f} {len(applied):>8} {each:>8.1f} {len(puts):>8}')
+
+
+@scenario('calendar')
+def month_calendar(options, out):
+    """Compare a month's per-day counts with shipping the month's appointments to the client"""
+    from rest_framework.renderers import JSONRenderer
+    from . import monthly
+    from .serializers import AppointmentListSerializer
+    from .views import AppointmentViewSet
+
+    doctor_ids = seed_users('doctor', options['doctors'])
+    patient_ids = seed_users('patient', options['patients'])
+    admin = User.objects.filter(role='admin').first() or User.objects.create(
+        email='admin@bench.local', name='Bench Admin', role='admin', password='!'
+    )
+    month = monthly.month_of(clinic_today())
+    if not Appointment.objects.exists():
+        rows = options['rows']
+        out(f'Seeding {rows:,} appointments...')
+        # Spread each doctor's share over three months, a quarter of them cancelled
+        start = clinic_datetime(month - timedelta(days=31), wall_time(0))
+        step = timedelta(days=92) * len(doctor_ids) / rows
+        seed_appointments(rows, doctor_ids, patient_ids, start=start, step=step, out=out)
+        Appointment.objects.filter(patient_id__in=patient_ids[::4]).update(status='cancelled')
+
+    view = AppointmentViewSet.as_view({'get': 'calendar'})
+    factory = APIRequestFactory()
+
+    def fetch(user, params):
+        request = factory.get('/api/appointments/calendar/', params)
+        force_authenticate(request, user=user)
+        response = view(request)
+        response.render()
+        return response.content
+
+    def ship(queryset):
+        return JSONRenderer().render(AppointmentListSerializer(queryset, many=True).data)
+
+    doctor = User.objects.get(id=doctor_ids[0])
+    scopes = [
+        ('clinic', admin, {}, Appointment.objects.all()),
+        ('doctor', doctor, {}, Appointment.objects.filter(doctor=doctor)),
+    ]
+    out(f'doctors={len(doctor_ids)} rows={Appointment.objects.count():,} month={month:%Y-%m}')
+    out(f'{"scope":>8} {"rows":>9} {"rows ms":>9} {"rows KB":>9} {"cold ms":>8} {"warm ms":>8} {"bytes":>6}')
+    for name, user, params, appointments in scopes:
+        in_month = appointments.select_related('patient', 'doctor').filter(
+            **day_range_filter(month, monthly.last_day(month))
+        )
+        rows_ms, payload = timed(lambda: ship(in_month), repeat=1)
+        cold = []
+        for _ in range(3):
+            monthly.invalidate([(doctor.id, clinic_datetime(month, wall_time(12)))])
+            cold.append(timed(lambda: fetch(user, params), repeat=1)[0])
+        warm, content = timed(lambda: fetch(user, params))
+        out(f'{name:>8} {in_month.count():>9,} {rows_ms:>9.0f} {len(payload) / 1024:>9.0f} '
+            f'{statistics.median(cold):>8.2f} {warm:>8.2f} {len(content):>6}')
+
+
+@scenario('agenda')
+def agenda(options, out):
+    """Time cold and warm reads of doctors' daily agendas"""
+    from . import agenda as agendas
+
+    doctor_ids = seed_users('doctor', options['doctors'])
+    patient_ids = seed_users('patient', options['patients'])
+    start = timezone.now().replace(second=0, microsecond=0) + timedelta(hours=1)
+    if not Appointment.objects.exists():
+        out(f'Seeding {options["rows"]:,} appointments...')
+        seed_appointments(options['rows'], doctor_ids, patient_ids, start=start, step=timedelta(minutes=30), out=out)
+
+    day = clinic_today() + timedelta(days=1)
+    agendas.clear()
+    cold, _ = timed(lambda: [agendas.get(doctor_id, day) for doctor_id in doctor_ids], repeat=1)
+    warm, _ = timed(lambda: [agendas.get(doctor_id, day) for doctor_id in doctor_ids])
+    out(f'doctors={len(doctor_ids)} rows={Appointment.objects.count():,}')
+    out(f'cold read {cold * 1000 / len(doctor_ids):>8.1f} us/agenda')
+    out(f'warm read {warm * 1000 / len(doctor_ids):>8.1f} us/agenda')
+    out(f'counters  {agendas.agendas.stats()}')
+
+
+@scenario('live')
+def live_fanout(options, out):
+    """Hold --threads x 100 idle SSE streams on one loop and time fan-out of status changes"""
+    import asyncio
+    from . import live
+
+    connections = options['threads'] * 100
+    events = options['attempts']
+
+    async def run():
+        streams = [live.stream([live.CLINIC_TOPIC]) for _ in range(connections)]
+        for frames in streams:
+            await anext(frames)  # Subscribes and yields the retry preamble
+        # Park every stream on its queue, as idle connections are
+        readers = [asyncio.ensure_future(anext(frames)) for frames in streams]
+        await asyncio.sleep(0.1)
+
+        idle_cpu = time.process_time()
+        await asyncio.sleep(2)
+        idle_cpu = time.process_time() - idle_cpu
+
+        latencies = []
+        for i in range(events):
+            started = time.perf_counter()
+            await asyncio.to_thread(live.broker.publish, 'appointment', {'id': i, 'status': 'confirmed'},
+                                    [live.CLINIC_TOPIC])
+            await asyncio.gather(*readers)
+            latencies.append((time.perf_counter() - started) * 1000)
+            readers = [asyncio.ensure_future(anext(frames)) for frames in streams]
+
+        for reader in readers:
+            reader.cancel()
+        await asyncio.gather(*readers, return_exceptions=True)
+        return idle_cpu, latencies
+
+    idle_cpu, latencies = asyncio.run(run())
+    out(f'connections={connections:,} events={events}')
+    out(f'idle cpu         {idle_cpu * 1000:.1f} ms over 2 s')
+    out(f'fan-out median   {statistics.median(latencies):.2f} ms until every connection has the event')
+    out(f'subscribers left {live.broker.subscriber_count()}')
+
+
+@scenario('triage')
+def triage_queue(options, out):
+    """Fill the walk-in queue with --slots x 10 people and time each queue operation"""
+    from . import triage
+
+    waiting = options['slots'] * 10
+    doctor = User.objects.get(id=seed_users('doctor', 1)[0])
+    rng = random.Random(0)
+    triage.queue.reset()
+
+    def arrive():
+        return triage.enqueue(name='walk-in', priority=rng.randint(1, 5))
+
+    elapsed, _ = timed(lambda: [arrive() for _ in range(waiting)], repeat=1)
+    ids = list(triage.queue.entries)
+    out(f'waiting={len(triage.queue):,}')
+    out(f'enqueue       {elapsed / waiting:>8.3f} ms/op')
+
+    elapsed, _ = timed(lambda: [triage.reprioritize(rng.choice(ids), rng.randint(1, 5)) for _ in range(100)], repeat=1)
+    out(f'reprioritize  {elapsed / 100:>8.3f} ms/op')
+
+    elapsed, _ = timed(lambda: [triage.call_next(doctor) for _ in range(100)], repeat=1)
+    out(f'call next     {elapsed / 100:>8.3f} ms/op')
+
+    rebuild, _ = timed(lambda: (triage.queue.reset(), triage.queue.sync()))
+    out(f'restart       {rebuild:>8.3f} ms (rebuild {len(triage.queue):,} waiting from the database)')
+
+
+@scenario('reminders')
+def reminders(options, out):
+    """Spread --rows appointments over the next day and time one reminder run end to end"""
+    import os
+    import tempfile
+    from django.test import override_settings
+    from . import reminders as engine
+
+    rows = options['rows']
+    doctor_ids = seed_users('doctor', options['doctors'])
+    patient_ids = seed_users('patient', options['patients'])
+    now = timezone.now().replace(second=0, microsecond=0)
+    if not Appointment.objects.exists():
+        out(f'Seeding {rows:,} appointments...')
+        step = timedelta(days=1) * len(doctor_ids) / rows
+        seed_appointments(rows, doctor_ids, patient_ids, start=now + timedelta(minutes=1), step=step, out=out)
+
+    with tempfile.TemporaryDirectory() as directory, \
+            override_settings(REMINDER_OUTBOX=os.path.join(directory, 'outbox.jsonl')):
+        scan, due = timed(lambda: sum(len(batch) for batch in engine.due_batches(0, 24 * 60, now, 1000)))
+        elapsed, totals = timed(lambda: engine.send_due(now, engine.FileTransport()), repeat=1)
+        idle, _ = timed(lambda: engine.send_due(now, engine.FileTransport()))
+        written = sum(1 for _ in open(settings.REMINDER_OUTBOX))
+
+    out(f'rows={Appointment.objects.count():,} due within a day={due:,}')
+    out(f'due scan  {scan:>10.1f} ms')
+    out(f'send run  {elapsed:>10.1f} ms ({totals["sent"] / elapsed * 1000:,.0f} reminders/s, {written:,} written)')
+    out(f'idle run  {idle:>10.1f} ms (nothing left to send)')
+
+
+@scenario('noshow')
+def no_show_scoring(options, out):
+    """Fit the no-show model on a year of --rows past visits and score --rows upcoming appointments"""
+    from django.db.models import Q
+    from django.db.models.functions import Mod
+    from . import noshow
+    from .models import NoShowScore
+
+    rows = options['rows']
+    doctor_ids = seed_users('doctor', options['doctors'])
+    patient_ids = seed_users('patient', options['patients'])
+    now = timezone.now().replace(second=0, microsecond=0)
+    if not Appointment.objects.exists():
+        out(f'Seeding {rows:,} past and {rows:,} upcoming appointments...')
+        year = timedelta(days=365)
+        seed_appointments(rows, doctor_ids, patient_ids, start=now - year, step=year * len(doctor_ids) / rows,
+                          status='completed', out=out)
+        # One patient in five misses three visits in seven, everyone else one in nineteen; one in eleven cancels.
+        # The moduli are coprime with the default patient count, so each patient's visits cycle through them
+        past = Appointment.objects.filter(date_time__lte=now).annotate(
+            patient_mod=Mod('patient_id', 5), sevenths=Mod('id', 7), nineteenths=Mod('id', 19), elevenths=Mod('id', 11)
+        )
+        past.filter(Q(patient_mod=0, sevenths__lt=3) | (~Q(patient_mod=0) & Q(nineteenths=0))).update(status='no_show')
+        past.filter(elevenths=0).update(status='cancelled')
+        seed_appointments(rows, doctor_ids, patient_ids, start=now + timedelta(minutes=1),
+                          step=timedelta(days=90) * len(doctor_ids) / rows, out=out)
+
+    fetch, past = timed(lambda: noshow.past_rows(now), repeat=1)
+    fit, model = timed(lambda: noshow.train(past, now), repeat=1)
+
+    def score():
+        ids, patients, at, created = noshow.upcoming_rows(now)
+        numeric, weekday, hour = noshow.features(at, created, noshow.total_records(past[0], past[3], patients))
+        return ids, patients, noshow.sigmoid(noshow.logits(model.parameters, numeric, weekday, hour))
+
+    scoring, (ids, patients, risks) = timed(score, repeat=1)
+    write, _ = timed(lambda: noshow.write_scores(ids, risks, now), repeat=1)
+    rewrite, _ = timed(lambda: noshow.write_scores(ids, risks, now + timedelta(seconds=1)), repeat=1)
+    total, result = timed(lambda: noshow.run(now=now + timedelta(seconds=2)), repeat=1)
+
+    flaky = patients % 5 == 0
+    out(f'past={len(past[0]):,} samples={model.samples:,} no-show rate={model.no_show_rate:.1%} '
+        f'log loss={model.log_loss:.3f} upcoming={len(ids):,}')
+    out(f'mean risk: flaky patients {risks[flaky].mean():.3f}, others {risks[~flaky].mean():.3f}')
+    out(f'fetch past   {fetch:>10.1f} ms')
+    out(f'fit          {fit:>10.1f} ms')
+    out(f'score        {scoring:>10.1f} ms')
+    out(f'write        {write:>10.1f} ms (insert)')
+    out(f'rewrite      {rewrite:>10.1f} ms (upsert)')
+    out(f'full run     {total:>10.1f} ms ({result["scored"]:,} scored, '
+        f'{NoShowScore.objects.count():,} scores stored)')
@@ -0,0 +1,164 @@
+"""
+Race-free appointment booking.
+
+A slot is claimed by the insert itself: the database's uniqueness rule on
+(doctor, date_time) decides which of several concurrent requests wins, so
+there is no read-then-write window. Appointments that overlap without
+starting together are looked for right after the write, in the same
+transaction: SQLite holds its write lock from the write until commit, so a
+competing booking has either committed already (and is seen) or waits for
+this one and sees it in turn. Losers get a 409 with the doctor's next free
+slots instead of a 500 from the unhandled ``IntegrityError``.
+
+Batches are planned with set-based queries and written with ``bulk_create``.
+"""
+from bisect import insort
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from authuser.models import User
+from . import availability, resources, series
+from .models import Appointment
+from .signals import appointments_changed, statuses_changed
+
+
+class SlotUnavailable(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'Doctor is already booked at this time'
+    default_code = 'slot_unavailable'
+
+
+def slot_unavailable(doctor_id, date_time):
+    next_slots = availability.next_free_slots(doctor_id, date_time)
+    return SlotUnavailable({
+        'error': SlotUnavailable.default_detail,
+        'next_available': [
+            {'start': start.isoformat(), 'end': end.isoformat()} for start, end in next_slots
+        ],
+    })
+
+
+def interval(date_time, duration=None):
+    return date_time, date_time + timedelta(minutes=duration or settings.APPOINTMENT_SLOT_MINUTES)
+
+
+def window(appointment):
+    return (appointment.doctor_id, *interval(appointment.date_time, appointment.duration))
+
+
+def check_written(windows):
+    """
+    Raise ``IntegrityError`` if a just-written (doctor_id, start, end) window
+    overlaps another active appointment. An identical start is the unique
+    constraint's business (and is the written row itself), so only partial
+    overlaps are looked for.
+    """
+    windows = list(windows)
+    busy = availability.nearby_intervals(windows)
+    for doctor_id, start, end in windows:
+        if availability.collides(busy[doctor_id], start, end, ignore_start=start):
+            raise IntegrityError('Appointment overlaps another booking')
+
+
+@contextmanager
+def claiming_slot(doctor_id, date_time, duration=None):
+    """
+    Run the write in a savepoint and turn a lost slot race (or an overlap)
+    into ``SlotUnavailable``, and rooms or equipment another booking holds
+    into ``ResourceUnavailable``.
+
+    Slots held by virtual (not yet materialized) series occurrences are
+    refused up front, since no row exists yet for the database to collide with.
+    """
+    start, end = interval(date_time, duration)
+    if series.is_virtually_reserved(doctor_id, start, end):
+        raise slot_unavailable(doctor_id, date_time)
+    try:
+        with transaction.atomic():
+            yield
+            check_written([(doctor_id, start, end)])
+    except resources.ResourcesTaken as conflict:
+        raise resources.resource_unavailable(doctor_id, date_time, duration, conflict.resource_ids, conflict.taken)
+    except IntegrityError:
+        raise slot_unavailable(doctor_id, date_time)
+
+
+def plan_bulk_booking(items):
+    """
+    Check a batch of bookings with set-based queries.
+
+    ``items`` maps request index to validated fields. Patient and doctor ids
+    are checked with one query, and overlaps with existing active rows and
+    virtual series occurrences with one more each; overlaps inside the batch
+    are caught as planned items join the busy intervals, first item wins.
+    Returns ({index: error}, {index: unsaved Appointment}).
+    """
+    user_ids = {item['patient_id'] for item in items.values()} | {item['doctor_id'] for item in items.values()}
+    roles = dict(User.objects.filter(id__in=user_ids).values_list('id', 'role'))
+
+    windows = {index: window(Appointment(**item)) for index, item in items.items()}
+    busy = availability.nearby_intervals(windows.values())
+    for doctor_id, date_time, minutes in series.virtual_reservations(
+        busy.keys(), min(start for _, start, _ in windows.values()), max(end for _, _, end in windows.values())
+    ):
+        insort(busy[doctor_id], (date_time, date_time + timedelta(minutes=minutes)))
+
+    errors = {}
+    planned = {}
+    for index, item in sorted(items.items()):
+        doctor_id, start, end = windows[index]
+        if roles.get(item['patient_id']) != 'patient' or roles.get(item['doctor_id']) != 'doctor':
+            errors[index] = 'Invalid patient or doctor ID'
+        elif availability.collides(busy[doctor_id], start, end):
+            errors[index] = SlotUnavailable.default_detail
+        else:
+            insort(busy[doctor_id], (start, end))
+            planned[index] = Appointment(**item)
+    return errors, planned
+
+
+def commit_bulk_booking(planned, all_or_nothing=True):
+    """
+    Insert planned appointments with ``bulk_create``.
+
+    A concurrent booking can still win a slot after planning. In
+    all-or-nothing mode that aborts the batch with a 409; in best-effort mode
+    the batch falls back to claiming each slot in its own savepoint. Returns
+    ({index: Appointment}, {index: error}).
+    """
+    created, errors = {}, {}
+    try:
+        with transaction.atomic():
+            Appointment.objects.bulk_create(planned.values())
+            check_written(window(appointment) for appointment in planned.values())
+        created = planned
+        # The per-row fallback below announces itself through post_save
+        statuses_changed(
+            (appointment.id, appointment.doctor_id, appointment.date_time, appointment.status)
+            for appointment in created.values()
+        )
+    except IntegrityError:
+        if all_or_nothing:
+            raise SlotUnavailable({
+                'error': 'A slot in the batch was booked concurrently; nothing was created'
+            })
+        for index, appointment in planned.items():
+            # bulk_create may have set ids from the rolled-back insert
+            appointment.pk = None
+            appointment._state.adding = True
+            try:
+                with transaction.atomic():
+                    appointment.save(force_insert=True)
+                    check_written([window(appointment)])
+                created[index] = appointment
+            except IntegrityError:
+                appointment.pk = None
+                errors[index] = SlotUnavailable.default_detail
+
+    appointments_changed((appointment.doctor_id, appointment.date_time) for appointment in created.values())
+    return created, errors
@@ -0,0 +1,44 @@
+"""
+Clinic-local calendar helpers.
+
+Day-based filters are expressed as half-open [start, end) timestamp ranges
+computed in the clinic's timezone, never as ``date_time__date=`` lookups: a
+bare range compares the stored column directly, so it stays an index range
+scan, and the clinic's "today" is independent of the server's timezone.
+"""
+from datetime import datetime, time, timedelta
+from zoneinfo import ZoneInfo
+
+from django.conf import settings
+from django.utils import timezone
+
+
+def clinic_timezone():
+    return ZoneInfo(settings.CLINIC_TIME_ZONE)
+
+
+def clinic_today(now=None):
+    """Return the current date on the clinic's wall clock"""
+    return timezone.localdate(now or timezone.now(), clinic_timezone())
+
+
+def clinic_date(date_time):
+    """Return the clinic-local date of an aware datetime"""
+    return timezone.localdate(date_time, clinic_timezone())
+
+
+def clinic_datetime(day, at):
+    """Return the aware datetime for clinic wall-clock time ``at`` on ``day``"""
+    return timezone.make_aware(datetime.combine(day, at), clinic_timezone())
+
+
+def day_window(first, last=None):
+    """Return the half-open [start, end) range covering clinic days ``first`` to ``last``"""
+    last = last or first
+    return clinic_datetime(first, time.min), clinic_datetime(last + timedelta(days=1), time.min)
+
+
+def day_range_filter(first, last=None, field='date_time'):
+    """Return sargable filter kwargs selecting rows on clinic days ``first`` to ``last``"""
+    start, end = day_window(first, last)
+    return {f'{field}__gte': start, f'{field}__lt': end}
@@ -0,0 +1,145 @@
+"""
+iCalendar (RFC 5545) feed of a doctor's appointments.
+
+Calendar clients poll the feed URL, which carries a signed token instead of
+API credentials. The token names the doctor's feed version, so rotating the
+feed (``rotate_feed``) revokes every URL issued before. Each poll then
+answers a single aggregate over the covering
+(doctor, date_time, status, duration, updated_at) index: the feed's ETag is
+built from the row count and the latest ``updated_at`` in the window, so an
+unchanged schedule costs a primary-key lookup, one index-only query and a
+304. Changed feeds are streamed from a chunked iterator and never held in
+memory whole.
+"""
+from datetime import timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.signing import BadSignature, Signer
+from django.db.models import Count, F, Max
+from django.utils import timezone
+
+from .models import Appointment, CalendarFeed
+
+
+FEED_SALT = 'mainapp.ical.feed'
+
+EVENT_STATUS = {
+    'pending': 'TENTATIVE',
+    'confirmed': 'CONFIRMED',
+    'completed': 'CONFIRMED',
+    'cancelled': 'CANCELLED',
+    'no_show': 'CONFIRMED',
+}
+
+
+def feed_version(doctor_id):
+    """The doctor's current feed version"""
+    return CalendarFeed.objects.filter(doctor_id=doctor_id).values_list('version', flat=True).first() or 0
+
+
+def feed_token(doctor_id):
+    """Return the doctor's signed feed token for their current feed version"""
+    return Signer(salt=FEED_SALT).sign(f'{doctor_id}.{feed_version(doctor_id)}')
+
+
+def rotate_feed(doctor_id):
+    """Revoke every feed URL issued for the doctor; returns the new token"""
+    rotated = CalendarFeed.objects.filter(doctor_id=doctor_id).update(
+        version=F('version') + 1, rotated_at=timezone.now()
+    )
+    if not rotated:
+        CalendarFeed.objects.create(doctor_id=doctor_id, version=1)
+    return feed_token(doctor_id)
+
+
+def doctor_id_for_token(token):
+    """Return the doctor id a feed token was issued for, or None if it is forged or revoked"""
+    try:
+        # Tokens issued before feeds had versions name version 0
+        doctor_id, _, version = Signer(salt=FEED_SALT).unsign(token).partition('.')
+        doctor_id, version = int(doctor_id), int(version or 0)
+    except (BadSignature, ValueError):
+        return None
+    return doctor_id if version == feed_version(doctor_id) else None
+
+
+def feed_queryset(doctor_id, now=None):
+    """The doctor's appointments shown in the feed (recent past and all future)"""
+    since = (now or timezone.now()) - timedelta(days=settings.CALENDAR_FEED_PAST_DAYS)
+    return Appointment.objects.filter(doctor_id=doctor_id, date_time__gte=since)
+
+
+def feed_etag(doctor_id, now=None):
+    """
+    Fingerprint the feed with one index-only aggregate. The count catches
+    rows that were deleted or moved to another doctor, which leave no newer
+    ``updated_at`` behind.
+    """
+    state = feed_queryset(doctor_id, now).aggregate(count=Count('id'), latest=Max('updated_at'))
+    latest = state['latest'].timestamp() if state['latest'] else 0
+    return f'{doctor_id}-{state["count"]}-{latest:.6f}'
+
+
+def escape_text(value):
+    """Escape a TEXT property value"""
+    return (
+        value.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+        .replace('\r\n', '\\n').replace('\n', '\\n')
+    )
+
+
+def fold(line):
+    """Fold a content line into CRLF-terminated chunks of at most 75 octets"""
+    chunks = []
+    current, size, limit = [], 0, 75
+    for char in line:
+        width = len(char.encode('utf-8'))
+        if size + width > limit:
+            chunks.append(''.join(current))
+            # Continuation lines start with a space, which counts towards the limit
+            current, size, limit = [], 0, 74
+        current.append(char)
+        size += width
+    chunks.append(''.join(current))
+    return '\r\n '.join(chunks) + '\r\n'
+
+
+def format_utc(date_time):
+    return date_time.astimezone(dt_timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def render_event(appointment_id, date_time, duration, status, reason, notes, updated_at, patient_name):
+    """Render one VEVENT"""
+    lines = [
+        'BEGIN:VEVENT',
+        f'UID:appointment-{appointment_id}@ehr',
+        f'DTSTAMP:{format_utc(updated_at)}',
+        f'LAST-MODIFIED:{format_utc(updated_at)}',
+        f'DTSTART:{format_utc(date_time)}',
+        f'DTEND:{format_utc(date_time + timedelta(minutes=duration))}',
+        f'STATUS:{EVENT_STATUS.get(status, "TENTATIVE")}',
+        f'SUMMARY:{escape_text(f"Appointment with {patient_name}")}',
+    ]
+    description = '\n'.join(part for part in (reason, notes) if part)
+    if description:
+        lines.append(f'DESCRIPTION:{escape_text(description)}')
+    lines.append('END:VEVENT')
+    return ''.join(fold(line) for line in lines)
+
+
+def stream_feed(doctor_id, now=None):
+    """Yield the VCALENDAR document for the doctor, one event at a time"""
+    yield ''.join(fold(line) for line in (
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//EHR//Appointments//EN',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        'X-WR-CALNAME:Appointments',
+    ))
+    rows = feed_queryset(doctor_id, now).order_by('date_time', 'id').values_list(
+        'id', 'date_time', 'duration', 'status', 'reason', 'notes', 'updated_at', 'patient__name'
+    )
+    for row in rows.iterator(chunk_size=settings.CALENDAR_FEED_CHUNK_SIZE):
+        yield render_event(*row)
+    yield fold('END:VCALENDAR')
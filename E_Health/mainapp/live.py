@@ -0,0 +1,165 @@
+"""
+Live appointment status push (Server-Sent Events).
+
+An in-process broker fans status changes out to the SSE connections of this
+worker. A change is rendered to its SSE frame once, however many screens
+subscribe, and the same bytes object is handed to every subscriber queue:
+subscribers on one event loop get it through a single
+``call_soon_threadsafe`` hop from the (sync) writer's thread. An idle
+connection is a task parked on its queue, woken only by a change or the
+heartbeat, so a worker holds thousands of them for almost no CPU.
+
+Topics are ``clinic`` (every change) and ``doctor:<id>``. Publishing runs
+after the writing transaction commits, and costs nothing when nobody on the
+topics is listening.
+"""
+import asyncio
+import itertools
+import json
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.signing import BadSignature, SignatureExpired, TimestampSigner
+from django.db import transaction
+
+
+CLINIC_TOPIC = 'clinic'
+TOKEN_SALT = 'mainapp.live.stream'
+# How long EventSource waits before reconnecting a dropped stream
+RETRY_MILLISECONDS = 3000
+
+
+def doctor_topic(doctor_id):
+    return f'doctor:{doctor_id}'
+
+
+class Subscriber:
+    """One SSE connection's bounded queue of pending frames"""
+
+    def __init__(self, topics, loop, maxsize):
+        self.topics = topics
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize)
+
+    def offer(self, frame):
+        """Queue a frame; a subscriber too slow to keep up is disconnected"""
+        try:
+            self.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            # Its stream ends and the client reconnects and resyncs
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+
+class Broker:
+    """Topic-based fan-out from writer threads to subscriber event loops"""
+
+    def __init__(self, queue_size):
+        self.queue_size = queue_size
+        self.topics = defaultdict(set)
+        self.lock = threading.Lock()
+        self.sequence = itertools.count(1)
+
+    def subscribe(self, topics):
+        """Register the calling coroutine's connection for ``topics``"""
+        subscriber = Subscriber(tuple(topics), asyncio.get_running_loop(), self.queue_size)
+        with self.lock:
+            for topic in subscriber.topics:
+                self.topics[topic].add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            for topic in subscriber.topics:
+                self.topics[topic].discard(subscriber)
+                if not self.topics[topic]:
+                    del self.topics[topic]
+
+    def subscriber_count(self):
+        with self.lock:
+            return len(set().union(*self.topics.values()))
+
+    def publish(self, event, data, topics):
+        """Render one SSE frame and deliver it to every subscriber of ``topics``"""
+        with self.lock:
+            subscribers = set().union(*(self.topics.get(topic, ()) for topic in topics))
+        if not subscribers:
+            return 0
+
+        payload = json.dumps(data, cls=DjangoJSONEncoder, separators=(',', ':'))
+        frame = f'id: {next(self.sequence)}\nevent: {event}\ndata: {payload}\n\n'.encode()
+
+        by_loop = defaultdict(list)
+        for subscriber in subscribers:
+            by_loop[subscriber.loop].append(subscriber)
+        for loop, targets in by_loop.items():
+            try:
+                loop.call_soon_threadsafe(deliver, targets, frame)
+            except RuntimeError:
+                pass  # Loop already closed; its connections are gone
+        return len(subscribers)
+
+
+def deliver(subscribers, frame):
+    for subscriber in subscribers:
+        subscriber.offer(frame)
+
+
+broker = Broker(settings.LIVE_QUEUE_SIZE)
+
+
+def publish_status_changes(changes):
+    """
+    Push (id, doctor_id, date_time, status) changes once the current
+    transaction commits.
+    """
+    if not broker.topics:
+        return  # Nobody is listening in this process
+    changes = list(changes)
+    if changes:
+        transaction.on_commit(lambda: _publish(changes))
+
+
+def _publish(changes):
+    for appointment_id, doctor_id, date_time, status in changes:
+        broker.publish('appointment', {
+            'id': appointment_id,
+            'doctor_id': doctor_id,
+            'date_time': date_time,
+            'status': status,
+        }, [CLINIC_TOPIC, doctor_topic(doctor_id)])
+
+
+def stream_token(user_id):
+    """Short-lived token letting ``EventSource`` (which cannot send headers) connect"""
+    return TimestampSigner(salt=TOKEN_SALT).sign(str(user_id))
+
+
+def user_id_for_token(token):
+    """Return the user id a stream token was issued to, or None if forged or expired"""
+    try:
+        return int(TimestampSigner(salt=TOKEN_SALT).unsign(token, max_age=settings.LIVE_TOKEN_MAX_AGE))
+    except (BadSignature, SignatureExpired, ValueError):
+        return None
+
+
+async def stream(topics):
+    """Yield the SSE byte stream for ``topics`` until the client is dropped or disconnects"""
+    heartbeat = settings.LIVE_HEARTBEAT_SECONDS
+    subscriber = broker.subscribe(topics)
+    try:
+        yield f'retry: {RETRY_MILLISECONDS}\n\n'.encode()
+        while True:
+            try:
+                frame = await asyncio.wait_for(subscriber.queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield b': keep-alive\n\n'
+                continue
+            if frame is None:
+                return
+            yield frame
+    finally:
+        broker.unsubscribe(subscriber)
@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from mainapp.benchmarks import SCENARIOS
+
+
+class Command(BaseCommand):
+    help = 'Run a synthetic-load benchmark against a scratch database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', choices=sorted(SCENARIOS))
+        parser.add_argument('--rows', type=int, default=5_000_000,
+                            help='Number of appointments to seed')
+        parser.add_argument('--doctors', type=int, default=500)
+        parser.add_argument('--patients', type=int, default=5000)
+        parser.add_argument('--page-size', type=int, default=50)
+        parser.add_argument('--pages', type=int, default=10_000,
+                            help='Deepest page to walk to')
+        parser.add_argument('--threads', type=int, default=16,
+                            help='Concurrent clients for contention scenarios')
+        parser.add_argument('--attempts', type=int, default=50,
+                            help='Requests per client for contention scenarios')
+        parser.add_argument('--slots', type=int, default=40,
+                            help='Distinct slots clients compete for')
+        parser.add_argument('--database', default=str(settings.BASE_DIR / 'bench.sqlite3'),
+                            help='Scratch database file (recreated unless --keepdb)')
+        parser.add_argument('--keepdb', action='store_true',
+                            help='Reuse the scratch database and its seeded rows')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('The benchmark command only manages SQLite scratch databases')
+
+        setup_test_environment()
+        connection.settings_dict['TEST']['NAME'] = options['database']
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False, keepdb=options['keepdb']
+        )
+        try:
+            SCENARIOS[options['scenario']](options, self.stdout.write)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
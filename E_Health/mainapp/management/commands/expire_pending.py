@@ -0,0 +1,25 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from mainapp import sweeper
+
+
+class Command(BaseCommand):
+    help = 'Cancel pending appointments that are too old or whose time has passed (run e.g. hourly)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age-hours', type=float, default=None,
+                            help='Expire pending appointments created longer ago than this')
+        parser.add_argument('--chunk-size', type=int, default=None,
+                            help='Rows cancelled per UPDATE (and per transaction)')
+        parser.add_argument('--pause', type=float, default=0,
+                            help='Seconds to sleep between chunks, letting other writers in')
+
+    def handle(self, *args, **options):
+        max_age = timedelta(hours=options['max_age_hours']) if options['max_age_hours'] is not None else None
+        result = sweeper.sweep(max_age=max_age, chunk_size=options['chunk_size'], pause=options['pause'])
+        self.stdout.write(
+            f'Expired {result["expired"]} pending appointments in {result["chunks"]} chunks '
+            f'in {result["seconds"]:.2f}s'
+        )
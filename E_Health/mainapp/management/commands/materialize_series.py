@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import F, Q
+from django.utils import timezone
+
+from mainapp import series
+from mainapp.models import AppointmentSeries
+
+
+class Command(BaseCommand):
+    help = 'Materialize recurring appointment occurrences up to the rolling horizon'
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        now = timezone.now()
+        horizon = series.horizon_end(now)
+
+        # Series whose watermark is behind the horizon and that can still occur past it
+        due = AppointmentSeries.objects.filter(
+            Q(until__isnull=True) | Q(until__gt=F('materialized_until')),
+            active=True,
+            materialized_until__lt=horizon,
+        )
+
+        count = appointments = 0
+        for instance in due.iterator():
+            written, skipped = series.materialize(instance, until=horizon, now=now)
+            appointments += written
+            count += 1
+            for date_time in skipped:
+                self.stderr.write(f'Series {instance.id}: skipped {date_time.isoformat()}, the slot is taken')
+
+        self.stdout.write(
+            f'Materialized {count} series ({appointments} occurrences in window) '
+            f'up to {horizon.isoformat()} in {time.monotonic() - started:.2f}s'
+        )
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from mainapp import noshow
+from mainapp.models import NoShowModel
+
+
+class Command(BaseCommand):
+    help = 'Fit the no-show model on past appointments and score every upcoming one (run e.g. nightly)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--no-train', action='store_true',
+                            help='Score with the latest fitted model instead of fitting a new one')
+
+    def handle(self, *args, **options):
+        try:
+            result = noshow.run(retrain=not options['no_train'])
+        except ValueError as error:
+            raise CommandError(str(error))
+        except NoShowModel.DoesNotExist:
+            raise CommandError('No model has been fitted yet; run without --no-train first')
+
+        model = result['model']
+        self.stdout.write(
+            f'Model of {model.trained_at:%Y-%m-%d %H:%M}: {model.samples} samples, '
+            f'{model.no_show_rate:.1%} no-shows, log loss {model.log_loss:.3f}'
+        )
+        self.stdout.write(
+            f'Scored {result["scored"]} upcoming appointments ({result["dropped"]} stale scores dropped) '
+            f'in {result["seconds"]:.2f}s'
+        )
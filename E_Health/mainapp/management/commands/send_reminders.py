@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from mainapp import reminders
+
+
+class Command(BaseCommand):
+    help = 'Send the appointment reminders that are due (run every few minutes)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Appointments read and dispatched per batch')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Concurrent dispatch threads')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        now = timezone.now()
+        totals = reminders.send_due(now, batch_size=options['batch_size'], workers=options['workers'])
+        self.stdout.write(
+            f'Sent {totals["sent"]} reminders ({totals["failed"]} failed, retried next run; '
+            f'{totals["skipped"]} skipped, no email address) '
+            f'in {time.monotonic() - started:.2f}s'
+        )
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:44
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='appointment',
+            options={'ordering': ['-date_time', '-id'], 'verbose_name': 'Appointment', 'verbose_name_plural': 'Appointments'},
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['date_time', 'id'], name='appointment_datetime_id_idx'),
+        ),
+    ]
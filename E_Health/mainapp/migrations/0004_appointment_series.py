@@ -0,0 +1,62 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:58
+
+import django.core.validators
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0003_appointment_active_slot_constraint'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='occurrence',
+            field=models.PositiveIntegerField(blank=True, help_text='Zero-based position of this appointment within its series', null=True),
+        ),
+        migrations.CreateModel(
+            name='AppointmentSeries',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.DateTimeField(help_text='Date and time of the first occurrence')),
+                ('frequency', models.CharField(choices=[('daily', 'Daily'), ('weekly', 'Weekly')], default='weekly', help_text='Unit of the repeat interval', max_length=10)),
+                ('interval', models.PositiveIntegerField(default=1, help_text='Number of days or weeks between occurrences', validators=[django.core.validators.MinValueValidator(1)])),
+                ('count', models.PositiveIntegerField(blank=True, help_text='Total number of occurrences (open-ended if empty)', null=True, validators=[django.core.validators.MinValueValidator(1)])),
+                ('until', models.DateTimeField(blank=True, help_text='No occurrence is scheduled after this time (open-ended if empty)', null=True)),
+                ('reason', models.TextField(blank=True, help_text='Reason copied onto every occurrence')),
+                ('active', models.BooleanField(default=True, help_text='Whether the series still schedules new occurrences')),
+                ('materialized_until', models.DateTimeField(help_text='Occurrences before this time exist as Appointment rows')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('doctor', models.ForeignKey(help_text='Doctor the recurring appointments are with', limit_choices_to={'role': 'doctor'}, on_delete=django.db.models.deletion.CASCADE, related_name='doctor_appointment_series', to=settings.AUTH_USER_MODEL)),
+                ('patient', models.ForeignKey(help_text='Patient the recurring appointments are for', limit_choices_to={'role': 'patient'}, on_delete=django.db.models.deletion.CASCADE, related_name='patient_appointment_series', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Appointment Series',
+                'verbose_name_plural': 'Appointment Series',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='series',
+            field=models.ForeignKey(blank=True, help_text='Recurring series this appointment was materialized from', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='appointments', to='mainapp.appointmentseries'),
+        ),
+        migrations.AddConstraint(
+            model_name='appointment',
+            constraint=models.UniqueConstraint(fields=('series', 'occurrence'), name='unique_series_occurrence'),
+        ),
+        migrations.AddIndex(
+            model_name='appointmentseries',
+            index=models.Index(fields=['doctor', 'active', 'materialized_until'], name='series_doctor_horizon_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointmentseries',
+            index=models.Index(fields=['active', 'materialized_until'], name='series_horizon_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0004_appointment_series'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WaitlistEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('earliest', models.DateTimeField(help_text='Earliest acceptable appointment start')),
+                ('latest', models.DateTimeField(help_text='Latest acceptable appointment end')),
+                ('auto_book', models.BooleanField(default=False, help_text='Book a freed slot immediately instead of offering it')),
+                ('reason', models.TextField(blank=True, help_text='Reason for the appointment')),
+                ('status', models.CharField(choices=[('waiting', 'Waiting'), ('offered', 'Offered'), ('booked', 'Booked')], default='waiting', help_text='Current status of the waitlist entry', max_length=20)),
+                ('offered_slot', models.DateTimeField(blank=True, help_text='Start of the slot currently offered to the patient', null=True)),
+                ('offer_expires_at', models.DateTimeField(blank=True, help_text='When the current offer lapses and the entry waits again', null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('appointment', models.ForeignKey(blank=True, help_text='Appointment booked from this entry', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='waitlist_entries', to='mainapp.appointment')),
+                ('doctor', models.ForeignKey(help_text='Doctor the patient wants to see', limit_choices_to={'role': 'doctor'}, on_delete=django.db.models.deletion.CASCADE, related_name='doctor_waitlist_entries', to=settings.AUTH_USER_MODEL)),
+                ('patient', models.ForeignKey(help_text='Patient waiting for a slot', limit_choices_to={'role': 'patient'}, on_delete=django.db.models.deletion.CASCADE, related_name='waitlist_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Waitlist Entry',
+                'verbose_name_plural': 'Waitlist Entries',
+                'ordering': ['created_at', 'id'],
+                'indexes': [models.Index(condition=models.Q(('status', 'waiting')), fields=['doctor', 'earliest', 'latest'], name='waitlist_doctor_window_idx'), models.Index(condition=models.Q(('status', 'offered')), fields=['offer_expires_at'], name='waitlist_offer_expiry_idx')],
+            },
+        ),
+    ]
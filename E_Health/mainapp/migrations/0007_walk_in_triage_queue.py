@@ -0,0 +1,57 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:09
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0006_appointment_feed_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WalkIn',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='Name of the walk-in patient', max_length=255)),
+                ('complaint', models.TextField(blank=True, help_text='Presenting complaint noted at triage')),
+                ('priority', models.PositiveSmallIntegerField(choices=[(1, 'Immediate'), (2, 'Very urgent'), (3, 'Urgent'), (4, 'Standard'), (5, 'Non-urgent')], default=4, help_text='Triage priority (1 is most urgent)')),
+                ('status', models.CharField(choices=[('waiting', 'Waiting'), ('called', 'Called'), ('left', 'Left')], default='waiting', help_text='Current status in the queue', max_length=20)),
+                ('arrived_at', models.DateTimeField(default=django.utils.timezone.now, help_text='Arrival time; breaks ties within a priority')),
+                ('called_at', models.DateTimeField(blank=True, help_text='When a doctor called the patient', null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('doctor', models.ForeignKey(blank=True, help_text='Doctor who called the patient', limit_choices_to={'role': 'doctor'}, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='called_walk_ins', to=settings.AUTH_USER_MODEL)),
+                ('patient', models.ForeignKey(blank=True, help_text='Registered patient, if the walk-in has an account', limit_choices_to={'role': 'patient'}, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='walk_ins', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Walk-in',
+                'verbose_name_plural': 'Walk-ins',
+                'ordering': ['priority', 'arrived_at', 'id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='TriageEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('enqueue', 'Enqueue'), ('reprioritize', 'Reprioritize'), ('call', 'Call'), ('leave', 'Leave')], help_text='Queue operation', max_length=20)),
+                ('priority', models.PositiveSmallIntegerField(blank=True, help_text='Priority after the operation (enqueue and reprioritize)', null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('walk_in', models.ForeignKey(help_text='Walk-in the operation applies to', on_delete=django.db.models.deletion.CASCADE, related_name='events', to='mainapp.walkin')),
+            ],
+            options={
+                'verbose_name': 'Triage Event',
+                'verbose_name_plural': 'Triage Events',
+                'ordering': ['id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='walkin',
+            index=models.Index(condition=models.Q(('status', 'waiting')), fields=['priority', 'arrived_at', 'id'], name='walkin_queue_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:11
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0007_walk_in_triage_queue'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='reminders_sent',
+            field=models.PositiveSmallIntegerField(default=0, help_text='How many of the APPOINTMENT_REMINDER_MINUTES reminders have gone out'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(condition=models.Q(('status__in', ['pending', 'confirmed'])), fields=['reminders_sent', 'date_time'], name='appointment_reminder_due_idx'),
+        ),
+    ]
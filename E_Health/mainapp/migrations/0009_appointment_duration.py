@@ -0,0 +1,30 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:19
+
+import django.core.validators
+import mainapp.models
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0008_appointment_reminders'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='appointment',
+            name='appointment_doctor_slot_idx',
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='duration',
+            field=models.PositiveSmallIntegerField(default=mainapp.models.default_duration, help_text='Length of the appointment in minutes', validators=[django.core.validators.MinValueValidator(1)]),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['doctor', 'date_time', 'status', 'duration', 'updated_at'], name='appointment_doctor_slot_idx'),
+        ),
+    ]
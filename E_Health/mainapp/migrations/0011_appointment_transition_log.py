@@ -0,0 +1,48 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:32
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_status_changed_at(apps, schema_editor):
+    # The last write is the best record of when existing rows reached their status
+    Appointment = apps.get_model('mainapp', 'Appointment')
+    Appointment.objects.update(status_changed_at=F('updated_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0010_pending_sweep_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='status_changed_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, help_text='When the appointment entered its current status'),
+        ),
+        migrations.RunPython(backfill_status_changed_at, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='AppointmentTransition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('from_status', models.CharField(choices=[('pending', 'Pending'), ('confirmed', 'Confirmed'), ('completed', 'Completed'), ('cancelled', 'Cancelled')], help_text='Status before the change', max_length=20)),
+                ('to_status', models.CharField(choices=[('pending', 'Pending'), ('confirmed', 'Confirmed'), ('completed', 'Completed'), ('cancelled', 'Cancelled')], help_text='Status after the change', max_length=20)),
+                ('at', models.DateTimeField(help_text='When the change happened')),
+                ('elapsed', models.DurationField(help_text='Time the appointment spent in from_status')),
+                ('actor', models.ForeignKey(blank=True, help_text='User who made the change (empty for automatic changes)', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='appointment_transitions', to=settings.AUTH_USER_MODEL)),
+                ('appointment', models.ForeignKey(help_text='Appointment whose status changed', on_delete=django.db.models.deletion.CASCADE, related_name='transitions', to='mainapp.appointment')),
+            ],
+            options={
+                'verbose_name': 'Appointment Transition',
+                'verbose_name_plural': 'Appointment Transitions',
+                'ordering': ['at', 'id'],
+                'indexes': [models.Index(fields=['appointment', 'at'], name='transition_history_idx'), models.Index(fields=['at', 'from_status', 'to_status', 'elapsed'], name='transition_turnaround_idx')],
+            },
+        ),
+    ]
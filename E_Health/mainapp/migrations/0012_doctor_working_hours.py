@@ -0,0 +1,47 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0011_appointment_transition_log'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduleException',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(help_text='Clinic-local day the override applies to')),
+                ('slots', models.BinaryField(help_text='Working grid steps of that day, one bit each (little-endian)')),
+                ('reason', models.CharField(blank=True, help_text='Why the day differs (e.g. leave, public holiday)', max_length=200)),
+                ('doctor', models.ForeignKey(help_text='Doctor whose day is overridden', limit_choices_to={'role': 'doctor'}, on_delete=django.db.models.deletion.CASCADE, related_name='schedule_exceptions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Schedule Exception',
+                'verbose_name_plural': 'Schedule Exceptions',
+                'ordering': ['doctor_id', 'date'],
+                'constraints': [models.UniqueConstraint(fields=('doctor', 'date'), name='unique_doctor_exception_date')],
+            },
+        ),
+        migrations.CreateModel(
+            name='WorkingHours',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('weekday', models.PositiveSmallIntegerField(choices=[(0, 'Monday'), (1, 'Tuesday'), (2, 'Wednesday'), (3, 'Thursday'), (4, 'Friday'), (5, 'Saturday'), (6, 'Sunday')], help_text='Day of the week (Monday is 0)')),
+                ('slots', models.BinaryField(help_text='Working grid steps of the day, one bit each (little-endian)')),
+                ('doctor', models.ForeignKey(help_text='Doctor the template belongs to', limit_choices_to={'role': 'doctor'}, on_delete=django.db.models.deletion.CASCADE, related_name='working_hours', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Working Hours',
+                'verbose_name_plural': 'Working Hours',
+                'ordering': ['doctor_id', 'weekday'],
+                'constraints': [models.UniqueConstraint(fields=('doctor', 'weekday'), name='unique_doctor_weekday')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:44
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0012_doctor_working_hours'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DoctorProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('specialty', models.CharField(help_text='Medical specialty (e.g., cardiology), stored in lower case', max_length=100)),
+                ('facility', models.CharField(blank=True, help_text='Hospital, clinic or site the doctor sees patients at', max_length=200)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.OneToOneField(limit_choices_to={'role': 'doctor'}, on_delete=django.db.models.deletion.CASCADE, related_name='doctor_profile', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Doctor Profile',
+                'verbose_name_plural': 'Doctor Profiles',
+                'ordering': ['specialty', 'id'],
+                'indexes': [models.Index(fields=['specialty', 'facility', 'user'], name='doctor_specialty_idx')],
+            },
+        ),
+    ]
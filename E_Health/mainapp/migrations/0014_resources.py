@@ -0,0 +1,47 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0013_doctor_profile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Resource',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='Name shown to schedulers (e.g., Procedure room 2, Ultrasound A)', max_length=100, unique=True)),
+                ('kind', models.CharField(choices=[('room', 'Room'), ('equipment', 'Equipment')], help_text='Whether the resource is a room or equipment', max_length=20)),
+                ('active', models.BooleanField(default=True, help_text='Inactive resources cannot be reserved')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Resource',
+                'verbose_name_plural': 'Resources',
+                'ordering': ['kind', 'name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ResourceReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_time', models.DateTimeField(help_text='Start of the appointment (moved with it)')),
+                ('duration', models.PositiveSmallIntegerField(help_text='Length of the appointment in minutes (changed with it)')),
+                ('appointment', models.ForeignKey(help_text='Appointment the resource is needed for', on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='mainapp.appointment')),
+                ('resource', models.ForeignKey(help_text='Room or equipment held', on_delete=django.db.models.deletion.PROTECT, related_name='reservations', to='mainapp.resource')),
+            ],
+            options={
+                'verbose_name': 'Resource Reservation',
+                'verbose_name_plural': 'Resource Reservations',
+                'ordering': ['resource_id', 'date_time'],
+                'indexes': [models.Index(fields=['resource', 'date_time', 'duration', 'appointment'], name='reservation_resource_slot_idx')],
+                'constraints': [models.UniqueConstraint(fields=('appointment', 'resource'), name='unique_appointment_resource')],
+            },
+        ),
+    ]
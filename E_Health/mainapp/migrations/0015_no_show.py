@@ -0,0 +1,59 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0014_resources'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NoShowModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trained_at', models.DateTimeField(help_text='When the model was fitted')),
+                ('samples', models.PositiveIntegerField(help_text='Past appointments (completed or no-show) it was fitted on')),
+                ('no_show_rate', models.FloatField(help_text='Share of those samples that were no-shows')),
+                ('log_loss', models.FloatField(help_text='Mean log loss on the training samples')),
+                ('parameters', models.JSONField(help_text='Intercept, feature weights, and the means and scales of the numeric features')),
+            ],
+            options={
+                'verbose_name': 'No-show Model',
+                'verbose_name_plural': 'No-show Models',
+                'ordering': ['-trained_at', '-id'],
+                'get_latest_by': ['trained_at', 'id'],
+            },
+        ),
+        migrations.AlterField(
+            model_name='appointment',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('confirmed', 'Confirmed'), ('completed', 'Completed'), ('cancelled', 'Cancelled'), ('no_show', 'No-show')], default='pending', help_text='Current status of the appointment', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='appointmenttransition',
+            name='from_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('confirmed', 'Confirmed'), ('completed', 'Completed'), ('cancelled', 'Cancelled'), ('no_show', 'No-show')], help_text='Status before the change', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='appointmenttransition',
+            name='to_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('confirmed', 'Confirmed'), ('completed', 'Completed'), ('cancelled', 'Cancelled'), ('no_show', 'No-show')], help_text='Status after the change', max_length=20),
+        ),
+        migrations.CreateModel(
+            name='NoShowScore',
+            fields=[
+                ('appointment', models.OneToOneField(help_text='Scored appointment', on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='no_show_score', serialize=False, to='mainapp.appointment')),
+                ('risk', models.FloatField(help_text='Probability (0-1) that the patient does not turn up')),
+                ('scored_at', models.DateTimeField(help_text='When the scoring run that wrote this score started')),
+            ],
+            options={
+                'verbose_name': 'No-show Score',
+                'verbose_name_plural': 'No-show Scores',
+                'indexes': [models.Index(fields=['scored_at'], name='no_show_scored_at_idx')],
+            },
+        ),
+    ]
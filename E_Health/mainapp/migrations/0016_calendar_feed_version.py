@@ -0,0 +1,28 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:55
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authuser', '0002_alter_user_options_user_contact_info_user_role'),
+        ('mainapp', '0015_no_show'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CalendarFeed',
+            fields=[
+                ('doctor', models.OneToOneField(help_text='Doctor whose feed this is', limit_choices_to={'role': 'doctor'}, on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='calendar_feed', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('version', models.PositiveIntegerField(default=0, help_text='Only feed tokens issued for this version are accepted')),
+                ('rotated_at', models.DateTimeField(auto_now=True, help_text='When the feed URL was last rotated')),
+            ],
+            options={
+                'verbose_name': 'Calendar Feed',
+                'verbose_name_plural': 'Calendar Feeds',
+            },
+        ),
+    ]
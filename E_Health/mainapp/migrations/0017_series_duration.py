@@ -0,0 +1,20 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:58
+
+import django.core.validators
+import mainapp.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0016_calendar_feed_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointmentseries',
+            name='duration',
+            field=models.PositiveSmallIntegerField(default=mainapp.models.default_duration, help_text='Length of each occurrence in minutes', validators=[django.core.validators.MinValueValidator(1)]),
+        ),
+    ]
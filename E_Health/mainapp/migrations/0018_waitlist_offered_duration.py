@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 04:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0017_series_duration'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='waitlistentry',
+            name='offered_duration',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='Length in minutes of the slot currently offered to the patient', null=True),
+        ),
+    ]
@@ -1,8 +1,34 @@
+from datetime import timedelta
+
 from django.db import models
 from django.conf import settings
 from django.core.validators import MinValueValidator
+from django.db.models import BooleanField, Case, ExpressionWrapper, IntegerField, Q, When
+from django.db.models.functions import ExtractYear
 from django.utils import timezone
 
+from .clinic_time import clinic_today
+
+
+def default_duration():
+    return settings.APPOINTMENT_SLOT_MINUTES
+
+
+class AppointmentQuerySet(models.QuerySet):
+    def with_flags(self, now=None):
+        """
+        Annotate ``upcoming`` and ``cancellable``, the SQL twins of
+        ``is_upcoming()`` and ``can_be_cancelled()``, against a single ``now``,
+        so every row agrees on it and both can be filtered and ordered on
+        """
+        upcoming = Q(date_time__gt=now or timezone.now())
+        return self.annotate(
+            upcoming=ExpressionWrapper(upcoming, output_field=BooleanField()),
+            cancellable=ExpressionWrapper(
+                upcoming & Q(status__in=self.model.ACTIVE_STATUSES), output_field=BooleanField()
+            ),
+        )
+
 
 class Appointment(models.Model):
     """
@@ -13,8 +39,25 @@ class Appointment(models.Model):
         ('confirmed', 'Confirmed'),
         ('completed', 'Completed'),
         ('cancelled', 'Cancelled'),
+        ('no_show', 'No-show'),
     ]
     
+    # Statuses that hold the doctor's time slot
+    ACTIVE_STATUSES = ['pending', 'confirmed']
+    
+    # State machine: target status -> statuses it may be reached from
+    STATUS_TRANSITIONS = {
+        'confirmed': ('pending',),
+        'completed': ('confirmed',),
+        'cancelled': ('pending', 'confirmed'),
+        'no_show': ('confirmed',),
+    }
+    
+    # Annotations added by AppointmentQuerySet.with_flags()
+    FLAG_ANNOTATIONS = ('upcoming', 'cancellable')
+    
+    objects = AppointmentQuerySet.as_manager()
+    
     # Relationships
     patient = models.ForeignKey(
         settings.AUTH_USER_MODEL,
@@ -37,6 +80,12 @@ class Appointment(models.Model):
         help_text='Date and time of the appointment'
     )
     
+    duration = models.PositiveSmallIntegerField(
+        default=default_duration,
+        validators=[MinValueValidator(1)],
+        help_text='Length of the appointment in minutes'
+    )
+    
     status = models.CharField(
         max_length=20,
         choices=STATUS_CHOICES,
@@ -44,6 +93,11 @@ class Appointment(models.Model):
         help_text='Current status of the appointment'
     )
     
+    status_changed_at = models.DateTimeField(
+        default=timezone.now,
+        help_text='When the appointment entered its current status'
+    )
+    
     # Additional information
     reason = models.TextField(
         blank=True,
@@ -55,20 +109,104 @@ class Appointment(models.Model):
         help_text='Additional notes about the appointment'
     )
     
+    # Recurrence
+    series = models.ForeignKey(
+        'AppointmentSeries',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='appointments',
+        help_text='Recurring series this appointment was materialized from'
+    )
+    
+    occurrence = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text='Zero-based position of this appointment within its series'
+    )
+    
+    # Reminders
+    reminders_sent = models.PositiveSmallIntegerField(
+        default=0,
+        help_text='How many of the APPOINTMENT_REMINDER_MINUTES reminders have gone out'
+    )
+    
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
-        ordering = ['-date_time']
+        # The id tiebreaker makes the ordering a unique key for cursor pagination
+        ordering = ['-date_time', '-id']
         verbose_name = 'Appointment'
         verbose_name_plural = 'Appointments'
-        # Ensure no double-booking for the same doctor at the same time
-        unique_together = ['doctor', 'date_time']
+        constraints = [
+            # Ensure no double-booking for the same doctor at the same time;
+            # cancelled and completed appointments release the slot
+            models.UniqueConstraint(
+                fields=['doctor', 'date_time'],
+                condition=models.Q(status__in=['pending', 'confirmed']),
+                name='unique_active_doctor_slot',
+            ),
+            # Each occurrence of a series is materialized at most once
+            models.UniqueConstraint(
+                fields=['series', 'occurrence'],
+                name='unique_series_occurrence',
+            ),
+        ]
+        indexes = [
+            # Serves keyset pages over the unfiltered (admin) list
+            models.Index(fields=['date_time', 'id'], name='appointment_datetime_id_idx'),
+            # Per-user agenda and overlap lookups (user + date_time range, status
+            # and duration read from the index without touching the table);
+            # updated_at makes the calendar feed's ETag aggregate index-only too
+            models.Index(
+                fields=['doctor', 'date_time', 'status', 'duration', 'updated_at'],
+                name='appointment_doctor_slot_idx',
+            ),
+            models.Index(fields=['patient', 'date_time', 'status'], name='appointment_patient_slot_idx'),
+            # Stale pending sweep: pending rows whose time passed, or that are too old
+            models.Index(fields=['status', 'date_time'], name='appointment_status_slot_idx'),
+            models.Index(fields=['status', 'created_at'], name='appointment_status_created_idx'),
+            # Reminder due-scan: per reminder stage, a date_time range over active rows only
+            models.Index(
+                fields=['reminders_sent', 'date_time'],
+                condition=models.Q(status__in=['pending', 'confirmed']),
+                name='appointment_reminder_due_idx',
+            ),
+        ]
     
     def __str__(self):
         return f"{self.patient.name} with Dr. {self.doctor.name} on {self.date_time.strftime('%B %d, %Y at %I:%M %p')}"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Remember the loaded slot and status so signal handlers can see what changed"""
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_slot = (
+            instance.__dict__.get('doctor_id'), instance.__dict__.get('date_time')
+        )
+        instance._loaded_status = instance.__dict__.get('status')
+        return instance
+    
+    def save(self, *args, **kwargs):
+        """A rescheduled appointment is reminded again; flags annotated at load time go stale"""
+        loaded_date_time = getattr(self, '_loaded_slot', (None, None))[1]
+        if loaded_date_time is not None and loaded_date_time != self.date_time:
+            self.reminders_sent = 0
+        for name in self.FLAG_ANNOTATIONS:
+            self.__dict__.pop(name, None)
+        super().save(*args, **kwargs)
+    
+    def refresh_from_db(self, *args, **kwargs):
+        """Reloaded values are the new baseline for change detection"""
+        super().refresh_from_db(*args, **kwargs)
+        self._loaded_slot = (self.doctor_id, self.date_time)
+        self._loaded_status = self.status
+    
+    def ends_at(self):
+        return self.date_time + timedelta(minutes=self.duration)
+    
     def is_upcoming(self):
         """Check if appointment is in the future"""
         return self.date_time > timezone.now()
@@ -76,6 +214,704 @@ class Appointment(models.Model):
     def can_be_cancelled(self):
         """Check if appointment can still be cancelled"""
         return self.status in ['pending', 'confirmed'] and self.is_upcoming()
+    
+    def can_transition(self, target):
+        """Whether the state machine allows moving from the current status to ``target``"""
+        return self.status in self.STATUS_TRANSITIONS.get(target, ())
+
+
+class AppointmentTransition(models.Model):
+    """
+    Append-only log of appointment status changes. ``elapsed`` is the time
+    spent in ``from_status``, so turnaround figures aggregate over this table
+    alone without touching appointments.
+    """
+    appointment = models.ForeignKey(
+        Appointment,
+        on_delete=models.CASCADE,
+        related_name='transitions',
+        help_text='Appointment whose status changed'
+    )
+    
+    from_status = models.CharField(
+        max_length=20,
+        choices=Appointment.STATUS_CHOICES,
+        help_text='Status before the change'
+    )
+    
+    to_status = models.CharField(
+        max_length=20,
+        choices=Appointment.STATUS_CHOICES,
+        help_text='Status after the change'
+    )
+    
+    actor = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='appointment_transitions',
+        help_text='User who made the change (empty for automatic changes)'
+    )
+    
+    at = models.DateTimeField(
+        help_text='When the change happened'
+    )
+    
+    elapsed = models.DurationField(
+        help_text='Time the appointment spent in from_status'
+    )
+    
+    class Meta:
+        ordering = ['at', 'id']
+        verbose_name = 'Appointment Transition'
+        verbose_name_plural = 'Appointment Transitions'
+        indexes = [
+            # Status history of one appointment
+            models.Index(fields=['appointment', 'at'], name='transition_history_idx'),
+            # Turnaround over a time window, read from the index alone
+            models.Index(fields=['at', 'from_status', 'to_status', 'elapsed'], name='transition_turnaround_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Appointment {self.appointment_id}: {self.from_status} -> {self.to_status}"
+    
+    @classmethod
+    def record(cls, rows, to_status, actor=None, at=None):
+        """Log moves of (appointment_id, from_status, status_changed_at) ``rows`` to ``to_status`` in one INSERT"""
+        at = at or timezone.now()
+        return cls.objects.bulk_create([
+            cls(appointment_id=pk, from_status=from_status, to_status=to_status, actor=actor,
+                at=at, elapsed=max(at - since, timedelta(0)))
+            for pk, from_status, since in rows
+        ])
+
+
+class NoShowModel(models.Model):
+    """
+    A logistic no-show model fitted by ``score_no_shows`` on past appointments.
+    The latest one scores upcoming appointments; ``parameters`` holds its
+    weights and the feature scaling they were fitted with (see ``noshow``).
+    """
+    trained_at = models.DateTimeField(
+        help_text='When the model was fitted'
+    )
+    
+    samples = models.PositiveIntegerField(
+        help_text='Past appointments (completed or no-show) it was fitted on'
+    )
+    
+    no_show_rate = models.FloatField(
+        help_text='Share of those samples that were no-shows'
+    )
+    
+    log_loss = models.FloatField(
+        help_text='Mean log loss on the training samples'
+    )
+    
+    parameters = models.JSONField(
+        help_text='Intercept, feature weights, and the means and scales of the numeric features'
+    )
+    
+    class Meta:
+        ordering = ['-trained_at', '-id']
+        get_latest_by = ['trained_at', 'id']
+        verbose_name = 'No-show Model'
+        verbose_name_plural = 'No-show Models'
+    
+    def __str__(self):
+        return f"No-show model of {self.trained_at:%Y-%m-%d %H:%M} ({self.samples} samples)"
+
+
+class NoShowScore(models.Model):
+    """
+    Predicted no-show probability of an upcoming appointment, rewritten in
+    bulk by each scoring run. Kept apart from ``Appointment`` so that scores
+    never reach patients through its serializer and the nightly write does
+    not touch appointment rows.
+    """
+    appointment = models.OneToOneField(
+        Appointment,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='no_show_score',
+        help_text='Scored appointment'
+    )
+    
+    risk = models.FloatField(
+        help_text='Probability (0-1) that the patient does not turn up'
+    )
+    
+    scored_at = models.DateTimeField(
+        help_text='When the scoring run that wrote this score started'
+    )
+    
+    class Meta:
+        verbose_name = 'No-show Score'
+        verbose_name_plural = 'No-show Scores'
+        indexes = [
+            # Dropping the scores a run did not rewrite
+            models.Index(fields=['scored_at'], name='no_show_scored_at_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Appointment {self.appointment_id}: {self.risk:.0%} no-show risk"
+
+
+class CalendarFeed(models.Model):
+    """
+    Revocation state of a doctor's calendar feed URL. Feed tokens carry the
+    version they were issued for; bumping it invalidates every URL issued so
+    far. Doctors without a row are on version 0.
+    """
+    doctor = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='calendar_feed',
+        limit_choices_to={'role': 'doctor'},
+        help_text='Doctor whose feed this is'
+    )
+    
+    version = models.PositiveIntegerField(
+        default=0,
+        help_text='Only feed tokens issued for this version are accepted'
+    )
+    
+    rotated_at = models.DateTimeField(
+        auto_now=True,
+        help_text='When the feed URL was last rotated'
+    )
+    
+    class Meta:
+        verbose_name = 'Calendar Feed'
+        verbose_name_plural = 'Calendar Feeds'
+    
+    def __str__(self):
+        return f"Calendar feed of doctor {self.doctor_id} (version {self.version})"
+
+
+class AppointmentSeries(models.Model):
+    """
+    Recurring appointment rule (every ``interval`` days or weeks, bounded by
+    ``count`` and/or ``until``). Occurrences are materialized as Appointment
+    rows only up to a rolling horizon; later ones are virtual reservations.
+    """
+    FREQUENCY_CHOICES = [
+        ('daily', 'Daily'),
+        ('weekly', 'Weekly'),
+    ]
+    
+    # Relationships
+    patient = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='patient_appointment_series',
+        limit_choices_to={'role': 'patient'},
+        help_text='Patient the recurring appointments are for'
+    )
+    
+    doctor = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='doctor_appointment_series',
+        limit_choices_to={'role': 'doctor'},
+        help_text='Doctor the recurring appointments are with'
+    )
+    
+    # Recurrence rule
+    start = models.DateTimeField(
+        help_text='Date and time of the first occurrence'
+    )
+    
+    frequency = models.CharField(
+        max_length=10,
+        choices=FREQUENCY_CHOICES,
+        default='weekly',
+        help_text='Unit of the repeat interval'
+    )
+    
+    interval = models.PositiveIntegerField(
+        default=1,
+        validators=[MinValueValidator(1)],
+        help_text='Number of days or weeks between occurrences'
+    )
+    
+    count = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        validators=[MinValueValidator(1)],
+        help_text='Total number of occurrences (open-ended if empty)'
+    )
+    
+    until = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text='No occurrence is scheduled after this time (open-ended if empty)'
+    )
+    
+    duration = models.PositiveSmallIntegerField(
+        default=default_duration,
+        validators=[MinValueValidator(1)],
+        help_text='Length of each occurrence in minutes'
+    )
+    
+    reason = models.TextField(
+        blank=True,
+        help_text='Reason copied onto every occurrence'
+    )
+    
+    # Materialization state
+    active = models.BooleanField(
+        default=True,
+        help_text='Whether the series still schedules new occurrences'
+    )
+    
+    materialized_until = models.DateTimeField(
+        help_text='Occurrences before this time exist as Appointment rows'
+    )
+    
+    # Timestamps
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = 'Appointment Series'
+        verbose_name_plural = 'Appointment Series'
+        indexes = [
+            # Virtual reservation lookups: a doctor's active series that reach past their horizon
+            models.Index(fields=['doctor', 'active', 'materialized_until'], name='series_doctor_horizon_idx'),
+            # Materializer sweep
+            models.Index(fields=['active', 'materialized_until'], name='series_horizon_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Every {self.interval} {self.frequency} for {self.patient.name} with Dr. {self.doctor.name}"
+    
+    def step_days(self):
+        """Days between consecutive occurrences"""
+        return self.interval * (7 if self.frequency == 'weekly' else 1)
+
+
+class WorkingHours(models.Model):
+    """
+    One weekday of a doctor's weekly working-hours template, as a bitmap of
+    the clinic day with one bit per ``SCHEDULE_GRID_MINUTES`` step (bit 0
+    starts at midnight). Doctors without a template work ``CLINIC_WORKING_HOURS``.
+    """
+    WEEKDAY_CHOICES = [
+        (0, 'Monday'),
+        (1, 'Tuesday'),
+        (2, 'Wednesday'),
+        (3, 'Thursday'),
+        (4, 'Friday'),
+        (5, 'Saturday'),
+        (6, 'Sunday'),
+    ]
+    
+    doctor = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='working_hours',
+        limit_choices_to={'role': 'doctor'},
+        help_text='Doctor the template belongs to'
+    )
+    
+    weekday = models.PositiveSmallIntegerField(
+        choices=WEEKDAY_CHOICES,
+        help_text='Day of the week (Monday is 0)'
+    )
+    
+    slots = models.BinaryField(
+        help_text='Working grid steps of the day, one bit each (little-endian)'
+    )
+    
+    class Meta:
+        ordering = ['doctor_id', 'weekday']
+        verbose_name = 'Working Hours'
+        verbose_name_plural = 'Working Hours'
+        constraints = [
+            models.UniqueConstraint(fields=['doctor', 'weekday'], name='unique_doctor_weekday'),
+        ]
+    
+    def __str__(self):
+        return f"Dr. {self.doctor.name} on {self.get_weekday_display()}"
+
+
+class ScheduleException(models.Model):
+    """
+    Date-specific override of a doctor's weekly template (leave, a holiday,
+    extra hours), in the same bitmap form; no bits set means a day off
+    """
+    doctor = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='schedule_exceptions',
+        limit_choices_to={'role': 'doctor'},
+        help_text='Doctor whose day is overridden'
+    )
+    
+    date = models.DateField(
+        help_text='Clinic-local day the override applies to'
+    )
+    
+    slots = models.BinaryField(
+        help_text='Working grid steps of that day, one bit each (little-endian)'
+    )
+    
+    reason = models.CharField(
+        max_length=200,
+        blank=True,
+        help_text='Why the day differs (e.g. leave, public holiday)'
+    )
+    
+    class Meta:
+        ordering = ['doctor_id', 'date']
+        verbose_name = 'Schedule Exception'
+        verbose_name_plural = 'Schedule Exceptions'
+        constraints = [
+            # Also serves the (doctor, date) range reads of a horizon
+            models.UniqueConstraint(fields=['doctor', 'date'], name='unique_doctor_exception_date'),
+        ]
+    
+    def __str__(self):
+        return f"Dr. {self.doctor.name} on {self.date}"
+
+
+class Resource(models.Model):
+    """
+    A room or piece of equipment that appointments can reserve alongside
+    their doctor; resources are available during ``CLINIC_WORKING_HOURS``
+    """
+    KIND_CHOICES = [
+        ('room', 'Room'),
+        ('equipment', 'Equipment'),
+    ]
+    
+    name = models.CharField(
+        max_length=100,
+        unique=True,
+        help_text='Name shown to schedulers (e.g., Procedure room 2, Ultrasound A)'
+    )
+    
+    kind = models.CharField(
+        max_length=20,
+        choices=KIND_CHOICES,
+        help_text='Whether the resource is a room or equipment'
+    )
+    
+    active = models.BooleanField(
+        default=True,
+        help_text='Inactive resources cannot be reserved'
+    )
+    
+    # Timestamps
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['kind', 'name']
+        verbose_name = 'Resource'
+        verbose_name_plural = 'Resources'
+    
+    def __str__(self):
+        return f"{self.name} ({self.get_kind_display()})"
+
+
+class ResourceReservation(models.Model):
+    """
+    One resource held by one appointment. The appointment's time is copied
+    here so a resource's bookings are a range scan of its own index; whether
+    the reservation still holds the resource is the appointment's status.
+    """
+    appointment = models.ForeignKey(
+        Appointment,
+        on_delete=models.CASCADE,
+        related_name='reservations',
+        help_text='Appointment the resource is needed for'
+    )
+    
+    resource = models.ForeignKey(
+        Resource,
+        on_delete=models.PROTECT,
+        related_name='reservations',
+        help_text='Room or equipment held'
+    )
+    
+    date_time = models.DateTimeField(
+        help_text='Start of the appointment (moved with it)'
+    )
+    
+    duration = models.PositiveSmallIntegerField(
+        help_text='Length of the appointment in minutes (changed with it)'
+    )
+    
+    class Meta:
+        ordering = ['resource_id', 'date_time']
+        verbose_name = 'Resource Reservation'
+        verbose_name_plural = 'Resource Reservations'
+        constraints = [
+            models.UniqueConstraint(fields=['appointment', 'resource'], name='unique_appointment_resource'),
+        ]
+        indexes = [
+            # Conflict checks and free time: one bounded date_time range per resource
+            models.Index(
+                fields=['resource', 'date_time', 'duration', 'appointment'],
+                name='reservation_resource_slot_idx',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.resource.name} for appointment {self.appointment_id}"
+
+
+class WaitlistEntry(models.Model):
+    """
+    Patient waiting for an earlier slot with a doctor inside a preferred window
+    """
+    STATUS_CHOICES = [
+        ('waiting', 'Waiting'),
+        ('offered', 'Offered'),
+        ('booked', 'Booked'),
+    ]
+    
+    # Relationships
+    patient = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='waitlist_entries',
+        limit_choices_to={'role': 'patient'},
+        help_text='Patient waiting for a slot'
+    )
+    
+    doctor = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='doctor_waitlist_entries',
+        limit_choices_to={'role': 'doctor'},
+        help_text='Doctor the patient wants to see'
+    )
+    
+    # Preferred window
+    earliest = models.DateTimeField(
+        help_text='Earliest acceptable appointment start'
+    )
+    
+    latest = models.DateTimeField(
+        help_text='Latest acceptable appointment end'
+    )
+    
+    auto_book = models.BooleanField(
+        default=False,
+        help_text='Book a freed slot immediately instead of offering it'
+    )
+    
+    reason = models.TextField(
+        blank=True,
+        help_text='Reason for the appointment'
+    )
+    
+    # Matching state
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default='waiting',
+        help_text='Current status of the waitlist entry'
+    )
+    
+    offered_slot = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text='Start of the slot currently offered to the patient'
+    )
+    
+    offered_duration = models.PositiveSmallIntegerField(
+        null=True,
+        blank=True,
+        help_text='Length in minutes of the slot currently offered to the patient'
+    )
+    
+    offer_expires_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text='When the current offer lapses and the entry waits again'
+    )
+    
+    appointment = models.ForeignKey(
+        Appointment,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='waitlist_entries',
+        help_text='Appointment booked from this entry'
+    )
+    
+    # Timestamps
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        # First come, first served
+        ordering = ['created_at', 'id']
+        verbose_name = 'Waitlist Entry'
+        verbose_name_plural = 'Waitlist Entries'
+        indexes = [
+            # Matcher lookup: waiting entries of a doctor whose window covers a freed slot
+            models.Index(
+                fields=['doctor', 'earliest', 'latest'],
+                condition=models.Q(status='waiting'),
+                name='waitlist_doctor_window_idx',
+            ),
+            # Lapsed-offer sweep
+            models.Index(
+                fields=['offer_expires_at'],
+                condition=models.Q(status='offered'),
+                name='waitlist_offer_expiry_idx',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.patient.name} waiting for Dr. {self.doctor.name}"
+
+
+class WalkIn(models.Model):
+    """
+    Walk-in patient waiting in the clinic's triage queue
+    """
+    # Five-level triage scale; lower is seen first
+    PRIORITY_CHOICES = [
+        (1, 'Immediate'),
+        (2, 'Very urgent'),
+        (3, 'Urgent'),
+        (4, 'Standard'),
+        (5, 'Non-urgent'),
+    ]
+    
+    STATUS_CHOICES = [
+        ('waiting', 'Waiting'),
+        ('called', 'Called'),
+        ('left', 'Left'),
+    ]
+    
+    # Relationships
+    patient = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='walk_ins',
+        limit_choices_to={'role': 'patient'},
+        help_text='Registered patient, if the walk-in has an account'
+    )
+    
+    doctor = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='called_walk_ins',
+        limit_choices_to={'role': 'doctor'},
+        help_text='Doctor who called the patient'
+    )
+    
+    # Triage details
+    name = models.CharField(
+        max_length=255,
+        help_text='Name of the walk-in patient'
+    )
+    
+    complaint = models.TextField(
+        blank=True,
+        help_text='Presenting complaint noted at triage'
+    )
+    
+    priority = models.PositiveSmallIntegerField(
+        choices=PRIORITY_CHOICES,
+        default=4,
+        help_text='Triage priority (1 is most urgent)'
+    )
+    
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default='waiting',
+        help_text='Current status in the queue'
+    )
+    
+    arrived_at = models.DateTimeField(
+        default=timezone.now,
+        help_text='Arrival time; breaks ties within a priority'
+    )
+    
+    called_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text='When a doctor called the patient'
+    )
+    
+    # Timestamps
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        # Queue order: most urgent first, then first come, first served
+        ordering = ['priority', 'arrived_at', 'id']
+        verbose_name = 'Walk-in'
+        verbose_name_plural = 'Walk-ins'
+        indexes = [
+            # Rebuilding the queue reads only the people still waiting
+            models.Index(
+                fields=['priority', 'arrived_at', 'id'],
+                condition=models.Q(status='waiting'),
+                name='walkin_queue_idx',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.name} ({self.get_priority_display()}, {self.status})"
+
+
+class TriageEvent(models.Model):
+    """
+    Append-only log of queue operations, written before any worker applies them
+    """
+    KIND_CHOICES = [
+        ('enqueue', 'Enqueue'),
+        ('reprioritize', 'Reprioritize'),
+        ('call', 'Call'),
+        ('leave', 'Leave'),
+    ]
+    
+    walk_in = models.ForeignKey(
+        WalkIn,
+        on_delete=models.CASCADE,
+        related_name='events',
+        help_text='Walk-in the operation applies to'
+    )
+    
+    kind = models.CharField(
+        max_length=20,
+        choices=KIND_CHOICES,
+        help_text='Queue operation'
+    )
+    
+    priority = models.PositiveSmallIntegerField(
+        null=True,
+        blank=True,
+        help_text='Priority after the operation (enqueue and reprioritize)'
+    )
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        # Log order is the id sequence; workers replay events after the last id they applied
+        ordering = ['id']
+        verbose_name = 'Triage Event'
+        verbose_name_plural = 'Triage Events'
+    
+    def __str__(self):
+        return f"{self.kind} walk-in {self.walk_in_id}"
 
 
 class MedicalRecord(models.Model):
@@ -161,10 +997,29 @@ class MedicalRecord(models.Model):
         return f"Medical record for {self.patient.name} by Dr. {self.doctor.name} on {self.created_at.strftime('%B %d, %Y')}"
 
 
+class PatientProfileQuerySet(models.QuerySet):
+    def with_age(self, today=None):
+        """Annotate ``age`` in whole years on ``today`` (the SQL twin of ``get_age()``)"""
+        today = today or clinic_today()
+        birthday_ahead = (
+            Q(date_of_birth__month__gt=today.month)
+            | Q(date_of_birth__month=today.month, date_of_birth__day__gt=today.day)
+        )
+        years = today.year - ExtractYear('date_of_birth')
+        return self.annotate(age=Case(
+            When(date_of_birth__isnull=True, then=None),
+            When(birthday_ahead, then=years - 1),
+            default=years,
+            output_field=IntegerField(),
+        ))
+
+
 class PatientProfile(models.Model):
     """
     Extended profile information for patients
     """
+    objects = PatientProfileQuerySet.as_manager()
+    
     # One-to-one relationship with User
     user = models.OneToOneField(
         settings.AUTH_USER_MODEL,
@@ -245,10 +1100,60 @@ class PatientProfile(models.Model):
     def __str__(self):
         return f"Profile for {self.user.name}"
     
+    def save(self, *args, **kwargs):
+        """An ``age`` annotated at load time goes stale with the date of birth"""
+        self.__dict__.pop('age', None)
+        super().save(*args, **kwargs)
+    
     def get_age(self):
         """Calculate patient's age"""
         if self.date_of_birth:
-            today = timezone.now().date()
+            today = clinic_today()
             return today.year - self.date_of_birth.year - ((today.month, today.day) < (self.date_of_birth.month, self.date_of_birth.day))
         return None
 
+
+class DoctorProfile(models.Model):
+    """
+    Extended profile information for doctors
+    """
+    # One-to-one relationship with User
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='doctor_profile',
+        limit_choices_to={'role': 'doctor'}
+    )
+    
+    # Practice information
+    specialty = models.CharField(
+        max_length=100,
+        help_text='Medical specialty (e.g., cardiology), stored in lower case'
+    )
+    
+    facility = models.CharField(
+        max_length=200,
+        blank=True,
+        help_text='Hospital, clinic or site the doctor sees patients at'
+    )
+    
+    # Timestamps
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['specialty', 'id']
+        verbose_name = 'Doctor Profile'
+        verbose_name_plural = 'Doctor Profiles'
+        indexes = [
+            # Earliest-slot search: the doctors of a specialty (optionally at one facility)
+            models.Index(fields=['specialty', 'facility', 'user'], name='doctor_specialty_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Profile for Dr. {self.user.name}"
+    
+    def save(self, *args, **kwargs):
+        """Specialties are matched case-insensitively through the index"""
+        self.specialty = self.specialty.strip().lower()
+        super().save(*args, **kwargs)
@@ -0,0 +1,97 @@
+"""
+Month calendar counts.
+
+Calendar views only need how many appointments of each status fall on each
+clinic day of a month, so ``counts`` answers with one query instead of
+shipping the appointments: a GROUP BY status per clinic day, glued together
+with UNION ALL. Each part is a [start, end) range scan that the (status,
+date_time) index, or the (doctor, date_time, status) one for a single doctor,
+answers without reading the table. Grouping the whole month by a computed
+local date instead would convert every row's timestamp (in Python, on
+SQLite) and sort them all, which is about 35 times slower at 300k rows.
+
+Results are cached per (scope, month) in the Django cache, stamped with a
+version that ``signals.appointments_changed`` bumps for both the doctor's and
+the clinic's month a change touches. The default cache is local memory, so
+that bump reaches only the process that made the change; other processes
+catch up when their entry expires after ``MONTH_CALENDAR_CACHE_TIMEOUT``.
+"""
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Value
+
+from .clinic_time import clinic_date, day_range_filter
+from .models import Appointment
+
+
+CACHE_KEY = 'calendar:{scope}:{month}:{version}'
+VERSION_KEY = 'calendar:{scope}:{month}:version'
+# Scope of the clinic-wide counts; any other scope is a doctor id
+CLINIC = 'clinic'
+STATUSES = [choice for choice, _ in Appointment.STATUS_CHOICES]
+
+
+def parse_month(value):
+    """Return the first day of a YYYY-MM month, or None if ``value`` is not one"""
+    try:
+        return datetime.strptime(value, '%Y-%m').date()
+    except ValueError:
+        return None
+
+
+def month_of(day):
+    return day.replace(day=1)
+
+
+def last_day(month):
+    return month_of(month + timedelta(days=31)) - timedelta(days=1)
+
+
+def version_key(scope, month):
+    return VERSION_KEY.format(scope=scope, month=month.strftime('%Y-%m'))
+
+
+def query(month, doctor_id=None):
+    """Return {'YYYY-MM-DD': {status: count}} for the month's days that have appointments, with one query"""
+    appointments = Appointment.objects.filter(status__in=STATUSES)
+    if doctor_id is not None:
+        appointments = appointments.filter(doctor_id=doctor_id)
+    days = [month + timedelta(days=n) for n in range(last_day(month).day)]
+    # order_by() drops the default ordering, which UNION parts may not carry
+    per_day = [
+        appointments.filter(**day_range_filter(day)).values('status').annotate(
+            day=Value(day.isoformat()), count=Count('id')
+        ).values_list('day', 'status', 'count').order_by()
+        for day in days
+    ]
+
+    result = {}
+    for day, status, count in per_day[0].union(*per_day[1:], all=True):
+        result.setdefault(day, {})[status] = count
+    return dict(sorted(result.items()))
+
+
+def counts(month, doctor_id=None):
+    """Return the month's per-day status counts for one doctor, or the clinic when ``doctor_id`` is None"""
+    scope = CLINIC if doctor_id is None else doctor_id
+    version = cache.get(version_key(scope, month), 0)
+    key = CACHE_KEY.format(scope=scope, month=month.strftime('%Y-%m'), version=version)
+    days = cache.get(key)
+    if days is None:
+        days = query(month, doctor_id)
+        cache.set(key, days, settings.MONTH_CALENDAR_CACHE_TIMEOUT)
+    return days
+
+
+def invalidate(slots):
+    """Retire the cached months of the doctors and the clinic that (doctor_id, date_time) ``slots`` fall in"""
+    scopes = set()
+    for doctor_id, date_time in slots:
+        month = month_of(clinic_date(date_time))
+        scopes.update([(doctor_id, month), (CLINIC, month)])
+    for scope, month in scopes:
+        key = version_key(scope, month)
+        if not cache.add(key, 1, None):
+            cache.incr(key)
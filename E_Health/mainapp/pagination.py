@@ -0,0 +1,150 @@
+from django.core import signing
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination that seeks on the full ordering key instead of an offset.
+    
+    The cursor carries the ordering values of the boundary row, so every page
+    is one index range scan of ``page_size`` rows however deep the client
+    pages, and cursors stay valid when rows are inserted in between.
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    cursor_query_param = 'cursor'
+    cursor_salt = 'mainapp.pagination.keyset'
+    invalid_cursor_message = 'Invalid cursor'
+    
+    def paginate_queryset(self, queryset, request, view=None):
+        """Return one page of rows positioned by the request cursor"""
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.model = queryset.model
+        self.ordering = self.get_ordering(queryset)
+        
+        cursor = self.decode_cursor(request)
+        reverse = bool(cursor and cursor['reverse'])
+        ordering = self.invert(self.ordering) if reverse else self.ordering
+        
+        queryset = queryset.order_by(*ordering)
+        if cursor:
+            queryset = queryset.filter(self.seek_filter(ordering, cursor['values']))
+        
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        
+        if reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        
+        self.page = rows
+        return rows
+    
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+    
+    def get_page_size(self, request):
+        """Read the requested page size, clamped to ``max_page_size``"""
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+    
+    def get_ordering(self, queryset):
+        """
+        Resolve the queryset ordering and append the primary key as a tiebreaker
+        so the key is unique. The tiebreaker follows the direction of the
+        leading field, which lets a single (field, id) index serve both ways.
+        """
+        ordering = list(queryset.query.order_by or self.model._meta.ordering)
+        if not ordering or not all(isinstance(field, str) for field in ordering):
+            raise ValueError('KeysetPagination requires a plain field ordering')
+        
+        pk_name = self.model._meta.pk.name
+        ordering = [
+            field.replace('pk', pk_name) if field.lstrip('-') == 'pk' else field
+            for field in ordering
+        ]
+        if pk_name not in [field.lstrip('-') for field in ordering]:
+            ordering.append(('-' if ordering[0].startswith('-') else '') + pk_name)
+        return ordering
+    
+    @staticmethod
+    def invert(ordering):
+        return [field[1:] if field.startswith('-') else '-' + field for field in ordering]
+    
+    @staticmethod
+    def seek_filter(ordering, values):
+        """
+        Build the "strictly after this key" predicate for a composite ordering.
+        
+        The leading-column bound is repeated outside the OR so the database can
+        start an index range scan at the cursor instead of filtering from the
+        first row.
+        """
+        fields = [(field.lstrip('-'), field.startswith('-')) for field in ordering]
+        after = Q()
+        for i, (name, descending) in enumerate(fields):
+            clause = Q(**{f'{name}__{"lt" if descending else "gt"}': values[i]})
+            for j, (prior_name, _) in enumerate(fields[:i]):
+                clause &= Q(**{prior_name: values[j]})
+            after = clause if i == 0 else after | clause
+        
+        lead_name, lead_descending = fields[0]
+        bound = Q(**{f'{lead_name}__{"lte" if lead_descending else "gte"}': values[0]})
+        return bound & after
+    
+    def encode_cursor(self, row, reverse):
+        fields = [self.model._meta.get_field(field.lstrip('-')) for field in self.ordering]
+        payload = {
+            'v': [field.value_to_string(row) for field in fields],
+            'r': reverse,
+        }
+        token = signing.dumps(payload, salt=self.cursor_salt, compress=True)
+        return replace_query_param(self.base_url, self.cursor_query_param, token)
+    
+    def decode_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        
+        try:
+            payload = signing.loads(token, salt=self.cursor_salt)
+            raw_values = payload['v']
+            if len(raw_values) != len(self.ordering):
+                raise ValueError('cursor does not match ordering')
+            fields = [self.model._meta.get_field(field.lstrip('-')) for field in self.ordering]
+            values = [field.to_python(value) for field, value in zip(fields, raw_values)]
+            return {'values': values, 'reverse': bool(payload['r'])}
+        except (signing.BadSignature, KeyError, TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+    
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+    
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
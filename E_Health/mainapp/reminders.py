@@ -0,0 +1,202 @@
+"""
+Appointment reminder engine.
+
+Reminders go out ``APPOINTMENT_REMINDER_MINUTES`` before each active
+appointment (e.g. 24 h and 2 h). ``Appointment.reminders_sent`` counts the
+stages already sent, so the rows due for a stage are a (reminders_sent,
+date_time) range scan on a partial index that covers active appointments
+only. Stages run closest first, so a late booking gets only the reminder
+that still makes sense.
+
+Due rows are read in keyset batches of ``REMINDER_BATCH_SIZE``, handed to a
+pool of ``REMINDER_WORKERS`` dispatch threads, and marked sent with one
+UPDATE per batch once the transport reports which of them went out. A crash
+between sending and marking resends that batch (at-least-once delivery).
+"""
+import json
+import logging
+from abc import ABC, abstractmethod
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from threading import Lock
+
+from django.conf import settings
+from django.core import mail
+from django.db.models import BooleanField, Q
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .clinic_time import clinic_timezone
+from .models import Appointment
+
+
+logger = logging.getLogger(__name__)
+
+# SQLite only uses a partial index when the query repeats the index's WHERE
+# clause with the same literal values (bound parameters never match), so the
+# active-status filter is inlined rather than passed as ``status__in``
+ACTIVE_LITERAL = RawSQL(
+    '"mainapp_appointment"."status" IN (%s)' % ', '.join(f"'{status}'" for status in Appointment.ACTIVE_STATUSES),
+    [],
+    output_field=BooleanField(),
+)
+
+
+@dataclass(frozen=True)
+class Reminder:
+    appointment_id: int
+    email: str
+    patient_name: str
+    doctor_name: str
+    date_time: datetime
+    minutes_before: int
+
+    def subject(self):
+        return 'Appointment reminder'
+
+    def body(self):
+        local = timezone.localtime(self.date_time, clinic_timezone())
+        return (
+            f'Dear {self.patient_name},\n\n'
+            f'This is a reminder of your appointment with Dr. {self.doctor_name} '
+            f'on {local:%A %d %B %Y at %H:%M}.\n'
+        )
+
+
+class Transport(ABC):
+    """Sends reminders, all with an email address"""
+
+    @abstractmethod
+    def send(self, reminders):
+        """Send ``reminders`` and return the appointment ids that went out"""
+
+
+class FileTransport(Transport):
+    """Local stand-in that appends each reminder as a JSON line to ``REMINDER_OUTBOX``"""
+
+    lock = Lock()
+
+    def send(self, reminders):
+        lines = ''.join(
+            json.dumps({**asdict(reminder), 'date_time': reminder.date_time.isoformat()}) + '\n'
+            for reminder in reminders
+        )
+        with self.lock, open(settings.REMINDER_OUTBOX, 'a', encoding='utf-8') as outbox:
+            outbox.write(lines)
+        return [reminder.appointment_id for reminder in reminders]
+
+
+class EmailTransport(Transport):
+    """Sends reminders through Django's email backend (SMTP, or file/console locally), one connection per batch"""
+
+    def send(self, reminders):
+        messages = [
+            mail.EmailMessage(reminder.subject(), reminder.body(), to=[reminder.email])
+            for reminder in reminders
+        ]
+        with mail.get_connection(fail_silently=False) as connection:
+            connection.send_messages(messages)
+        return [reminder.appointment_id for reminder in reminders]
+
+
+def get_transport():
+    return import_string(settings.REMINDER_TRANSPORT)()
+
+
+def stages():
+    """(stage index, minutes before) pairs, closest to the appointment first"""
+    offsets = sorted(settings.APPOINTMENT_REMINDER_MINUTES, reverse=True)
+    return sorted(enumerate(offsets), key=lambda stage: stage[1])
+
+
+def due_query(sent, minutes, now):
+    """Active rows with ``sent`` reminders out, starting within ``minutes`` of ``now``, in index order"""
+    return Appointment.objects.filter(
+        ACTIVE_LITERAL,
+        reminders_sent=sent,
+        date_time__gt=now,
+        date_time__lte=now + timedelta(minutes=minutes),
+    ).order_by('date_time', 'id')
+
+
+def due_batches(stage, minutes, now, batch_size):
+    """
+    Yield lists of Reminders due for ``stage``. Rows behind on reminders are
+    read one ``reminders_sent`` value at a time, so every batch is a keyset
+    range scan already in index order.
+    """
+    for sent in range(stage + 1):
+        due = due_query(sent, minutes, now).values_list(
+            'id', 'date_time', 'patient__email', 'patient__name', 'doctor__name'
+        )
+        after = None
+        while True:
+            page = due
+            if after:
+                # The bare lower bound is what lets the index seek past earlier batches
+                page = due.filter(
+                    Q(date_time__gt=after[0]) | Q(date_time=after[0], id__gt=after[1]),
+                    date_time__gte=after[0],
+                )
+            rows = list(page[:batch_size])
+            if not rows:
+                break
+            yield [
+                Reminder(pk, email, patient_name, doctor_name, date_time, minutes)
+                for pk, date_time, email, patient_name, doctor_name in rows
+            ]
+            after = (rows[-1][1], rows[-1][0])
+
+
+def mark_sent(stage, appointment_ids):
+    """Record a dispatched batch with a single UPDATE"""
+    return Appointment.objects.filter(id__in=appointment_ids, reminders_sent__lte=stage).update(
+        reminders_sent=stage + 1
+    )
+
+
+def send_due(now=None, transport=None, batch_size=None, workers=None):
+    """
+    Send every reminder due at ``now``; returns {'sent': n, 'failed': n, 'skipped': n}.
+    Patients without an email address are skipped: their stage is marked
+    done, so they are not counted as failed and retried on every run.
+    """
+    now = now or timezone.now()
+    transport = transport or get_transport()
+    batch_size = batch_size or settings.REMINDER_BATCH_SIZE
+    workers = workers or settings.REMINDER_WORKERS
+    totals = {'sent': 0, 'failed': 0, 'skipped': 0}
+
+    def settle(futures):
+        done, pending = wait(futures, return_when=FIRST_COMPLETED)
+        for future in done:
+            stage, batch = futures.pop(future)
+            try:
+                sent = future.result()
+            except Exception:
+                logger.exception('Sending %d reminders failed', len(batch))
+                sent = []
+            # Marking stays on this thread, so dispatch threads never write to the database
+            totals['sent'] += mark_sent(stage, sent) if sent else 0
+            totals['failed'] += len(batch) - len(sent)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for stage, minutes in stages():
+            for batch in due_batches(stage, minutes, now, batch_size):
+                unreachable = [reminder.appointment_id for reminder in batch if not reminder.email]
+                if unreachable:
+                    totals['skipped'] += mark_sent(stage, unreachable)
+                    batch = [reminder for reminder in batch if reminder.email]
+                    if not batch:
+                        continue
+                futures[pool.submit(transport.send, batch)] = (stage, batch)
+                # Bound the batches in flight so memory stays flat on a large day
+                while len(futures) >= 2 * workers:
+                    settle(futures)
+            # A later stage's scan must not see rows this stage is still sending
+            while futures:
+                settle(futures)
+    return totals
@@ -0,0 +1,203 @@
+"""
+Bulk rescheduling of a doctor's appointments, e.g. when they go on leave.
+
+Planning reads everything up front: the doctor's active appointments in the
+date range, the rooms and equipment they hold, and the free-time bitmaps
+(see ``schedule``) of every doctor who may take them over. Appointments are
+then placed in time order, in memory: each takes the first free run that
+fits it (and suits its resources) and marks it busy, so later ones cannot
+land on it. ``shift`` keeps the doctor and moves each appointment to their
+first free slot after the range; ``reassign`` keeps the time as close as it
+can with a colleague, the least loaded colleague winning ties. Appointments
+that fit nowhere within ``RESCHEDULE_SEARCH_DAYS`` are left as they are and
+reported.
+
+A plan is written in one transaction with a ``bulk_update`` and checked for
+overlaps right after the write, like ``booking``'s bulk path: if a
+concurrent booking took a planned slot or resource, nothing moves. The
+planned appointments are read again, locked, before the write, so one
+cancelled, moved or resized since planning also leaves everything in place.
+"""
+import heapq
+from dataclasses import dataclass
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from . import booking, resources, schedule
+from .clinic_time import clinic_date, clinic_datetime
+from .models import Appointment, ResourceReservation
+from .signals import appointments_changed
+
+
+class PlanOutdated(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'An appointment changed since the plan was made; nothing was moved'
+    default_code = 'plan_outdated'
+
+
+@dataclass(frozen=True)
+class Move:
+    """One planned change: ``appointment`` (as loaded) goes to ``doctor_id`` at ``date_time``"""
+    appointment: Appointment
+    doctor_id: int
+    date_time: datetime
+    resource_ids: tuple = ()
+
+
+def plan(doctor_id, first, last, colleagues=None, now=None):
+    """
+    Place the doctor's active appointments from clinic day ``first`` to
+    ``last`` (those not yet started) with the doctor after ``last``, or with
+    ``colleagues`` (doctor ids) when given. Reads the database only; returns
+    ([Move], [(Appointment, reason)] for those that fit nowhere).
+    """
+    now = now or timezone.now()
+    start, end = schedule.read_window(first, last, since=now)
+    span = dict(doctor_id=doctor_id, status__in=Appointment.ACTIVE_STATUSES, date_time__gte=start, date_time__lt=end)
+    appointments = list(Appointment.objects.filter(**span).order_by('date_time', 'id'))
+    if not appointments:
+        return [], []
+    holds = {}
+    for appointment_id, resource_id in ResourceReservation.objects.filter(
+        **{f'appointment__{name}': value for name, value in span.items()}
+    ).order_by().values_list('appointment_id', 'resource_id'):
+        holds.setdefault(appointment_id, []).append(resource_id)
+
+    doctors = [doctor_id] if colleagues is None else list(colleagues)
+    since = max(now, clinic_datetime(last + timedelta(days=1), time.min)) if colleagues is None else start
+    horizon = clinic_date(since), last + timedelta(days=settings.RESCHEDULE_SEARCH_DAYS)
+    days = (horizon[1] - horizon[0]).days + 1
+    free = {key: value.bits for key, value in schedule.free_time(doctors, horizon[0], days, since).items()}
+    resource_ids = {resource_id for needs in holds.values() for resource_id in needs}
+    taken = resources.busy_bits(resource_ids, *horizon, since) if resource_ids else {}
+
+    if colleagues is None:
+        reason = f'The doctor has no free slot within {settings.RESCHEDULE_SEARCH_DAYS} days after the range'
+    else:
+        reason = f'No colleague has a free slot within {settings.RESCHEDULE_SEARCH_DAYS} days'
+    load = dict.fromkeys(doctors, 0)
+    version = dict.fromkeys(doctors, 0)
+    queues = {}
+
+    def first_free(candidate, after, minutes, blocked=0):
+        starts = schedule.FreeTime(horizon[0], free[candidate] & ~blocked).next_free(after, minutes)
+        return starts[0] if starts else None
+
+    def best_fit(after, minutes, blocked):
+        """The (start, load, doctor_id) that takes ``minutes`` soonest from ``after``, or None"""
+        if blocked:
+            fits = ((first_free(candidate, after, minutes, blocked), load[candidate], candidate) for candidate in doctors)
+            return min((fit for fit in fits if fit[0] is not None), default=None)
+        # Per length, a heap of each doctor's first free start as last seen.
+        # ``after`` never decreases and bitmaps only lose bits, so an entry is
+        # exact until its start falls behind ``after`` or its doctor takes an
+        # appointment; only such stale entries at the top are recomputed, and
+        # a doctor with no free run left is dropped for good.
+        queue = queues.setdefault(minutes, [(after, 0, candidate, -1) for candidate in doctors])
+        while queue:
+            start, _, candidate, seen = queue[0]
+            if seen == version[candidate] and start >= after:
+                return queue[0][:3]
+            start = first_free(candidate, after, minutes)
+            if start is None:
+                heapq.heappop(queue)
+            else:
+                heapq.heapreplace(queue, (start, load[candidate], candidate, version[candidate]))
+        return None
+
+    moves, unplaced = [], []
+    for appointment in appointments:
+        needs = holds.get(appointment.id, [])
+        # The appointment's own reservations stay busy until it leaves them
+        own = schedule.window_bits(horizon[0], appointment.date_time, appointment.ends_at())
+        blocked = 0
+        for resource_id in needs:
+            blocked |= taken[resource_id] & ~own
+        best = best_fit(since if colleagues is None else appointment.date_time, appointment.duration, blocked)
+        if best is None:
+            unplaced.append((appointment, reason))
+            continue
+
+        date_time, _, candidate = best
+        window = schedule.window_bits(horizon[0], date_time, date_time + timedelta(minutes=appointment.duration))
+        free[candidate] &= ~window
+        for resource_id in needs:
+            taken[resource_id] = taken[resource_id] & ~own | window
+        load[candidate] += 1
+        version[candidate] += 1
+        moves.append(Move(appointment, candidate, date_time, tuple(sorted(needs))))
+    return moves, unplaced
+
+
+def commit(moves, now=None):
+    """
+    Write planned ``moves`` in one transaction, all or nothing: an
+    appointment no longer as planned raises ``PlanOutdated``, and a slot or a
+    resource taken since planning ``SlotUnavailable`` or
+    ``ResourceUnavailable``, leaving every appointment where it was
+    """
+    now = now or timezone.now()
+    rows = [
+        Appointment(id=move.appointment.id, doctor_id=move.doctor_id, date_time=move.date_time,
+                    duration=move.appointment.duration)
+        for move in moves
+    ]
+    # bulk_update writes a CASE per column, so columns with one value for
+    # every row are set by plain UPDATEs instead
+    varying = [
+        name for name in ('doctor_id', 'date_time')
+        if any(getattr(move, name) != getattr(move.appointment, name) for move in moves)
+    ]
+    # A rescheduled appointment is reminded again, as in Appointment.save()
+    retimed = [move.appointment.id for move in moves if move.date_time != move.appointment.date_time]
+    try:
+        with transaction.atomic():
+            # Locked, so none of them can change between this check and the write
+            planned = Appointment.objects.select_for_update().filter(
+                id__in=[row.id for row in rows], status__in=Appointment.ACTIVE_STATUSES
+            )
+            current = {row[0]: row[1:] for row in planned.values_list('id', 'doctor_id', 'date_time', 'duration')}
+            changed = [
+                move.appointment.id for move in moves
+                if current.get(move.appointment.id)
+                != (move.appointment.doctor_id, move.appointment.date_time, move.appointment.duration)
+            ]
+            if changed:
+                raise PlanOutdated({'error': PlanOutdated.default_detail, 'changed': changed})
+            if varying:
+                Appointment.objects.bulk_update(rows, [name.removesuffix('_id') for name in varying])
+            Appointment.objects.filter(id__in=[row.id for row in rows]).update(updated_at=now)
+            if retimed:
+                Appointment.objects.filter(id__in=retimed).update(reminders_sent=0)
+            holding = [move.appointment.id for move in moves if move.resource_ids]
+            if holding:
+                ResourceReservation.objects.filter(appointment_id__in=holding).update(
+                    date_time=Subquery(Appointment.objects.filter(id=OuterRef('appointment_id')).values('date_time'))
+                )
+            booking.check_written(booking.window(row) for row in rows)
+            taken = resources.conflicts(
+                (row.id, row.date_time, row.ends_at(), move.resource_ids) for row, move in zip(rows, moves)
+            )
+            if taken:
+                taken = sorted({resource_id for ids in taken.values() for resource_id in ids})
+                raise resources.ResourcesTaken(taken, taken)
+    except IntegrityError:
+        raise booking.SlotUnavailable({
+            'error': 'A planned slot was booked concurrently; nothing was moved'
+        })
+    except resources.ResourcesTaken as conflict:
+        raise resources.ResourceUnavailable({
+            'error': 'A planned room or equipment was booked concurrently; nothing was moved',
+            'resource_ids': conflict.taken,
+        })
+
+    appointments_changed(
+        [(move.appointment.doctor_id, move.appointment.date_time) for move in moves]
+        + [(move.doctor_id, move.date_time) for move in moves]
+    )
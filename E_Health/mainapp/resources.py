@@ -0,0 +1,167 @@
+"""
+Rooms and equipment reserved alongside doctors.
+
+An appointment holds each resource it needs through a ``ResourceReservation``
+row carrying a copy of the appointment's time, so a resource's bookings are a
+bounded range scan of its (resource, date_time) index, like a doctor's.
+Whether a reservation still holds its resource is read from the appointment's
+status, so cancelling, completing or expiring an appointment frees everything
+it held without another write.
+
+Reservations are written in their appointment's transaction and checked for
+overlaps right after the write, as ``booking`` does for doctors: SQLite holds
+its write lock from the appointment's insert until commit, so of two bookings
+racing for a room each either sees the other's committed rows or waits for
+them. The loser rolls back whole, appointment included.
+
+Free time reuses the bitmaps of ``schedule``: a resource is free during
+``CLINIC_WORKING_HOURS`` outside its reservations, and the time a doctor and
+every resource are free together is the AND of their bitmaps.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from . import schedule
+from .clinic_time import clinic_date
+from .models import Appointment, ResourceReservation
+
+
+class ResourceUnavailable(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'A required room or equipment is already booked at this time'
+    default_code = 'resource_unavailable'
+
+    def __init__(self, detail):
+        super().__init__()
+        # As given: APIException would turn the resource ids into strings
+        self.detail = detail
+
+
+class ResourcesTaken(Exception):
+    """Raised inside a booking's transaction; ``booking.claiming_slot`` answers it after the rollback"""
+
+    def __init__(self, resource_ids, taken):
+        super().__init__(taken)
+        self.resource_ids = resource_ids
+        self.taken = taken
+
+
+def resource_unavailable(doctor_id, date_time, duration, resource_ids, taken):
+    minutes = duration or settings.APPOINTMENT_SLOT_MINUTES
+    starts = next_free(resource_ids, date_time, minutes, doctor_id=doctor_id)
+    return ResourceUnavailable({
+        'error': ResourceUnavailable.default_detail,
+        'resource_ids': taken,
+        'next_available': [
+            {'start': start.isoformat(), 'end': (start + timedelta(minutes=minutes)).isoformat()}
+            for start in starts
+        ],
+    })
+
+
+def held(resource_ids, start, end):
+    """
+    Active reservations of ``resource_ids`` that can overlap [start, end):
+    no appointment outlasts ``APPOINTMENT_MAX_MINUTES``, so only those
+    starting in (start - that, end) are read
+    """
+    return ResourceReservation.objects.filter(
+        resource_id__in=resource_ids,
+        appointment__status__in=Appointment.ACTIVE_STATUSES,
+        date_time__gt=start - timedelta(minutes=settings.APPOINTMENT_MAX_MINUTES),
+        date_time__lt=end,
+    ).order_by()
+
+
+def conflicts(holds):
+    """
+    Return {appointment_id: sorted ids of the resources another active
+    appointment holds during it} for just-written (appointment_id, start,
+    end, resource_ids) ``holds``, with one query however many there are
+    """
+    holds = [hold for hold in holds if hold[3]]
+    if not holds:
+        return {}
+    rows = held(
+        {resource_id for *_, resource_ids in holds for resource_id in resource_ids},
+        min(start for _, start, _, _ in holds),
+        max(end for _, _, end, _ in holds),
+    ).values_list('resource_id', 'appointment_id', 'date_time', 'duration')
+    reservations = {}
+    for resource_id, *reservation in rows:
+        reservations.setdefault(resource_id, []).append(reservation)
+
+    taken = {}
+    for appointment_id, start, end, resource_ids in holds:
+        hit = [
+            resource_id for resource_id in sorted(resource_ids)
+            if any(
+                other != appointment_id and begin < end and begin + timedelta(minutes=minutes) > start
+                for other, begin, minutes in reservations.get(resource_id, ())
+            )
+        ]
+        if hit:
+            taken[appointment_id] = hit
+    return taken
+
+
+def check_written(appointment, resource_ids):
+    """Raise ``ResourcesTaken`` if another active appointment holds any of ``resource_ids`` during ``appointment``"""
+    taken = conflicts([(appointment.id, appointment.date_time, appointment.ends_at(), resource_ids)])
+    if taken:
+        raise ResourcesTaken(resource_ids, taken[appointment.id])
+
+
+def reserve(appointment, resource_ids):
+    """Hold ``resource_ids`` for a just-written ``appointment``, inside its transaction"""
+    ResourceReservation.objects.bulk_create([
+        ResourceReservation(
+            appointment=appointment, resource_id=resource_id,
+            date_time=appointment.date_time, duration=appointment.duration,
+        )
+        for resource_id in resource_ids
+    ])
+    check_written(appointment, resource_ids)
+
+
+def move(appointment, resource_ids=None):
+    """Carry a just-rescheduled ``appointment``'s reservations along (or swap in ``resource_ids``), inside its transaction"""
+    reservations = appointment.reservations.all()
+    if resource_ids is None:
+        resource_ids = list(reservations.values_list('resource_id', flat=True))
+        if resource_ids:
+            reservations.update(date_time=appointment.date_time, duration=appointment.duration)
+            check_written(appointment, resource_ids)
+    else:
+        reservations.delete()
+        reserve(appointment, resource_ids)
+
+
+def busy_bits(resource_ids, first, last, since=None):
+    """Return {resource_id: horizon bitmap of the steps from ``first`` to ``last`` it is reserved}"""
+    start, end = schedule.read_window(first, last, since)
+    rows = held(resource_ids, start, end).values_list('resource_id', 'date_time', 'duration')
+    return schedule.project(rows, resource_ids, first, last)
+
+
+def free_time(resource_ids, first, days, doctor_id=None, since=None):
+    """
+    FreeTime of the steps over ``days`` clinic days from ``first`` when every
+    one of ``resource_ids`` (and the doctor, if given) is free. Only times
+    from ``since`` on are accurate when it is given.
+    """
+    bits = schedule.clinic_bits(first, days)
+    for busy in busy_bits(resource_ids, first, first + timedelta(days=days - 1), since).values():
+        bits &= ~busy
+    if doctor_id is not None:
+        bits &= schedule.free_time([doctor_id], first, days, since)[doctor_id].bits
+    return schedule.FreeTime(first, bits)
+
+
+def next_free(resource_ids, after, minutes, count=5, doctor_id=None, days=None):
+    """Start times of the first ``count`` free runs of ``minutes`` from ``after`` that suit every resource and the doctor"""
+    days = days or settings.AVAILABILITY_MAX_DAYS
+    return free_time(resource_ids, clinic_date(after), days, doctor_id, since=after).next_free(after, minutes, count)
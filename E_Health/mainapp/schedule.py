@@ -0,0 +1,349 @@
+"""
+Doctor working hours and free time as slot bitmaps.
+
+A clinic day is ``steps_per_day()`` grid steps of ``SCHEDULE_GRID_MINUTES``
+(96 at 15 minutes), and a set of times within it is an int with one bit per
+step. Weekly templates (``WorkingHours``) and date exceptions
+(``ScheduleException``) store such day masks. A doctor's horizon is one int
+whose bit ``d * steps_per_day() + s`` is step ``s`` of day ``d``; active
+appointments and virtual series occurrences are projected onto the same
+grid, so free time is ``working & ~busy`` and "is this slot free" or "next N
+free slots" are shifts and ANDs instead of loops over rows and datetimes.
+A 90-day horizon is about 1 KB per doctor, so thousands of doctors fit in
+memory at once.
+"""
+import heapq
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from itertools import islice, repeat
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import DateField, F, IntegerField, Value
+
+from . import series
+from .clinic_time import clinic_date, clinic_datetime, clinic_timezone
+from .models import Appointment, ScheduleException, WorkingHours
+
+
+def grid():
+    return timedelta(minutes=settings.SCHEDULE_GRID_MINUTES)
+
+
+def steps_per_day():
+    return 24 * 60 // settings.SCHEDULE_GRID_MINUTES
+
+
+def parse_minutes(value):
+    """Minutes since midnight of an 'HH:MM' clinic time ('24:00' is the end of the day)"""
+    if value == '24:00':
+        return 24 * 60
+    parsed = time.fromisoformat(value)
+    if parsed.second or parsed.microsecond:
+        raise ValueError(f'{value} is not a whole minute')
+    return parsed.hour * 60 + parsed.minute
+
+
+def format_minutes(minutes):
+    return f'{minutes // 60:02d}:{minutes % 60:02d}'
+
+
+def encode(windows):
+    """Day mask of ('HH:MM', 'HH:MM') windows; ValueError if one is empty or off the grid"""
+    step = settings.SCHEDULE_GRID_MINUTES
+    mask = 0
+    for start, end in windows:
+        first, last = parse_minutes(start), parse_minutes(end)
+        if first % step or last % step or not 0 <= first < last <= 24 * 60:
+            raise ValueError(f'{start}-{end} is not a window on the {step}-minute grid')
+        mask |= (1 << last // step) - (1 << first // step)
+    return mask
+
+
+def decode(mask):
+    """('HH:MM', 'HH:MM') windows of a day mask"""
+    step = settings.SCHEDULE_GRID_MINUTES
+    return [(format_minutes(start * step), format_minutes(end * step)) for start, end in runs(mask)]
+
+
+def to_bytes(mask):
+    return mask.to_bytes((steps_per_day() + 7) // 8, 'little')
+
+
+def from_bytes(data):
+    return int.from_bytes(data, 'little')
+
+
+def runs(bits):
+    """Yield the (start, end) positions of each run of set bits, lowest first"""
+    position = 0
+    while bits:
+        gap = (bits & -bits).bit_length() - 1
+        bits >>= gap
+        length = (~bits & (bits + 1)).bit_length() - 1
+        yield position + gap, position + gap + length
+        bits >>= length
+        position += gap + length
+
+
+def run_starts(bits, length):
+    """Bitmap of the positions where ``length`` consecutive set bits of ``bits`` begin"""
+    starts, span = bits, 1
+    # Doubling: a run of 2k set bits is a run of k followed by another
+    while span < length:
+        shift = min(span, length - span)
+        starts &= starts >> shift
+        span += shift
+    return starts
+
+
+def clinic_masks():
+    """Day masks of the clinic's default ``CLINIC_WORKING_HOURS`` by weekday"""
+    return {weekday: encode(settings.CLINIC_WORKING_HOURS.get(weekday, [])) for weekday in range(7)}
+
+
+def day_masks(doctor_ids, first, last):
+    """
+    Return {doctor_id: [working mask of each day from ``first`` to ``last``]},
+    reading the doctors' templates and their exceptions in range with one query
+    """
+    templates = WorkingHours.objects.filter(doctor_id__in=doctor_ids).order_by().values(
+        'doctor_id', 'slots', key_weekday=F('weekday'), key_date=Value(None, output_field=DateField())
+    )
+    exceptions = ScheduleException.objects.filter(
+        doctor_id__in=doctor_ids, date__range=(first, last)
+    ).order_by().values(
+        'doctor_id', 'slots', key_weekday=Value(None, output_field=IntegerField()), key_date=F('date')
+    )
+    weekly, overrides = {}, {}
+    for row in templates.union(exceptions, all=True):
+        if row['key_date'] is None:
+            weekly.setdefault(row['doctor_id'], {})[row['key_weekday']] = from_bytes(row['slots'])
+        else:
+            overrides[row['doctor_id'], row['key_date']] = from_bytes(row['slots'])
+
+    default = clinic_masks()
+    days = [first + timedelta(days=n) for n in range((last - first).days + 1)]
+    masks = {}
+    for doctor_id in doctor_ids:
+        template = weekly.get(doctor_id, default)
+        masks[doctor_id] = [overrides.get((doctor_id, day), template.get(day.weekday(), 0)) for day in days]
+    return masks
+
+
+def working_windows(doctor_id, days):
+    """Return {day: clinic-local (start, end) datetimes the doctor works} for ``days``"""
+    first = min(days)
+    masks = day_masks([doctor_id], first, max(days))[doctor_id]
+    return {
+        day: [
+            (datetime_at(day, start), datetime_at(day, end))
+            for start, end in runs(masks[(day - first).days])
+        ]
+        for day in days
+    }
+
+
+def clinic_bits(first, days):
+    """Horizon bitmap of ``CLINIC_WORKING_HOURS`` over ``days`` clinic days from ``first``"""
+    default = clinic_masks()
+    return horizon_bits([default[(first + timedelta(days=n)).weekday()] for n in range(days)])
+
+
+def horizon_bits(masks):
+    """Join consecutive day masks (first day in the lowest bits) into one horizon bitmap"""
+    width = steps_per_day()
+    bits = 0
+    for mask in reversed(masks):
+        bits = bits << width | mask
+    return bits
+
+
+def step_at(first, date_time, round_up=False):
+    """Horizon position of the grid step holding ``date_time`` (the step it ends, if ``round_up``)"""
+    offset = date_time.astimezone(clinic_timezone()).replace(tzinfo=None) - datetime.combine(first, time.min)
+    return -(-offset // grid()) if round_up else offset // grid()
+
+
+def datetime_at(first, step):
+    """Aware datetime at which horizon position ``step`` starts"""
+    days, step = divmod(step, steps_per_day())
+    return clinic_datetime(first + timedelta(days=days), (datetime.min + step * grid()).time())
+
+
+def window_bits(first, start, end):
+    """Horizon bitmap of the grid steps from clinic day ``first`` on that [start, end) touches"""
+    low, high = max(step_at(first, start), 0), step_at(first, end, round_up=True)
+    return (1 << high) - (1 << low) if low < high else 0
+
+
+def read_window(first, last, since=None):
+    """The [start, end) span of clinic days ``first`` to ``last``, cut to start no earlier than ``since``"""
+    start = clinic_datetime(first, time.min)
+    if since is not None:
+        start = max(start, since)
+    return start, clinic_datetime(last + timedelta(days=1), time.min)
+
+
+def busy_bits(doctor_ids, first, last, since=None):
+    """
+    Return {doctor_id: horizon bitmap of the steps from ``first`` to ``last``
+    touched by active appointments or virtual series occurrences}. With
+    ``since``, bookings over before then are not read (their steps look free).
+    """
+    start, end = read_window(first, last, since)
+    rows = Appointment.objects.filter(
+        doctor_id__in=doctor_ids,
+        status__in=Appointment.ACTIVE_STATUSES,
+        date_time__gt=start - timedelta(minutes=settings.APPOINTMENT_MAX_MINUTES),
+        date_time__lt=end,
+    ).order_by().values_list('doctor_id', 'date_time', 'duration')
+    intervals = list(rows)
+    intervals.extend(series.virtual_reservations(doctor_ids, start, end))
+    return project(intervals, doctor_ids, first, last)
+
+
+def project(intervals, keys, first, last):
+    """
+    Return {key: horizon bitmap of the steps from ``first`` to ``last`` that
+    the (key, start, minutes) ``intervals`` touch}, for every key in ``keys``
+    """
+    # This loop runs once per booking, so it works in epoch seconds and looks
+    # the clinic's UTC offset up once per hour, rather than converting each
+    # datetime to the clinic's wall clock like step_at()
+    zone = clinic_timezone()
+    origin = datetime.combine(first, time.min, tzinfo=dt_timezone.utc).timestamp()
+    width = settings.SCHEDULE_GRID_MINUTES * 60
+    offsets = {}
+
+    def wall_clock(seconds):
+        hour = seconds // 3600
+        if hour not in offsets:
+            offsets[hour] = datetime.fromtimestamp(seconds, zone).utcoffset().total_seconds()
+        return seconds + offsets[hour] - origin
+
+    limit = ((last - first).days + 1) * steps_per_day()
+    busy = dict.fromkeys(keys, 0)
+    for key, begin, minutes in intervals:
+        begin = begin.timestamp()
+        low = max(int(wall_clock(begin) // width), 0)
+        high = min(-int(-wall_clock(begin + minutes * 60) // width), limit)
+        if low < high:
+            busy[key] |= (1 << high) - (1 << low)
+    return busy
+
+
+@dataclass(frozen=True)
+class FreeTime:
+    """A doctor's free grid steps from clinic day ``first`` on, as one horizon bitmap"""
+    first: date
+    bits: int
+
+    def is_free(self, start, end):
+        """Whether all of [start, end) is working time not taken by a booking"""
+        low, high = step_at(self.first, start), step_at(self.first, end, round_up=True)
+        if low < 0:
+            return False
+        wanted = (1 << high) - (1 << low)
+        return self.bits & wanted == wanted
+
+    def free_starts(self, after, minutes):
+        """Lazily yield the start times of successive non-overlapping free runs of ``minutes`` from ``after``"""
+        length = -(-minutes // settings.SCHEDULE_GRID_MINUTES)
+        starts = run_starts(self.bits, length) & (-1 << max(step_at(self.first, after, round_up=True), 0))
+        while starts:
+            step = (starts & -starts).bit_length() - 1
+            yield datetime_at(self.first, step)
+            starts &= -1 << (step + length)
+
+    def next_free(self, after, minutes, count=1):
+        """Start times of the first ``count`` non-overlapping free runs of ``minutes`` at or after ``after``"""
+        return list(islice(self.free_starts(after, minutes), count))
+
+
+def free_time(doctor_ids, first, days=None, since=None):
+    """
+    Return {doctor_id: FreeTime} over ``days`` clinic days from ``first``
+    (default ``SCHEDULE_HORIZON_DAYS``), whatever the number of doctors, with
+    one query each for working hours, appointments and series. Only times
+    from ``since`` on are accurate when it is given.
+    """
+    days = days or settings.SCHEDULE_HORIZON_DAYS
+    last = first + timedelta(days=days - 1)
+    masks = day_masks(doctor_ids, first, last)
+    busy = busy_bits(doctor_ids, first, last, since)
+    return {doctor_id: FreeTime(first, horizon_bits(masks[doctor_id]) & ~busy[doctor_id]) for doctor_id in doctor_ids}
+
+
+def earliest(doctor_ids, after, minutes, count, days=None):
+    """
+    Return the first ``count`` (start, doctor_id) free slots of ``minutes``
+    across ``doctor_ids`` at or after ``after``, earliest first.
+
+    Each doctor's free starts are a lazy stream off their bitmap and the
+    streams are k-way merged through a heap, so only about ``count`` slots
+    are ever decoded however many doctors there are. Bitmaps are built for a
+    window of days at a time, starting with the rest of ``after``'s day and
+    doubling, so later days (and their bookings) are only read when the
+    earlier ones cannot fill ``count``. The search stops ``days`` (default
+    ``SCHEDULE_HORIZON_DAYS``) after ``after``'s day.
+    """
+    found = []
+    first = clinic_date(after)
+    horizon = first + timedelta(days=days or settings.SCHEDULE_HORIZON_DAYS)
+    span = 1
+    while len(found) < count and first < horizon and doctor_ids:
+        span = min(span, (horizon - first).days)
+        free = free_time(doctor_ids, first, span, since=after)
+        streams = [zip(bits.free_starts(after, minutes), repeat(doctor_id)) for doctor_id, bits in free.items()]
+        found.extend(islice(heapq.merge(*streams), count - len(found)))
+        first += timedelta(days=span)
+        span *= 2
+    return found
+
+
+def hours(doctor_id, first):
+    """The doctor's weekly template (or the clinic default) and their exceptions from ``first``, as windows"""
+    weekly = {weekday: from_bytes(slots) for weekday, slots in WorkingHours.objects.filter(
+        doctor_id=doctor_id
+    ).values_list('weekday', 'slots')}
+    exceptions = ScheduleException.objects.filter(doctor_id=doctor_id, date__gte=first).values_list(
+        'date', 'slots', 'reason'
+    )
+    return {
+        'grid_minutes': settings.SCHEDULE_GRID_MINUTES,
+        'default': not weekly,
+        'weekly': {weekday: decode(mask) for weekday, mask in (weekly or clinic_masks()).items()},
+        'exceptions': [
+            {'date': day, 'hours': decode(from_bytes(slots)), 'reason': reason}
+            for day, slots, reason in exceptions
+        ],
+    }
+
+
+def save_hours(doctor_id, weekly=None, exceptions=None):
+    """
+    Replace the doctor's weekly template with {weekday: day mask} (missing
+    weekdays are off) unless ``weekly`` is None, and set or (for a None
+    mask) drop {date: (day mask, reason)} ``exceptions``
+    """
+    exceptions = exceptions or {}
+    dropped = [day for day, (mask, _) in exceptions.items() if mask is None]
+    with transaction.atomic():
+        if weekly is not None:
+            WorkingHours.objects.filter(doctor_id=doctor_id).delete()
+            WorkingHours.objects.bulk_create([
+                WorkingHours(doctor_id=doctor_id, weekday=weekday, slots=to_bytes(weekly.get(weekday, 0)))
+                for weekday in range(7)
+            ])
+        if dropped:
+            ScheduleException.objects.filter(doctor_id=doctor_id, date__in=dropped).delete()
+        ScheduleException.objects.bulk_create(
+            [
+                ScheduleException(doctor_id=doctor_id, date=day, slots=to_bytes(mask), reason=reason)
+                for day, (mask, reason) in exceptions.items() if mask is not None
+            ],
+            update_conflicts=True,
+            unique_fields=['doctor', 'date'],
+            update_fields=['slots', 'reason'],
+        )
@@ -1,8 +1,14 @@
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth import authenticate
 from django.contrib.auth.password_validation import validate_password
 from authuser.models import User
-from .models import Appointment, MedicalRecord, PatientProfile
+from . import resources, schedule
+from .booking import claiming_slot
+from .models import (
+    Appointment, AppointmentSeries, AppointmentTransition, DoctorProfile, MedicalRecord, PatientProfile,
+    Resource, WaitlistEntry, WalkIn
+)
 from django.utils import timezone
 
 
@@ -63,8 +69,27 @@ class PatientProfileSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'created_at', 'updated_at']
     
     def get_age(self, obj):
-        """Get calculated age"""
-        return obj.get_age()
+        """Read the with_age() annotation (computed per row only for unannotated instances)"""
+        return obj.age if hasattr(obj, 'age') else obj.get_age()
+
+
+class DoctorProfileSerializer(serializers.ModelSerializer):
+    """Serializer for DoctorProfile model"""
+    user = UserSerializer(read_only=True)
+    
+    class Meta:
+        model = DoctorProfile
+        fields = '__all__'
+        read_only_fields = ['id', 'created_at', 'updated_at']
+
+
+class ResourceSerializer(serializers.ModelSerializer):
+    """Serializer for Resource model"""
+    
+    class Meta:
+        model = Resource
+        fields = '__all__'
+        read_only_fields = ['id', 'created_at', 'updated_at']
 
 
 class AppointmentSerializer(serializers.ModelSerializer):
@@ -73,48 +98,299 @@ class AppointmentSerializer(serializers.ModelSerializer):
     doctor = UserSerializer(read_only=True)
     patient_id = serializers.IntegerField(write_only=True)
     doctor_id = serializers.IntegerField(write_only=True)
+    resource_ids = serializers.ListField(
+        child=serializers.IntegerField(),
+        write_only=True,
+        required=False,
+        max_length=settings.APPOINTMENT_MAX_RESOURCES,
+        help_text='Rooms and equipment the appointment needs besides its doctor'
+    )
     is_upcoming = serializers.SerializerMethodField()
     can_be_cancelled = serializers.SerializerMethodField()
     
     class Meta:
         model = Appointment
         fields = '__all__'
-        read_only_fields = ['id', 'created_at', 'updated_at']
+        read_only_fields = [
+            'id', 'status', 'status_changed_at', 'series', 'occurrence', 'reminders_sent', 'created_at', 'updated_at'
+        ]
     
     def get_is_upcoming(self, obj):
-        """Get whether appointment is in the future"""
-        return obj.is_upcoming()
+        """Read the with_flags() annotation (computed per row only for unannotated instances)"""
+        return obj.upcoming if hasattr(obj, 'upcoming') else obj.is_upcoming()
     
     def get_can_be_cancelled(self, obj):
-        """Get whether appointment can be cancelled"""
-        return obj.can_be_cancelled()
+        """Read the with_flags() annotation (computed per row only for unannotated instances)"""
+        return obj.cancellable if hasattr(obj, 'cancellable') else obj.can_be_cancelled()
     
     def validate(self, attrs):
         """Validate appointment data"""
-        # Check if patient and doctor exist and have correct roles
-        try:
-            patient = User.objects.get(id=attrs['patient_id'], role='patient')
-            doctor = User.objects.get(id=attrs['doctor_id'], role='doctor')
-        except User.DoesNotExist:
+        # Check if patient and doctor exist and have correct roles (one query for both)
+        users = User.objects.in_bulk([attrs['patient_id'], attrs['doctor_id']])
+        patient = users.get(attrs['patient_id'])
+        doctor = users.get(attrs['doctor_id'])
+        if not patient or not doctor or not patient.is_patient() or not doctor.is_doctor():
             raise serializers.ValidationError('Invalid patient or doctor ID')
         
         # Check if appointment time is in the future
         if attrs['date_time'] <= timezone.now():
             raise serializers.ValidationError('Appointment must be scheduled for the future')
         
-        # Check for double-booking
-        existing_appointment = Appointment.objects.filter(
-            doctor=doctor,
-            date_time=attrs['date_time'],
-            status__in=['pending', 'confirmed']
-        ).first()
+        if attrs.get('resource_ids'):
+            attrs['resource_ids'] = sorted(set(attrs['resource_ids']))
+            if Resource.objects.filter(id__in=attrs['resource_ids'], active=True).count() != len(attrs['resource_ids']):
+                raise serializers.ValidationError('Invalid or inactive resource ID')
+        
+        # Double-booking and overlaps (of the doctor and of any resources) are
+        # caught around the write itself (see booking.claiming_slot), so there
+        # is no check-then-act window between concurrent bookings
+        del attrs['patient_id'], attrs['doctor_id']
+        attrs['patient'] = patient
+        attrs['doctor'] = doctor
+        return attrs
+    
+    def validate_duration(self, value):
+        """Check the appointment is not longer than the clinic allows"""
+        if value > settings.APPOINTMENT_MAX_MINUTES:
+            raise serializers.ValidationError(
+                f'Appointments can last at most {settings.APPOINTMENT_MAX_MINUTES} minutes'
+            )
+        return value
+    
+    def create(self, validated_data):
+        """Claim the slot (and resources) atomically, answering 409 if another booking won or overlaps them"""
+        resource_ids = validated_data.pop('resource_ids', None)
+        with claiming_slot(validated_data['doctor'].id, validated_data['date_time'], validated_data.get('duration')):
+            appointment = super().create(validated_data)
+            if resource_ids:
+                resources.reserve(appointment, resource_ids)
+            return appointment
+    
+    def update(self, instance, validated_data):
+        """Move the appointment (and its resources) atomically, answering 409 if the new time is taken"""
+        resource_ids = validated_data.pop('resource_ids', None)
+        moved = resource_ids is not None or 'date_time' in validated_data or 'duration' in validated_data
+        doctor = validated_data.get('doctor', instance.doctor)
+        with claiming_slot(
+            doctor.id,
+            validated_data.get('date_time', instance.date_time),
+            validated_data.get('duration', instance.duration),
+        ):
+            appointment = super().update(instance, validated_data)
+            if moved:
+                resources.move(appointment, resource_ids)
+            return appointment
+
+
+class AppointmentBulkItemSerializer(serializers.Serializer):
+    """Field-level validation of one item in a bulk booking (no database access)"""
+    patient_id = serializers.IntegerField()
+    doctor_id = serializers.IntegerField()
+    date_time = serializers.DateTimeField()
+    duration = serializers.IntegerField(required=False, min_value=1, max_value=settings.APPOINTMENT_MAX_MINUTES)
+    reason = serializers.CharField(required=False, allow_blank=True, default='')
+    notes = serializers.CharField(required=False, allow_blank=True, default='')
+    
+    def validate_date_time(self, value):
+        """Check if appointment time is in the future"""
+        if value <= timezone.now():
+            raise serializers.ValidationError('Appointment must be scheduled for the future')
+        return value
+
+
+class AppointmentBulkSerializer(serializers.Serializer):
+    """Serializer for a bulk booking request"""
+    MODE_CHOICES = [
+        ('all_or_nothing', 'All or nothing'),
+        ('best_effort', 'Best effort'),
+    ]
+    
+    mode = serializers.ChoiceField(choices=MODE_CHOICES, default='all_or_nothing')
+    appointments = serializers.ListField(
+        child=serializers.DictField(),
+        allow_empty=False,
+        max_length=settings.BULK_BOOKING_MAX_ITEMS
+    )
+
+
+class AppointmentBulkStatusSerializer(serializers.Serializer):
+    """Serializer for a bulk status transition request"""
+    ids = serializers.ListField(
+        child=serializers.IntegerField(),
+        allow_empty=False,
+        max_length=settings.BULK_BOOKING_MAX_ITEMS
+    )
+    status = serializers.ChoiceField(choices=['confirmed', 'completed', 'cancelled', 'no_show'])
+    backfill = serializers.BooleanField(default=True)
+
+
+class RescheduleSerializer(serializers.Serializer):
+    """Serializer for a request to move a doctor's appointments out of a date range"""
+    MODE_CHOICES = [
+        ('shift', "To the doctor's first free slots after the range"),
+        ('reassign', 'To colleagues of the same specialty, as close to the original time as possible'),
+    ]
+
+    start_date = serializers.DateField()
+    end_date = serializers.DateField()
+    mode = serializers.ChoiceField(choices=MODE_CHOICES, default='shift')
+    dry_run = serializers.BooleanField(default=False)
+
+    def validate(self, attrs):
+        """Check the range is ordered and not too long"""
+        if not 0 <= (attrs['end_date'] - attrs['start_date']).days < settings.RESCHEDULE_MAX_DAYS:
+            raise serializers.ValidationError(
+                f'end_date must be on or after start_date and within {settings.RESCHEDULE_MAX_DAYS} days'
+            )
+        return attrs
+
+
+class AppointmentSeriesSerializer(serializers.ModelSerializer):
+    """Serializer for AppointmentSeries model"""
+    patient_id = serializers.IntegerField(write_only=True)
+    doctor_id = serializers.IntegerField(write_only=True)
+    
+    class Meta:
+        model = AppointmentSeries
+        fields = '__all__'
+        read_only_fields = ['id', 'patient', 'doctor', 'active', 'materialized_until', 'created_at', 'updated_at']
+    
+    def validate(self, attrs):
+        """Validate series data"""
+        # Check if patient and doctor exist and have correct roles (one query for both)
+        users = User.objects.in_bulk([attrs['patient_id'], attrs['doctor_id']])
+        patient = users.get(attrs['patient_id'])
+        doctor = users.get(attrs['doctor_id'])
+        if not patient or not doctor or not patient.is_patient() or not doctor.is_doctor():
+            raise serializers.ValidationError('Invalid patient or doctor ID')
+        
+        if attrs['start'] <= timezone.now():
+            raise serializers.ValidationError('Series must start in the future')
+        
+        if attrs.get('until') and attrs['until'] < attrs['start']:
+            raise serializers.ValidationError('until must not be before start')
+        
+        del attrs['patient_id'], attrs['doctor_id']
+        attrs['patient'] = patient
+        attrs['doctor'] = doctor
+        # Nothing is materialized until the series is saved
+        attrs['materialized_until'] = attrs['start']
+        return attrs
+    
+    def validate_duration(self, value):
+        """Check the occurrences are not longer than the clinic allows"""
+        if value > settings.APPOINTMENT_MAX_MINUTES:
+            raise serializers.ValidationError(
+                f'Appointments can last at most {settings.APPOINTMENT_MAX_MINUTES} minutes'
+            )
+        return value
+
+
+class AppointmentTransitionSerializer(serializers.ModelSerializer):
+    """Serializer for one AppointmentTransition log entry"""
+    actor_name = serializers.CharField(source='actor.name', read_only=True, default=None)
+    
+    class Meta:
+        model = AppointmentTransition
+        fields = ['id', 'from_status', 'to_status', 'actor', 'actor_name', 'at', 'elapsed']
+        read_only_fields = fields
+
+
+class WaitlistEntrySerializer(serializers.ModelSerializer):
+    """Serializer for WaitlistEntry model"""
+    patient_id = serializers.IntegerField(write_only=True)
+    doctor_id = serializers.IntegerField(write_only=True)
+    
+    class Meta:
+        model = WaitlistEntry
+        fields = '__all__'
+        read_only_fields = [
+            'id', 'patient', 'doctor', 'status', 'offered_slot', 'offered_duration', 'offer_expires_at',
+            'appointment', 'created_at', 'updated_at'
+        ]
+    
+    def validate(self, attrs):
+        """Validate waitlist entry data"""
+        # Check if patient and doctor exist and have correct roles (one query for both)
+        users = User.objects.in_bulk([attrs['patient_id'], attrs['doctor_id']])
+        patient = users.get(attrs['patient_id'])
+        doctor = users.get(attrs['doctor_id'])
+        if not patient or not doctor or not patient.is_patient() or not doctor.is_doctor():
+            raise serializers.ValidationError('Invalid patient or doctor ID')
+        
+        if attrs['latest'] <= timezone.now():
+            raise serializers.ValidationError('Waitlist window must end in the future')
         
-        if existing_appointment:
-            raise serializers.ValidationError('Doctor is already booked at this time')
+        if attrs['latest'] <= attrs['earliest']:
+            raise serializers.ValidationError('latest must be after earliest')
         
+        del attrs['patient_id'], attrs['doctor_id']
+        attrs['patient'] = patient
+        attrs['doctor'] = doctor
         return attrs
 
 
+class WalkInSerializer(serializers.ModelSerializer):
+    """Serializer for WalkIn model"""
+    patient_id = serializers.IntegerField(write_only=True, required=False, allow_null=True)
+    priority_display = serializers.CharField(source='get_priority_display', read_only=True)
+    
+    class Meta:
+        model = WalkIn
+        fields = '__all__'
+        read_only_fields = [
+            'id', 'patient', 'doctor', 'status', 'arrived_at', 'called_at', 'created_at', 'updated_at'
+        ]
+    
+    def validate(self, attrs):
+        """Validate walk-in data"""
+        patient_id = attrs.pop('patient_id', None)
+        if patient_id is not None:
+            patient = User.objects.filter(id=patient_id, role='patient').first()
+            if not patient:
+                raise serializers.ValidationError('Invalid patient ID')
+            attrs['patient'] = patient
+        return attrs
+
+
+class WalkInPrioritySerializer(serializers.Serializer):
+    """Serializer for a triage priority change"""
+    priority = serializers.ChoiceField(choices=WalkIn.PRIORITY_CHOICES)
+
+
+class WorkingWindowsField(serializers.ListField):
+    """One day's [["HH:MM", "HH:MM"], ...] working windows, held as a schedule day mask"""
+    child = serializers.ListField(child=serializers.CharField(), min_length=2, max_length=2)
+    
+    def to_internal_value(self, data):
+        try:
+            return schedule.encode(super().to_internal_value(data))
+        except ValueError as error:
+            raise serializers.ValidationError(str(error))
+    
+    def to_representation(self, value):
+        return [list(window) for window in schedule.decode(value)]
+
+
+class ScheduleExceptionSerializer(serializers.Serializer):
+    """Serializer for one dated working-hours override (null hours remove it)"""
+    date = serializers.DateField()
+    hours = WorkingWindowsField(allow_null=True)
+    reason = serializers.CharField(max_length=200, required=False, allow_blank=True, default='')
+
+
+class WorkingHoursSerializer(serializers.Serializer):
+    """Serializer for a doctor's weekly template (weekday -> windows) and dated overrides"""
+    weekly = serializers.DictField(child=WorkingWindowsField(), required=False)
+    exceptions = ScheduleExceptionSerializer(many=True, required=False)
+    
+    def validate_weekly(self, value):
+        """Keys are weekdays, 0 (Monday) to 6 (Sunday); missing weekdays are days off"""
+        if not set(value) <= {str(weekday) for weekday in range(7)}:
+            raise serializers.ValidationError('Weekdays must be 0 (Monday) to 6 (Sunday)')
+        return {int(weekday): mask for weekday, mask in value.items()}
+
+
 class MedicalRecordSerializer(serializers.ModelSerializer):
     """Serializer for MedicalRecord model"""
     patient = UserSerializer(read_only=True)
@@ -154,10 +430,10 @@ class AppointmentListSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Appointment
-        fields = ['id', 'patient_name', 'doctor_name', 'date_time', 'status', 'reason', 'is_upcoming']
+        fields = ['id', 'patient_name', 'doctor_name', 'date_time', 'duration', 'status', 'reason', 'is_upcoming']
     
     def get_is_upcoming(self, obj):
-        return obj.is_upcoming()
+        return obj.upcoming if hasattr(obj, 'upcoming') else obj.is_upcoming()
 
 
 class MedicalRecordListSerializer(serializers.ModelSerializer):
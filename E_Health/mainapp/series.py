@@ -0,0 +1,206 @@
+"""
+Recurring appointment series.
+
+A series is stored as its rule only. Occurrences become ``Appointment`` rows
+when the rolling horizon (``SERIES_HORIZON_DAYS``) reaches them; occurrences
+past a series' ``materialized_until`` are virtual reservations. Lookups find
+the few series that reach into a time window through the
+(doctor, active, materialized_until) index and compute just the occurrences
+inside that window arithmetically, so no series is ever expanded in full.
+"""
+from datetime import timedelta
+from math import lcm
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from . import availability, signals
+from .clinic_time import clinic_date, clinic_datetime, clinic_timezone
+from .models import Appointment, AppointmentSeries, AppointmentTransition
+
+
+class SeriesConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'Some occurrences of the series clash with existing bookings'
+    default_code = 'series_conflict'
+
+
+def series_conflict(clashes):
+    return SeriesConflict({
+        'error': SeriesConflict.default_detail,
+        'conflicts': [date_time.isoformat() for date_time in clashes],
+    })
+
+
+def occurrence_at(series, index):
+    """Return the datetime of occurrence ``index``, keeping the clinic wall-clock time"""
+    first = timezone.localtime(series.start, clinic_timezone())
+    return clinic_datetime(first.date() + timedelta(days=index * series.step_days()), first.time())
+
+
+def occurrences(series, start, end):
+    """Yield (index, date_time) for the series' occurrences in [start, end)"""
+    step = series.step_days()
+    # Jump straight to the first occurrence that can fall in the window
+    index = max(0, (clinic_date(start) - clinic_date(series.start)).days // step - 1)
+    while series.count is None or index < series.count:
+        date_time = occurrence_at(series, index)
+        if date_time >= end or (series.until is not None and date_time > series.until):
+            return
+        if date_time >= start:
+            yield index, date_time
+        index += 1
+
+
+def occurrence_length(series):
+    return timedelta(minutes=series.duration)
+
+
+def reaching_series(doctor_ids, start, end):
+    """Active series of ``doctor_ids`` that may have virtual occurrences overlapping [start, end)"""
+    return AppointmentSeries.objects.filter(
+        Q(until__isnull=True) | Q(until__gt=start - availability.max_duration()),
+        doctor_id__in=doctor_ids,
+        active=True,
+        materialized_until__lt=end,
+        start__lt=end,
+    )
+
+
+def series_reservations(series, start, end):
+    """Yield (doctor_id, date_time, minutes) of the series' not-yet-materialized occurrences overlapping [start, end)"""
+    # An occurrence starting up to its length before ``start`` still runs into the window
+    window_start = max(start - occurrence_length(series) + timedelta(microseconds=1), series.materialized_until)
+    for _, date_time in occurrences(series, window_start, end):
+        yield series.doctor_id, date_time, series.duration
+
+
+def virtual_reservations(doctor_ids, start, end):
+    """Yield (doctor_id, date_time, minutes) of not-yet-materialized occurrences overlapping [start, end)"""
+    for series in reaching_series(doctor_ids, start, end):
+        yield from series_reservations(series, start, end)
+
+
+def is_virtually_reserved(doctor_id, start, end):
+    """Whether a virtual occurrence already holds any of the doctor's time in [start, end)"""
+    return any(True for _ in virtual_reservations([doctor_id], start, end))
+
+
+def conflicts(series):
+    """
+    Sorted start times of the series' occurrences that overlap an active
+    appointment of its doctor or a virtual occurrence of another of the
+    doctor's active series. Two series repeat together every
+    lcm(step, other step) days, so a clash with another series is looked for
+    (and reported) within the first such period only.
+    """
+    length = occurrence_length(series)
+    clashes = set()
+
+    def overlapping(start, end):
+        """Start times of the series' occurrences overlapping [start, end)"""
+        return (date_time for _, date_time in occurrences(series, start - length + timedelta(microseconds=1), end))
+
+    booked = Appointment.objects.filter(
+        doctor_id=series.doctor_id,
+        status__in=Appointment.ACTIVE_STATUSES,
+        date_time__gt=series.start - availability.max_duration(),
+    ).order_by().values_list('date_time', 'duration')
+    for date_time, minutes in booked:
+        clashes.update(overlapping(date_time, date_time + timedelta(minutes=minutes)))
+
+    others = AppointmentSeries.objects.filter(
+        Q(until__isnull=True) | Q(until__gt=series.start - availability.max_duration()),
+        doctor_id=series.doctor_id,
+        active=True,
+    ).exclude(pk=series.pk)
+    for other in others:
+        start = max(series.start, other.materialized_until)
+        end = start + timedelta(days=lcm(series.step_days(), other.step_days()) + 1)
+        for _, date_time, minutes in series_reservations(other, start, end):
+            clashes.update(overlapping(date_time, date_time + timedelta(minutes=minutes)))
+    return sorted(clashes)
+
+
+def horizon_end(now=None):
+    return (now or timezone.now()) + timedelta(days=settings.SERIES_HORIZON_DAYS)
+
+
+def materialize(series, until=None, now=None):
+    """
+    Write the series' occurrences between its watermark and ``until`` as
+    pending appointments. Occurrences that would overlap another active
+    appointment, fully or in part, are skipped. Returns how many occurrences
+    in the window now exist as appointments, and the start times of the
+    skipped ones.
+    """
+    from .booking import commit_bulk_booking
+
+    now = now or timezone.now()
+    until = until or horizon_end(now)
+    if not series.active or until <= series.materialized_until:
+        return 0, []
+
+    due = dict(occurrences(series, max(series.materialized_until, now), until))
+    existing = set(Appointment.objects.filter(
+        series=series, occurrence__in=due, status__in=Appointment.ACTIVE_STATUSES
+    ).values_list('occurrence', flat=True))
+    length = occurrence_length(series)
+    busy = availability.nearby_intervals(
+        (series.doctor_id, date_time, date_time + length) for index, date_time in due.items() if index not in existing
+    )
+    planned, skipped = {}, []
+    for index, date_time in due.items():
+        if index in existing:
+            continue
+        if availability.collides(busy.get(series.doctor_id, []), date_time, date_time + length):
+            skipped.append(date_time)
+            continue
+        planned[index] = Appointment(
+            patient_id=series.patient_id,
+            doctor_id=series.doctor_id,
+            date_time=date_time,
+            duration=series.duration,
+            reason=series.reason,
+            series=series,
+            occurrence=index,
+        )
+
+    with transaction.atomic():
+        # A booking racing in after the check above loses its overlap to
+        # check_written, and the occurrence it hits is skipped
+        created, errors = commit_bulk_booking(planned, all_or_nothing=False) if planned else ({}, {})
+        series.materialized_until = until
+        series.save(update_fields=['materialized_until', 'updated_at'])
+
+    skipped.extend(planned[index].date_time for index in errors)
+    return len(existing) + len(created), sorted(skipped)
+
+
+def stop(series, now=None):
+    """End the series now, cancel its upcoming occurrences and return their freed (doctor_id, date_time, minutes)"""
+    now = now or timezone.now()
+    with transaction.atomic():
+        series.active = False
+        series.until = now
+        series.save(update_fields=['active', 'until', 'updated_at'])
+        upcoming = Appointment.objects.filter(
+            series=series, date_time__gt=now, status__in=Appointment.ACTIVE_STATUSES
+        )
+        cancelled = list(upcoming.values_list(
+            'id', 'doctor_id', 'date_time', 'duration', 'status', 'status_changed_at'
+        ))
+        upcoming.update(status='cancelled', status_changed_at=now, updated_at=now)
+        AppointmentTransition.record(
+            [(pk, status, since) for pk, _, _, _, status, since in cancelled], 'cancelled', at=now
+        )
+
+    signals.appointments_changed((doctor_id, date_time) for _, doctor_id, date_time, _, _, _ in cancelled)
+    signals.statuses_changed(
+        (pk, doctor_id, date_time, 'cancelled') for pk, doctor_id, date_time, _, _, _ in cancelled
+    )
+    return [(doctor_id, date_time, duration) for _, doctor_id, date_time, duration, _, _ in cancelled]
@@ -0,0 +1,75 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from authuser.models import User
+from . import agenda, availability, live, monthly
+from .models import Appointment, AppointmentSeries, ScheduleException, WorkingHours
+
+
+def appointments_changed(slots):
+    """
+    Drop every cache derived from the given (doctor_id, date_time) slots.
+
+    Model signals call this for single-row writes; bulk writes that bypass
+    signals (``bulk_create``, ``QuerySet.update``) must call it themselves.
+    """
+    slots = set(slots)
+    for doctor_id, date_time in slots:
+        availability.invalidate(doctor_id, date_time)
+        agenda.invalidate(doctor_id, date_time)
+    monthly.invalidate(slots)
+
+
+@receiver([post_save, post_delete], sender=Appointment)
+def invalidate_appointment_caches(sender, instance, **kwargs):
+    """Drop cached data for the doctor-days this appointment occupies or left"""
+    slots = [(instance.doctor_id, instance.date_time)]
+    doctor_id, date_time = getattr(instance, '_loaded_slot', (None, None))
+    if date_time is not None:
+        slots.append((doctor_id, date_time))
+    appointments_changed(slots)
+    instance._loaded_slot = (instance.doctor_id, instance.date_time)
+
+
+def statuses_changed(changes):
+    """
+    Announce (id, doctor_id, date_time, status) changes to live subscribers.
+
+    Model signals call this for single-row writes; bulk writes that bypass
+    signals must call it themselves, like ``appointments_changed``.
+    """
+    live.publish_status_changes(changes)
+
+
+@receiver(post_save, sender=Appointment)
+def announce_status_change(sender, instance, created=False, **kwargs):
+    """Push new bookings and status changes to live subscribers"""
+    if created or instance.status != getattr(instance, '_loaded_status', None):
+        statuses_changed([(instance.id, instance.doctor_id, instance.date_time, instance.status)])
+    instance._loaded_status = instance.status
+
+
+@receiver(post_delete, sender=Appointment)
+def announce_deletion(sender, instance, **kwargs):
+    statuses_changed([(instance.id, instance.doctor_id, instance.date_time, 'deleted')])
+
+
+@receiver([post_save, post_delete], sender=AppointmentSeries)
+def invalidate_series_caches(sender, instance, **kwargs):
+    """A series can reserve any future day of its doctor"""
+    availability.invalidate_doctor(instance.doctor_id)
+
+
+@receiver([post_save, post_delete], sender=WorkingHours)
+@receiver([post_save, post_delete], sender=ScheduleException)
+def invalidate_working_hours_caches(sender, instance, **kwargs):
+    """Working hours shape every day of the doctor's availability"""
+    availability.invalidate_doctor(instance.doctor_id)
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_caches(sender, instance, created=False, update_fields=None, **kwargs):
+    """Agendas show user names; a new user or a login cannot change them"""
+    if created or (update_fields is not None and 'name' not in update_fields):
+        return
+    agenda.clear()
@@ -0,0 +1,124 @@
+"""
+Expiry of stale pending appointments.
+
+A pending appointment that no doctor confirms is cancelled once it is older
+than ``PENDING_EXPIRY_HOURS`` or its time has passed, which frees its slot
+for the waitlist and keeps it out of the dashboard's pending count. Stale
+rows are found through the (status, date_time) and (status, created_at)
+indexes and cancelled a chunk at a time, each chunk in its own short
+transaction, so SQLite's write lock is never held for more than one
+``SWEEP_CHUNK_SIZE`` UPDATE and bookings keep going during a large sweep.
+"""
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from . import waitlist
+from .models import Appointment, AppointmentTransition
+from .signals import appointments_changed, statuses_changed
+
+
+logger = logging.getLogger(__name__)
+
+
+def stale_querysets(now, max_age):
+    """Pending rows whose time has passed, then pending rows older than ``max_age``"""
+    pending = Appointment.objects.filter(status='pending')
+    return [
+        pending.filter(date_time__lte=now).order_by('date_time'),
+        pending.filter(created_at__lte=now - max_age).order_by('created_at'),
+    ]
+
+
+def expire_chunk(queryset, now, chunk_size):
+    """
+    Cancel up to ``chunk_size`` rows of ``queryset``; returns the (id,
+    doctor_id, date_time, duration, since) moved
+    """
+    with transaction.atomic():
+        rows = list(queryset.values_list('id', 'doctor_id', 'date_time', 'duration', 'status_changed_at')[:chunk_size])
+        if not rows:
+            return []
+        ids = [row[0] for row in rows]
+        updated = Appointment.objects.filter(id__in=ids, status='pending').update(
+            status='cancelled', status_changed_at=now, updated_at=now
+        )
+        if updated != len(ids):
+            # Someone confirmed or cancelled a few since the read; keep the rows this UPDATE moved
+            moved = set(Appointment.objects.filter(id__in=ids, status='cancelled', updated_at=now).values_list(
+                'id', flat=True
+            ))
+            rows = [row for row in rows if row[0] in moved]
+        AppointmentTransition.record([(pk, 'pending', since) for pk, _, _, _, since in rows], 'cancelled', at=now)
+
+    appointments_changed((doctor_id, date_time) for _, doctor_id, date_time, _, _ in rows)
+    statuses_changed((pk, doctor_id, date_time, 'cancelled') for pk, doctor_id, date_time, _, _ in rows)
+    waitlist.backfill([(doctor_id, date_time, duration) for _, doctor_id, date_time, duration, _ in rows], now)
+    return rows
+
+
+def sweep(now=None, max_age=None, chunk_size=None, pause=0):
+    """
+    Cancel every stale pending appointment, ``pause`` seconds between chunks.
+    Returns {'expired': n, 'chunks': n, 'seconds': s}.
+    """
+    started = time.monotonic()
+    now = now or timezone.now()
+    if max_age is None:
+        max_age = timedelta(hours=settings.PENDING_EXPIRY_HOURS)
+    chunk_size = chunk_size or settings.SWEEP_CHUNK_SIZE
+
+    expired = chunks = 0
+    for queryset in stale_querysets(now, max_age):
+        while True:
+            rows = expire_chunk(queryset, now, chunk_size)
+            if not rows:
+                break
+            expired += len(rows)
+            chunks += 1
+            if pause:
+                time.sleep(pause)
+
+    # Offers that lapsed unanswered move on even when nothing was cancelled
+    waitlist.backfill([], now)
+    result = {'expired': expired, 'chunks': chunks, 'seconds': time.monotonic() - started}
+    logger.info('Expired %(expired)d pending appointments in %(chunks)d chunks (%(seconds).2fs)', result)
+    return result
+
+
+class PeriodicSweeper(threading.Thread):
+    """Daemon thread running ``sweep`` every ``interval`` seconds until stopped"""
+
+    def __init__(self, interval):
+        super().__init__(name='pending-sweeper', daemon=True)
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                sweep(pause=settings.SWEEP_CHUNK_PAUSE)
+            except Exception:
+                logger.exception('Pending appointment sweep failed')
+            finally:
+                close_old_connections()
+
+    def stop(self):
+        self.stopped.set()
+
+
+runner = None
+
+
+def start_periodic(interval=None):
+    """Start this process's periodic sweeper (once); returns it"""
+    global runner
+    if runner is None:
+        runner = PeriodicSweeper(interval or settings.SWEEP_INTERVAL_SECONDS)
+        runner.start()
+    return runner
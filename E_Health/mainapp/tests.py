@@ -1,3 +1,2171 @@
-from django.test import TestCase
+import asyncio
+import os
+import tempfile
+import threading
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Avg, Count, Max
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+import numpy as np
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, APITestCase
+
+from authuser.models import User
+from .models import (
+    Appointment, AppointmentSeries, AppointmentTransition, DoctorProfile, MedicalRecord, NoShowModel, NoShowScore,
+    PatientProfile, Resource, ResourceReservation, WaitlistEntry, WalkIn
+)
+from . import (
+    agenda, availability, booking, ical, live, monthly, noshow, reminders, reschedule, resources, schedule, series,
+    sweeper, transitions, triage, waitlist
+)
+from .clinic_time import clinic_datetime, clinic_today, day_range_filter, day_window
+from .pagination import KeysetPagination
+from .views import (
+    AppointmentSeriesViewSet, AppointmentViewSet, DashboardViewSet, DoctorProfileViewSet, DoctorViewSet,
+    MedicalRecordViewSet, PatientProfileViewSet, ResourceViewSet, WaitlistViewSet, WalkInViewSet
+)
+
+
+def make_user(role, index=0):
+    return User.objects.create_user(
+        email=f'{role}{index}@example.com', password=None, name=f'{role} {index}', role=role
+    )
+
+
+class QueryBudgetTestCase(APITestCase):
+    """
+    Harness that runs an endpoint and fails when it issues more SQL queries
+    than the viewset's ``query_budget`` allows for that action.
+    """
+
+    def assertWithinBudget(self, viewset, action, method, url, user, data=None):
+        budget = viewset.query_budget[action]
+        self.client.force_authenticate(user=user)
+        extra = {} if method == 'get' else {'format': 'json'}
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, data, **extra)
+        self.assertLess(response.status_code, 400, response.content)
+        self.assertLessEqual(
+            len(queries), budget,
+            f'{viewset.__name__}.{action} ran {len(queries)} queries (budget {budget}):\n'
+            + '\n'.join(query['sql'] for query in queries.captured_queries)
+        )
+        return len(queries)
+
+
+class KeysetPaginationTests(APITestCase):
+    """Cursor pages of /api/appointments/ and of other orderings"""
+
+    def setUp(self):
+        self.admin = make_user('admin')
+        self.doctors = [make_user('doctor', i) for i in range(3)]
+        self.patient = make_user('patient')
+        self.base = timezone.now() + timedelta(days=1)
+        # Three doctors share every start, so the ordering key ties on date_time
+        for minutes in range(0, 7 * 30, 30):
+            for doctor in self.doctors:
+                Appointment.objects.create(
+                    patient=self.patient, doctor=doctor, date_time=self.base + timedelta(minutes=minutes),
+                    status='confirmed' if minutes % 60 else 'pending'
+                )
+        self.client.force_authenticate(user=self.admin)
+
+    def walk(self, url, link='next'):
+        """Follow ``link`` from ``url`` to the end, returning the ids of each page"""
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, response.data)
+            pages.append([row['id'] for row in response.data['results']])
+            url = response.data[link]
+        return pages
+
+    def paginate(self, queryset, query=''):
+        """Run KeysetPagination over ``queryset`` for a GET with ``query``"""
+        paginator = KeysetPagination()
+        request = Request(APIRequestFactory().get(f'/rows/{query}'))
+        rows = paginator.paginate_queryset(queryset, request)
+        return paginator, [row.id for row in rows]
+
+    def test_next_and_previous_links_walk_every_row_once(self):
+        expected = list(Appointment.objects.order_by('-date_time', '-id').values_list('id', flat=True))
+        pages = self.walk('/api/appointments/?page_size=4')
+        self.assertEqual([len(page) for page in pages], [4, 4, 4, 4, 4, 1])
+        self.assertEqual(sum(pages, []), expected)
+
+        last = self.client.get('/api/appointments/?page_size=4')
+        for _ in range(5):
+            last = self.client.get(last.data['next'])
+        self.assertIsNone(last.data['next'])
+        back = self.walk(last.data['previous'], link='previous')
+        self.assertEqual(back, pages[-2::-1])
+
+    def test_inserted_rows_do_not_shift_later_pages(self):
+        first = self.client.get('/api/appointments/?page_size=6')
+        seen = [row['id'] for row in first.data['results']]
+        # A row ahead of the cursor and one behind it
+        earlier = Appointment.objects.create(
+            patient=self.patient, doctor=self.doctors[0], date_time=self.base + timedelta(days=1)
+        )
+        later = Appointment.objects.create(
+            patient=self.patient, doctor=self.doctors[0], date_time=self.base - timedelta(hours=1)
+        )
+
+        rest = sum(self.walk(first.data['next']), [])
+        self.assertNotIn(earlier.id, rest)
+        self.assertEqual(rest[-1], later.id)
+        self.assertEqual(len(seen) + len(rest), Appointment.objects.count() - 1)
+        self.assertFalse(set(seen) & set(rest))
+
+    def test_mixed_directions_break_ties_on_id(self):
+        queryset = Appointment.objects.order_by('status', '-date_time')
+        paginator, _ = self.paginate(queryset)
+        # The tiebreaker follows the leading field's direction
+        self.assertEqual(paginator.ordering, ['status', '-date_time', 'id'])
+
+        expected = list(queryset.order_by('status', '-date_time', 'id').values_list('id', flat=True))
+        ids, query = [], '?page_size=5'
+        while query is not None:
+            paginator, page = self.paginate(queryset, query)
+            ids += page
+            link = paginator.get_next_link()
+            query = link and link[link.index('?'):]
+        self.assertEqual(ids, expected)
+
+    def test_page_size_is_clamped(self):
+        for value, size in (('3', 3), ('0', 50), ('-2', 50), ('many', 50), ('1000', 200)):
+            paginator, _ = self.paginate(Appointment.objects.all(), f'?page_size={value}')
+            self.assertEqual(paginator.page_size, size, value)
+
+    def test_tampered_or_foreign_cursor_is_404(self):
+        link = self.client.get('/api/appointments/?page_size=4').data['next']
+        cursor = link.split('cursor=')[1].split('&')[0]
+        self.assertEqual(self.client.get(f'/api/appointments/?cursor={cursor[:-2]}xx').status_code, 404)
+        self.assertEqual(self.client.get('/api/appointments/?cursor=garbage').status_code, 404)
+
+        # A validly signed cursor for a different ordering key does not apply here
+        paginator, _ = self.paginate(Appointment.objects.order_by('status', '-date_time'), '?page_size=2')
+        foreign = paginator.get_next_link().split('cursor=')[1]
+        self.assertEqual(self.client.get(f'/api/appointments/?cursor={foreign}').status_code, 404)
+
+
+class EndpointQueryBudgetTests(QueryBudgetTestCase):
+    """Every budgeted action stays within budget at one row and at many rows"""
+
+    def setUp(self):
+        self.admin = make_user('admin')
+        self.doctor = make_user('doctor')
+        self.patient = make_user('patient')
+        self.base = timezone.now() + timedelta(hours=1)
+
+    def seed(self, count):
+        """Add ``count`` appointments, patients, profiles and records for the doctor"""
+        start = Appointment.objects.count()
+        for i in range(start, start + count):
+            patient = self.patient if i == 0 else make_user('patient', i)
+            PatientProfile.objects.get_or_create(user=patient)
+            appointment = Appointment.objects.create(
+                patient=patient, doctor=self.doctor,
+                date_time=self.base + timedelta(minutes=15 * i), status='pending'
+            )
+            MedicalRecord.objects.create(
+                patient=patient, doctor=self.doctor, appointment=appointment,
+                symptoms='cough', diagnosis='cold'
+            )
+
+    def read_endpoints(self):
+        appointment = Appointment.objects.filter(patient=self.patient).first()
+        record = MedicalRecord.objects.filter(patient=self.patient).first()
+        profile = PatientProfile.objects.get(user=self.patient)
+        return [
+            (AppointmentViewSet, 'list', '/api/appointments/'),
+            (AppointmentViewSet, 'retrieve', f'/api/appointments/{appointment.id}/'),
+            (AppointmentViewSet, 'upcoming', '/api/appointments/upcoming/'),
+            (AppointmentViewSet, 'today', '/api/appointments/today/'),
+            (MedicalRecordViewSet, 'list', '/api/medical-records/'),
+            (MedicalRecordViewSet, 'retrieve', f'/api/medical-records/{record.id}/'),
+            (MedicalRecordViewSet, 'patient_history',
+             f'/api/medical-records/patient_history/?patient_id={self.patient.id}'),
+            (PatientProfileViewSet, 'list', '/api/patient-profiles/'),
+            (PatientProfileViewSet, 'retrieve', f'/api/patient-profiles/{profile.id}/'),
+        ]
+
+    def test_every_action_declares_a_budget(self):
+        for viewset in (AppointmentViewSet, AppointmentSeriesViewSet, DoctorProfileViewSet, MedicalRecordViewSet,
+                        PatientProfileViewSet, ResourceViewSet, WaitlistViewSet, WalkInViewSet):
+            actions = {'list', 'retrieve'} | {a.__name__ for a in viewset.get_extra_actions()}
+            self.assertEqual(actions - set(viewset.query_budget), set(), viewset.__name__)
+        for viewset in (DashboardViewSet, DoctorViewSet):
+            actions = {a.__name__ for a in viewset.get_extra_actions()}
+            self.assertEqual(actions - set(viewset.query_budget), set(), viewset.__name__)
+
+    def test_read_endpoints_are_constant_in_result_size(self):
+        self.seed(1)
+        small = {
+            (viewset, action, user): self.assertWithinBudget(viewset, action, 'get', url, user)
+            for user in (self.admin, self.doctor)
+            for viewset, action, url in self.read_endpoints()
+        }
+
+        self.seed(20)
+        for user in (self.admin, self.doctor):
+            for viewset, action, url in self.read_endpoints():
+                count = self.assertWithinBudget(viewset, action, 'get', url, user)
+                self.assertEqual(count, small[viewset, action, user], f'{viewset.__name__}.{action}')
+
+    def test_status_transitions_within_budget(self):
+        self.seed(3)
+        pending = list(Appointment.objects.exclude(patient=self.patient))
+
+        self.assertWithinBudget(
+            AppointmentViewSet, 'confirm', 'post', f'/api/appointments/{pending[0].id}/confirm/', self.doctor
+        )
+        self.assertWithinBudget(
+            AppointmentViewSet, 'complete', 'post', f'/api/appointments/{pending[0].id}/complete/', self.doctor
+        )
+        own = Appointment.objects.get(patient=self.patient)
+        self.assertWithinBudget(
+            AppointmentViewSet, 'cancel', 'post', f'/api/appointments/{own.id}/cancel/', self.patient
+        )
+
+    def test_dashboard_within_budget(self):
+        self.admin.is_staff = True
+        self.admin.save()
+        self.seed(12)
+        self.assertWithinBudget(DashboardViewSet, 'stats', 'get', '/api/dashboard/stats/', self.admin)
+        self.assertWithinBudget(
+            DashboardViewSet, 'recent_activity', 'get', '/api/dashboard/recent_activity/', self.admin
+        )
+
+
+class AvailabilityTests(QueryBudgetTestCase):
+    """Free-slot computation, caching and invalidation"""
+
+    def setUp(self):
+        cache.clear()
+        self.doctor = make_user('doctor')
+        self.patient = make_user('patient')
+        # A Monday far enough ahead that no slot is in the past
+        self.day = timezone.localdate() + timedelta(days=7 - timezone.localdate().weekday() + 7)
+
+    def at(self, hour, minute=0):
+        return timezone.make_aware(datetime.combine(self.day, time(hour, minute)))
+
+    def url(self):
+        return f'/api/doctors/{self.doctor.id}/availability/?from={self.day}&to={self.day}'
+
+    def test_interval_helpers(self):
+        merged = availability.merge_intervals([(self.at(9), self.at(10)), (self.at(9, 30), self.at(11)),
+                                               (self.at(14), self.at(15))])
+        self.assertEqual(merged, [(self.at(9), self.at(11)), (self.at(14), self.at(15))])
+        free = availability.subtract_intervals([(self.at(8), self.at(12))], merged)
+        self.assertEqual(free, [(self.at(8), self.at(9)), (self.at(11), self.at(12))])
+
+    def test_booked_and_offgrid_slots_are_not_free(self):
+        Appointment.objects.create(patient=self.patient, doctor=self.doctor, date_time=self.at(9))
+        Appointment.objects.create(patient=self.patient, doctor=self.doctor, date_time=self.at(10, 10))
+        Appointment.objects.create(
+            patient=self.patient, doctor=self.doctor, date_time=self.at(11), status='cancelled'
+        )
+
+        slots = availability.get_available_slots(self.doctor.id, self.day, self.day)
+        starts = [start for start, _ in slots]
+        self.assertNotIn(self.at(9), starts)
+        self.assertNotIn(self.at(10), starts)
+        self.assertNotIn(self.at(10, 30), starts)
+        self.assertIn(self.at(11), starts)
+        self.assertNotIn(self.at(12), starts)  # lunch break
+        self.assertEqual(len(starts), 16 - 3)
+
+    def test_cached_read_and_invalidation_on_save(self):
+        self.assertWithinBudget(DoctorViewSet, 'availability', 'get', self.url(), self.patient)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url())
+        self.assertEqual(len(queries), 1)  # only the doctor lookup
+
+        appointment = Appointment.objects.create(patient=self.patient, doctor=self.doctor, date_time=self.at(8))
+        starts = [slot['start'] for slot in self.client.get(self.url()).data['slots']]
+        self.assertNotIn(self.at(8), starts)
+
+        appointment.status = 'cancelled'
+        appointment.save()
+        starts = [slot['start'] for slot in self.client.get(self.url()).data['slots']]
+        self.assertIn(self.at(8), starts)
+
+    def test_rejects_bad_ranges(self):
+        self.client.force_authenticate(user=self.patient)
+        base = f'/api/doctors/{self.doctor.id}/availability/'
+        self.assertEqual(self.client.get(base + '?from=nope').status_code, 400)
+        self.assertEqual(self.client.get(base + f'?from={self.day}&to={self.day - timedelta(days=1)}').status_code, 400)
+
+
+class WorkingHoursTests(QueryBudgetTestCase):
+    """Per-doctor working-hours bitmaps and the free-time bitmaps built on them"""
+
+    def setUp(self):
+        cache.clear()
+        self.doctor = make_user('doctor')
+        self.other_doctor = make_user('doctor', 1)
+        self.patient = make_user('patient')
+        # A Monday far enough ahead that no slot is in the past
+        self.day = clinic_today() + timedelta(days=7 - clinic_today().weekday() + 7)
+
+    def at(self, hour, minute=0, days=0):
+        return timezone.make_aware(datetime.combine(self.day + timedelta(days=days), time(hour, minute)))
+
+    def put(self, user, data):
+        self.client.force_authenticate(user=user)
+        return self.client.put(f'/api/doctors/{self.doctor.id}/working-hours/', data, format='json')
+
+    def starts(self, day):
+        return [start for start, _ in availability.get_available_slots(self.doctor.id, day, day)]
+
+    def test_masks_round_trip_on_the_grid(self):
+        mask = schedule.encode([('08:00', '12:00'), ('13:00', '24:00')])
+        self.assertEqual(bin(mask).count('1'), 16 + 44)
+        self.assertEqual(schedule.decode(mask), [('08:00', '12:00'), ('13:00', '24:00')])
+        self.assertEqual(schedule.from_bytes(schedule.to_bytes(mask)), mask)
+        self.assertEqual(len(schedule.to_bytes(mask)), 12)
+        with self.assertRaises(ValueError):
+            schedule.encode([('08:10', '12:00')])
+
+    def test_template_and_exception_drive_availability(self):
+        self.assertEqual(len(self.starts(self.day)), 16)  # clinic default hours
+
+        response = self.put(self.doctor, {
+            'weekly': {'0': [['09:00', '11:00']], '1': [['14:00', '15:00']]},
+            'exceptions': [{'date': self.day + timedelta(days=1), 'hours': [], 'reason': 'Leave'}],
+        })
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertFalse(response.data['default'])
+        self.assertEqual(response.data['weekly'][0], [('09:00', '11:00')])
+        self.assertEqual(response.data['exceptions'][0]['reason'], 'Leave')
+
+        self.assertEqual(self.starts(self.day), [self.at(9), self.at(9, 30), self.at(10), self.at(10, 30)])
+        self.assertEqual(self.starts(self.day + timedelta(days=1)), [])
+        self.assertEqual(self.starts(self.day + timedelta(days=2)), [])  # Wednesday is now off
+
+        self.put(self.doctor, {'exceptions': [{'date': self.day + timedelta(days=1), 'hours': None}]})
+        self.assertEqual(self.starts(self.day + timedelta(days=1)), [self.at(14, days=1), self.at(14, 30, days=1)])
+
+    def test_update_is_validated_and_within_budget(self):
+        self.assertEqual(self.put(self.patient, {'weekly': {}}).status_code, 403)
+        self.assertEqual(self.put(self.doctor, {'weekly': {'7': []}}).status_code, 400)
+        self.assertEqual(self.put(self.doctor, {'weekly': {'0': [['09:00', '09:10']]}}).status_code, 400)
+
+        url = f'/api/doctors/{self.doctor.id}/working-hours/'
+        self.assertWithinBudget(DoctorViewSet, 'working_hours', 'get', url, self.patient)
+        for _ in range(2):
+            self.assertWithinBudget(DoctorViewSet, 'working_hours', 'put', url, self.doctor, {
+                'weekly': {'0': [['09:00', '17:00']]},
+                'exceptions': [
+                    {'date': self.day, 'hours': [['10:00', '12:00']], 'reason': 'Training'},
+                    {'date': self.day + timedelta(days=1), 'hours': None},
+                ],
+            })
+
+    def test_free_time_is_bitwise_over_the_horizon(self):
+        Appointment.objects.create(patient=self.patient, doctor=self.doctor, date_time=self.at(8), duration=45)
+        Appointment.objects.create(
+            patient=self.patient, doctor=self.doctor, date_time=self.at(9), status='cancelled'
+        )
+        with self.assertNumQueries(3):
+            free = schedule.free_time([self.doctor.id, self.other_doctor.id], self.day, days=90)
+
+        mine = free[self.doctor.id]
+        self.assertFalse(mine.is_free(self.at(8, 30), self.at(9)))
+        self.assertTrue(mine.is_free(self.at(9), self.at(10)))
+        self.assertFalse(mine.is_free(self.at(11, 30), self.at(12, 30)))  # lunch break
+        self.assertEqual(mine.next_free(self.at(7), 30, count=3), [self.at(8, 45), self.at(9, 15), self.at(9, 45)])
+        self.assertEqual(mine.next_free(self.at(11, 45), 60), [self.at(13)])
+        self.assertEqual(free[self.other_doctor.id].next_free(self.at(7), 30), [self.at(8)])
+        self.assertEqual(mine.next_free(self.at(16, 30), 60), [self.at(8, days=1)])
+
+
+class EarliestDoctorSearchTests(QueryBudgetTestCase):
+    """Doctor profiles and the earliest free slots across a specialty"""
+
+    def setUp(self):
+        cache.clear()
+        self.doctors = [make_user('doctor', i) for i in range(3)]
+        for doctor in self.doctors:
+            DoctorProfile.objects.create(user=doctor, specialty=' Cardiology', facility='North wing')
+        dermatologist = make_user('doctor', 3)
+        DoctorProfile.objects.create(user=dermatologist, specialty='dermatology')
+        self.patient = make_user('patient')
+        # A Monday far enough ahead that no slot is in the past
+        self.day = clinic_today() + timedelta(days=7 - clinic_today().weekday() + 7)
+
+        first, second, _ = self.doctors
+        Appointment.objects.create(patient=self.patient, doctor=first, date_time=self.at(8), duration=60)
+        schedule.save_hours(second.id, {0: schedule.encode([('10:00', '12:00')])})
+
+    def at(self, hour, minute=0, days=0):
+        return timezone.make_aware(datetime.combine(self.day + timedelta(days=days), time(hour, minute)))
+
+    def search(self, **params):
+        self.client.force_authenticate(user=self.patient)
+        return self.client.get('/api/doctors/earliest/', params)
+
+    def found(self, **params):
+        response = self.search(**params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return [(slot['start'], slot['doctor_id']) for slot in response.data['slots']]
+
+    def test_merges_doctors_in_start_order(self):
+        first, second, third = self.doctors
+        slots = self.found(specialty='cardiology', after=self.at(7).isoformat(), count=5)
+        self.assertEqual(slots, [
+            (self.at(8), third.id), (self.at(8, 30), third.id),
+            (self.at(9), first.id), (self.at(9), third.id), (self.at(9, 30), first.id),
+        ])
+        slots = self.found(specialty='Cardiology', after=self.at(9, 45).isoformat(), count=3, minutes=60)
+        self.assertEqual(slots, [(self.at(9, 45), first.id), (self.at(9, 45), third.id), (self.at(10), second.id)])
+
+    def test_later_windows_are_read_only_when_needed(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.search(specialty='cardiology', count=1, after=self.at(8).isoformat())
+        self.assertEqual(len(queries), 1 + 3)  # doctors, then one day of working hours, bookings and series
+
+        slots = self.found(specialty='cardiology', after=self.at(16, 45).isoformat(), count=1)
+        self.assertEqual(slots, [(self.at(8, days=1), self.doctors[0].id)])
+        self.assertWithinBudget(
+            DoctorViewSet, 'earliest', 'get', '/api/doctors/earliest/', self.patient,
+            {'specialty': 'cardiology', 'count': 50, 'minutes': 240}
+        )
+
+    def test_rejects_bad_searches(self):
+        self.assertEqual(self.search().status_code, 400)
+        self.assertEqual(self.search(specialty='cardiology', count=0).status_code, 400)
+        self.assertEqual(self.search(specialty='cardiology', after='tomorrow').status_code, 400)
+        self.assertEqual(self.found(specialty='neurology'), [])
+
+    def test_profiles_are_created_by_their_doctor(self):
+        doctor = make_user('doctor', 9)
+        self.client.force_authenticate(user=doctor)
+        response = self.client.post('/api/doctor-profiles/', {'specialty': 'Neurology', 'facility': 'East'})
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.data['specialty'], 'neurology')
+        self.assertEqual(self.client.post('/api/doctor-profiles/', {'specialty': 'x'}).status_code, 400)
+        other = DoctorProfile.objects.get(user=self.doctors[0])
+        self.assertEqual(self.client.patch(f'/api/doctor-profiles/{other.id}/', {'facility': 'x'}).status_code, 404)
+
+        self.client.force_authenticate(user=self.patient)
+        self.assertEqual(self.client.post('/api/doctor-profiles/', {'specialty': 'x'}).status_code, 403)
+        self.assertWithinBudget(
+            DoctorProfileViewSet, 'list', 'get', '/api/doctor-profiles/?specialty=cardiology', self.patient
+        )
+        self.assertEqual(len(self.client.get('/api/doctor-profiles/?specialty=cardiology').data), 3)
+
+
+class ResourceBookingTests(QueryBudgetTestCase):
+    """Rooms and equipment are reserved with the appointment and conflict like doctors"""
+
+    def setUp(self):
+        cache.clear()
+        self.doctor = make_user('doctor')
+        self.other_doctor = make_user('doctor', 1)
+        self.patient = make_user('patient')
+        self.room = Resource.objects.create(name='Procedure room', kind='room')
+        self.ultrasound = Resource.objects.create(name='Ultrasound', kind='equipment')
+        # A Monday far enough ahead that no slot is in the past
+        self.day = timezone.localdate() + timedelta(days=7 - timezone.localdate().weekday() + 7)
+        self.client.force_authenticate(user=self.patient)
+
+    def at(self, hour, minute=0):
+        return timezone.make_aware(datetime.combine(self.day, time(hour, minute)))
+
+    def book(self, at, resources, doctor=None, duration=60):
+        return self.client.post('/api/appointments/', {
+            'patient_id': self.patient.id, 'doctor_id': (doctor or self.doctor).id, 'date_time': at.isoformat(),
+            'duration': duration, 'resource_ids': [resource.id for resource in resources],
+        }, format='json')
+
+    def test_overlapping_reservation_returns_409_and_books_nothing(self):
+        response = self.book(self.at(9), [self.room, self.ultrasound])
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(
+            set(ResourceReservation.objects.values_list('resource_id', 'date_time', 'duration')),
+            {(self.room.id, self.at(9), 60), (self.ultrasound.id, self.at(9), 60)},
+        )
+
+        response = self.book(self.at(9, 30), [self.ultrasound], doctor=self.other_doctor)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['resource_ids'], [self.ultrasound.id])
+        self.assertEqual(response.data['next_available'][0]['start'], self.at(10).isoformat())
+        self.assertEqual((Appointment.objects.count(), ResourceReservation.objects.count()), (1, 2))
+
+        # Back to back is fine, and so is another room at the same time
+        self.assertEqual(self.book(self.at(10), [self.ultrasound], doctor=self.other_doctor).status_code, 201)
+        other_room = Resource.objects.create(name='Procedure room 2', kind='room')
+        self.assertEqual(self.book(self.at(11, 30), [other_room], doctor=self.other_doctor).status_code, 201)
+
+    def test_cancelling_frees_the_resources(self):
+        appointment = Appointment.objects.get(id=self.book(self.at(9), [self.room]).data['id'])
+        self.assertEqual(self.book(self.at(9), [self.room], doctor=self.other_doctor).status_code, 409)
+
+        transitions.transition(appointment, 'cancelled')
+        self.assertEqual(self.book(self.at(9), [self.room], doctor=self.other_doctor).status_code, 201)
+
+    def test_rescheduling_moves_the_reservations(self):
+        self.book(self.at(9), [self.room], doctor=self.other_doctor)
+        moved = self.book(self.at(11), [self.room, self.ultrasound]).data['id']
+
+        def move(at, **extra):
+            return self.client.put(f'/api/appointments/{moved}/', {
+                'patient_id': self.patient.id, 'doctor_id': self.doctor.id, 'date_time': at.isoformat(), **extra,
+            }, format='json')
+
+        self.assertEqual(move(self.at(9, 30)).status_code, 409)
+        self.assertEqual(set(ResourceReservation.objects.filter(appointment_id=moved).values_list(
+            'date_time', flat=True
+        )), {self.at(11)})
+
+        self.assertEqual(move(self.at(13)).status_code, 200)
+        self.assertEqual(set(ResourceReservation.objects.filter(appointment_id=moved).values_list(
+            'resource_id', 'date_time'
+        )), {(self.room.id, self.at(13)), (self.ultrasound.id, self.at(13))})
+
+        self.assertEqual(move(self.at(9, 30), resource_ids=[self.ultrasound.id]).status_code, 200)
+        self.assertEqual(list(ResourceReservation.objects.filter(appointment_id=moved).values_list(
+            'resource_id', 'date_time'
+        )), [(self.ultrasound.id, self.at(9, 30))])
+
+    def test_invalid_or_inactive_resources_rejected(self):
+        self.ultrasound.active = False
+        self.ultrasound.save()
+        self.assertEqual(self.book(self.at(9), [self.ultrasound]).status_code, 400)
+        self.assertEqual(self.book(self.at(9), [Resource(id=999)]).status_code, 400)
+        self.assertEqual(Appointment.objects.count(), 0)
+
+    def test_common_free_time_intersects_every_resource_and_the_doctor(self):
+        Appointment.objects.create(patient=self.patient, doctor=self.doctor, date_time=self.at(10))
+        for hour, resource in ((8, self.room), (9, self.ultrasound)):
+            appointment = Appointment.objects.create(
+                patient=self.patient, doctor=self.other_doctor, date_time=self.at(hour), duration=60
+            )
+            resources.reserve(appointment, [resource.id])
+
+        url = (f'/api/resources/availability/?resource_ids={self.room.id},{self.ultrasound.id}'
+               f'&doctor_id={self.doctor.id}&minutes=60&count=2&after={self.at(7).isoformat()}')
+        self.assertWithinBudget(ResourceViewSet, 'availability', 'get', url.replace('+', '%2B'), self.patient)
+        response = self.client.get(url.replace('+', '%2B'))
+        # 10:30 is the first hour all three are free; 11:30 runs into lunch
+        self.assertEqual([slot['start'] for slot in response.data['slots']], [self.at(10, 30), self.at(13)])
+
+        response = self.client.get(f'/api/resources/availability/?resource_ids={self.room.id}'
+                                   f'&after={self.at(7).isoformat()}'.replace('+', '%2B'))
+        self.assertEqual(response.data['slots'][0]['start'], self.at(9))
+
+        for query in ('resource_ids=x', f'resource_ids={self.room.id}&minutes=0', 'resource_ids=999',
+                      f'resource_ids={self.room.id}&doctor_id={self.patient.id}'):
+            self.assertEqual(self.client.get(f'/api/resources/availability/?{query}').status_code, 400, query)
+
+    def test_only_admins_manage_resources(self):
+        self.assertWithinBudget(ResourceViewSet, 'list', 'get', '/api/resources/?kind=room', self.patient)
+        self.assertEqual([r['name'] for r in self.client.get('/api/resources/?kind=room').data], ['Procedure room'])
+        self.assertEqual(self.client.post('/api/resources/', {'name': 'ECG', 'kind': 'equipment'}).status_code, 403)
+
+        admin = make_user('admin')
+        admin.is_staff = True
+        admin.save()
+        self.client.force_authenticate(user=admin)
+        self.assertEqual(self.client.post('/api/resources/', {'name': 'ECG', 'kind': 'equipment'}).status_code, 201)
+
+
+class RescheduleTests(QueryBudgetTestCase):
+    """A doctor's appointments are moved out of a date range in bulk, planned in memory"""
+
+    def setUp(self):
+        cache.clear()
+        self.doctor = make_user('doctor')
+        self.colleagues = [make_user('doctor', i) for i in (1, 2)]
+        self.dermatologist = make_user('doctor', 3)
+        for doctor in (self.doctor, *self.colleagues):
+            DoctorProfile.objects.create(user=doctor, specialty='cardiology')
+        DoctorProfile.objects.create(user=self.dermatologist, specialty='dermatology')
+        self.patient = make_user('patient')
+        self.admin = make_user('admin')
+        self.room = Resource.objects.create(name='Procedure room', kind='room')
+        # A Monday far enough ahead that no slot is in the past
+        self.day = clinic_today() + timedelta(days=7 - clinic_today().weekday() + 7)
+        self.ids = [
+            Appointment.objects.create(
+                patient=self.patient, doctor=self.doctor, date_time=self.at(hour, minute), duration=duration
+            ).id
+            for hour, minute, duration in ((9, 0, 30), (9, 30, 30), (10, 0, 60))
+        ]
+
+    def at(self, hour, minute=0, days=0):
+        return timezone.make_aware(datetime.combine(self.day + timedelta(days=days), time(hour, minute)))
+
+    def reschedule(self, user=None, **data):
+        self.client.force_authenticate(user=user or self.admin)
+        return self.client.post(f'/api/doctors/{self.doctor.id}/reschedule/', {
+            'start_date': self.day.isoformat(), 'end_date': self.day.isoformat(), **data
+        }, format='json')
+
+    def slots(self):
+        return list(Appointment.objects.filter(id__in=self.ids).order_by('id').values_list('doctor_id', 'date_time'))
+
+    def test_dry_run_plans_without_writing(self):
+        before = self.slots()
+        response = self.reschedule(dry_run=True)
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual((response.data['moved'], response.data['unplaced']), (3, []))
+        self.assertEqual(
+            [(change['id'], change['from']['date_time'], change['to']['date_time']) for change in response.data['changes']],
+            [(self.ids[0], self.at(9), self.at(8, days=1)), (self.ids[1], self.at(9, 30), self.at(8, 30, days=1)),
+             (self.ids[2], self.at(10), self.at(9, days=1))],
+        )
+        self.assertEqual(self.slots(), before)
+
+    def test_shift_moves_to_the_doctors_first_free_slots_after_the_range(self):
+        Appointment.objects.create(patient=self.patient, doctor=self.doctor, date_time=self.at(8, 30, days=1))
+        Appointment.objects.filter(id__in=self.ids).update(reminders_sent=1)
+
+        response = self.reschedule()
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(self.slots(), [
+            (self.doctor.id, self.at(8, days=1)), (self.doctor.id, self.at(9, days=1)),
+            (self.doctor.id, self.at(9, 30, days=1)),
+        ])
+        self.assertEqual(set(Appointment.objects.filter(id__in=self.ids).values_list('reminders_sent', flat=True)), {0})
+        # Availability caches saw the change
+        free = availability.get_available_slots(self.doctor.id, self.day, self.day)
+        self.assertIn((self.at(9), self.at(9, 30)), free)
+
+    def test_reassign_keeps_the_time_and_spreads_over_colleagues(self):
+        first, second = self.colleagues
+        Appointment.objects.create(patient=self.patient, doctor=first, date_time=self.at(9))
+
+        self.assertWithinBudget(
+            DoctorViewSet, 'reschedule', 'post', f'/api/doctors/{self.doctor.id}/reschedule/', self.admin,
+            {'start_date': self.day.isoformat(), 'end_date': self.day.isoformat(), 'mode': 'reassign'},
+        )
+        # 9:00 goes to the free colleague, 9:30 to the less loaded one, 10:00 to the first on a tie
+        self.assertEqual(self.slots(), [
+            (second.id, self.at(9)), (first.id, self.at(9, 30)), (first.id, self.at(10)),
+        ])
+
+    def test_resources_follow_and_constrain_the_move(self):
+        resources.reserve(Appointment.objects.get(id=self.ids[2]), [self.room.id])
+        other = Appointment.objects.create(
+            patient=self.patient, doctor=self.dermatologist, date_time=self.at(8, days=1), duration=120
+        )
+        resources.reserve(other, [self.room.id])
+
+        self.assertWithinBudget(
+            DoctorViewSet, 'reschedule', 'post', f'/api/doctors/{self.doctor.id}/reschedule/', self.admin,
+            {'start_date': self.day.isoformat(), 'end_date': self.day.isoformat()},
+        )
+        # The room is busy until 10:00 on the next day, though the doctor is free from 9:00
+        self.assertEqual([date_time for _, date_time in self.slots()], [
+            self.at(8, days=1), self.at(8, 30, days=1), self.at(10, days=1),
+        ])
+        self.assertEqual(
+            ResourceReservation.objects.get(appointment_id=self.ids[2]).date_time, self.at(10, days=1)
+        )
+
+    def test_unplaced_appointments_are_reported_and_left_alone(self):
+        schedule.save_hours(self.doctor.id, {})
+        before = self.slots()
+        response = self.reschedule()
+        self.assertEqual(response.data['moved'], 0)
+        self.assertEqual([entry['id'] for entry in response.data['unplaced']], self.ids)
+        self.assertEqual(self.slots(), before)
+
+        # Colleagues covering only that morning take the appointments before 10:00
+        for colleague in self.colleagues:
+            schedule.save_hours(colleague.id, {}, {self.day: (schedule.encode([('08:00', '10:00')]), 'Cover')})
+        response = self.reschedule(mode='reassign')
+        self.assertEqual(response.data['moved'], 2)
+        self.assertEqual([entry['id'] for entry in response.data['unplaced']], [self.ids[2]])
+
+    def test_concurrent_booking_aborts_the_whole_plan(self):
+        before = self.slots()
+        moves, _ = reschedule.plan(self.doctor.id, self.day, self.day)
+        Appointment.objects.create(patient=self.patient, doctor=self.doctor, date_time=self.at(8, 45, days=1))
+        with self.assertRaises(booking.SlotUnavailable):
+            reschedule.commit(moves)
+        self.assertEqual(self.slots(), before)
+
+    def test_appointments_changed_since_planning_abort_the_whole_plan(self):
+        plan = reschedule.plan(self.doctor.id, self.day, self.day)
+        Appointment.objects.filter(id=self.ids[0]).update(status='cancelled')
+        Appointment.objects.filter(id=self.ids[1]).update(date_time=self.at(11))
+        before = self.slots()
+        with self.assertRaises(reschedule.PlanOutdated) as raised:
+            reschedule.commit(plan[0])
+        self.assertEqual(raised.exception.detail['changed'], [str(appointment_id) for appointment_id in self.ids[:2]])
+        self.assertEqual(self.slots(), before)
+
+        with mock.patch.object(reschedule, 'plan', return_value=plan):
+            self.assertEqual(self.reschedule().status_code, 409)
+        self.assertEqual(self.slots(), before)
+
+    def test_admins_only_and_validation(self):
+        self.assertEqual(self.reschedule(user=self.doctor).status_code, 403)
+        self.assertEqual(self.reschedule(user=self.patient).status_code, 403)
+        self.assertEqual(self.reschedule(end_date=(self.day - timedelta(days=1)).isoformat()).status_code, 400)
+        self.assertEqual(self.reschedule(end_date=(self.day + timedelta(days=31)).isoformat()).status_code, 400)
+
+        DoctorProfile.objects.filter(user=self.doctor).delete()
+        self.assertEqual(self.reschedule(mode='reassign').status_code, 400)
+
+
+@override_settings(NO_SHOW_MIN_SAMPLES=20)
+class NoShowTests(QueryBudgetTestCase):
+    """The no-show status and the nightly risk model fitted on it"""
+
+    def setUp(self):
+        self.doctor = make_user('doctor')
+        self.other_doctor = make_user('doctor', 1)
+        self.admin = make_user('admin')
+        self.reliable = make_user('patient')
+        self.flaky = make_user('patient', 1)
+        # Noon yesterday, so upcoming appointments (noon tomorrow on) stay clear of clinic midnight
+        self.now = clinic_datetime(clinic_today() - timedelta(days=1), time(12))
+
+    def history(self):
+        """Thirty past visits each: the reliable patient keeps them all, the flaky one misses two in three"""
+        Appointment.objects.bulk_create(
+            Appointment(
+                patient=patient, doctor=doctor, date_time=self.now - timedelta(days=day),
+                status='no_show' if patient == self.flaky and day % 3 else 'completed'
+            )
+            for day in range(1, 31)
+            for patient, doctor in ((self.reliable, self.other_doctor), (self.flaky, self.doctor))
+        )
+
+    def upcoming(self, patient, days=2, minutes=0):
+        return Appointment.objects.create(
+            patient=patient, doctor=self.doctor, date_time=self.now + timedelta(days=days, minutes=minutes),
+            status='confirmed'
+        )
+
+    def test_only_the_doctor_records_a_no_show_after_the_start(self):
+        appointment = Appointment.objects.create(
+            patient=self.reliable, doctor=self.doctor, date_time=self.now - timedelta(minutes=20), status='confirmed'
+        )
+        url = f'/api/appointments/{appointment.id}/no-show/'
+        for user in (self.reliable, self.other_doctor):
+            self.client.force_authenticate(user=user)
+            self.assertIn(self.client.post(url).status_code, (403, 404))
+
+        self.assertWithinBudget(AppointmentViewSet, 'no_show', 'post', url, self.doctor)
+        appointment.refresh_from_db()
+        self.assertEqual(appointment.status, 'no_show')
+
+        later = self.upcoming(self.reliable)
+        self.client.force_authenticate(user=self.doctor)
+        self.assertEqual(self.client.post(f'/api/appointments/{later.id}/no-show/').status_code, 400)
+        self.assertEqual(Appointment.objects.get(id=later.id).status, 'confirmed')
+
+    def test_bulk_no_show_skips_appointments_not_started(self):
+        started = Appointment.objects.create(
+            patient=self.reliable, doctor=self.doctor, date_time=self.now - timedelta(hours=1), status='confirmed'
+        )
+        later = self.upcoming(self.reliable)
+        self.client.force_authenticate(user=self.doctor)
+        response = self.client.post(
+            '/api/appointments/bulk-status/', {'ids': [started.id, later.id], 'status': 'no_show'}, format='json'
+        )
+        self.assertEqual(response.data['moved'], [started.id])
+        self.assertEqual([entry['id'] for entry in response.data['rejected']], [later.id])
+
+    def test_bulk_no_show_by_anyone_but_a_doctor_is_rejected_per_id(self):
+        started = Appointment.objects.create(
+            patient=self.reliable, doctor=self.doctor, date_time=self.now - timedelta(hours=1), status='confirmed'
+        )
+        for user in (self.admin, self.reliable):
+            self.client.force_authenticate(user=user)
+            response = self.client.post(
+                '/api/appointments/bulk-status/', {'ids': [started.id], 'status': 'no_show'}, format='json'
+            )
+            self.assertEqual(response.status_code, 200, response.data)
+            self.assertEqual(response.data['moved'], [])
+            self.assertEqual([entry['id'] for entry in response.data['rejected']], [started.id])
+        self.assertEqual(Appointment.objects.get(id=started.id).status, 'confirmed')
+
+    def test_running_records_count_only_earlier_rows_of_the_same_patient(self):
+        patients = np.array([1, 1, 1, 2, 2])
+        outcome = np.array([noshow.KEPT, noshow.MISSED, noshow.CANCELLED, noshow.MISSED, noshow.KEPT])
+        self.assertEqual(noshow.running_records(patients, outcome).tolist(), [
+            [0, 0, 0], [1, 0, 0], [2, 1, 0], [0, 0, 0], [1, 1, 0],
+        ])
+        self.assertEqual(noshow.total_records(patients, outcome, np.array([2, 3, 1])).tolist(), [
+            [2, 1, 0], [0, 0, 0], [2, 1, 1],
+        ])
+
+    def test_run_fits_scores_and_drops_stale_scores(self):
+        self.history()
+        flaky, reliable = self.upcoming(self.flaky), self.upcoming(self.reliable, days=3)
+        cancelled = self.upcoming(self.reliable, days=4)
+        NoShowScore.objects.create(appointment=cancelled, risk=0.5, scored_at=self.now - timedelta(days=1))
+        Appointment.objects.filter(id=cancelled.id).update(status='cancelled')
+
+        result = noshow.run(now=self.now)
+        self.assertEqual((result['scored'], result['dropped']), (2, 1))
+        model = NoShowModel.objects.latest()
+        self.assertEqual(model.samples, 60)
+        self.assertAlmostEqual(model.no_show_rate, 20 / 60)
+        risks = dict(NoShowScore.objects.values_list('appointment_id', 'risk'))
+        self.assertEqual(set(risks), {flaky.id, reliable.id})
+        self.assertGreater(risks[flaky.id], 0.5)
+        self.assertLess(risks[reliable.id], 0.2)
+
+        # Rescoring with the same model rewrites the scores in place
+        result = noshow.run(retrain=False, now=self.now + timedelta(hours=1))
+        self.assertEqual((result['model'], result['scored'], result['dropped']), (model, 2, 0))
+        self.assertEqual(NoShowModel.objects.count(), 1)
+
+    def test_command_needs_enough_history(self):
+        with self.assertRaisesMessage(CommandError, 'Need at least 20 past visits'):
+            call_command('score_no_shows', stdout=StringIO())
+        with self.assertRaisesMessage(CommandError, 'No model has been fitted yet'):
+            call_command('score_no_shows', '--no-train', stdout=StringIO())
+
+        self.history()
+        out = StringIO()
+        call_command('score_no_shows', stdout=out)
+        self.assertIn('60 samples', out.getvalue())
+
+    def test_risk_endpoint_is_staff_only_within_budget(self):
+        self.history()
+        appointment = self.upcoming(self.flaky)
+        noshow.run(now=self.now)
+        unscored = self.upcoming(self.reliable, minutes=30)
+        day = clinic_today(appointment.date_time)
+        url = f'/api/appointments/no-show-risk/?date={day.isoformat()}'
+
+        self.assertWithinBudget(AppointmentViewSet, 'no_show_risk', 'get', url, self.doctor)
+        response = self.client.get(url)
+        rows = response.data['appointments']
+        self.assertEqual([row['id'] for row in rows], [appointment.id, unscored.id])
+        self.assertGreater(rows[0]['risk'], 0.5)
+        self.assertIsNone(rows[1]['risk'])
+
+        self.client.force_authenticate(user=self.other_doctor)
+        self.assertEqual(self.client.get(url).data['appointments'], [])
+        self.client.force_authenticate(user=self.admin)
+        self.assertEqual(len(self.client.get(f'{url}&doctor_id={self.doctor.id}').data['appointments']), 2)
+        self.assertEqual(self.client.get(f'{url}&doctor_id={self.other_doctor.id}').data['appointments'], [])
+        self.client.force_authenticate(user=self.reliable)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+
+class ComputedFlagTests(APITestCase):
+    """is_upcoming, can_be_cancelled and age come from SQL annotations"""
+
+    def setUp(self):
+        cache.clear()
+        self.doctor = make_user('doctor')
+        self.patient = make_user('patient')
+        self.now = timezone.now()
+        self.past = Appointment.objects.create(patient=self.patient, doctor=self.doctor,
+                                               date_time=self.now - timedelta(days=1))
+        self.future = Appointment.objects.create(patient=self.patient, doctor=self.doctor,
+                                                 date_time=self.now + timedelta(days=1))
+        self.cancelled = Appointment.objects.create(patient=self.patient, doctor=self.doctor,
+                                                    date_time=self.now + timedelta(days=2), status='cancelled')
+
+    def test_flags_match_methods_and_filter_and_order(self):
+        rows = Appointment.objects.with_flags(self.now)
+        for appointment in rows:
+            self.assertEqual(appointment.upcoming, appointment.is_upcoming())
+            self.assertEqual(appointment.cancellable, appointment.can_be_cancelled())
+        self.assertEqual(list(rows.filter(cancellable=True)), [self.future])
+        self.assertEqual([a.id for a in rows.order_by('-cancellable', '-upcoming', 'id')],
+                         [self.future.id, self.cancelled.id, self.past.id])
+
+    def test_list_reads_annotations_and_filters_on_them(self):
+        self.client.force_authenticate(user=self.patient)
+        with mock.patch.object(Appointment, 'is_upcoming', side_effect=AssertionError('called per row')):
+            response = self.client.get('/api/appointments/?upcoming=true')
+        self.assertEqual([row['id'] for row in response.data['results']], [self.cancelled.id, self.future.id])
+        self.assertTrue(all(row['is_upcoming'] for row in response.data['results']))
+
+        response = self.client.get('/api/appointments/?cancellable=false')
+        self.assertEqual([row['id'] for row in response.data['results']], [self.cancelled.id, self.past.id])
+        self.assertEqual(self.client.get('/api/appointments/?upcoming=soon').status_code, 400)
+
+    def test_saved_instance_does_not_report_stale_flags(self):
+        self.client.force_authenticate(user=self.patient)
+        response = self.client.post(f'/api/appointments/{self.future.id}/cancel/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.data['appointment']['can_be_cancelled'])
+
+    def test_age_annotation(self):
+        today = date(2026, 3, 15)
+        births = [date(2000, 3, 15), date(2000, 3, 16), date(2000, 2, 29), None]
+        for i, born in enumerate(births):
+            PatientProfile.objects.create(user=make_user('patient', i + 1), date_of_birth=born)
+
+        ages = dict(PatientProfile.objects.with_age(today).values_list('date_of_birth', 'age'))
+        self.assertEqual(ages, {date(2000, 3, 15): 26, date(2000, 3, 16): 25, date(2000, 2, 29): 26, None: None})
+        self.assertEqual(
+            list(PatientProfile.objects.with_age(today).filter(age__lt=26).values_list('age', flat=True)), [25]
+        )
+        by_age = PatientProfile.objects.with_age(today).filter(age__isnull=False).order_by('-age', 'date_of_birth')
+        self.assertEqual(list(by_age.values_list('date_of_birth', flat=True)),
+                         [date(2000, 2, 29), date(2000, 3, 15), date(2000, 3, 16)])
+
+    @override_settings(CLINIC_TIME_ZONE='Pacific/Kiritimati')
+    def test_age_is_counted_on_the_clinic_date(self):
+        profile = PatientProfile.objects.create(user=make_user('patient', 1), date_of_birth=date(2000, 3, 15))
+        # Still the 14th in UTC, already the birthday at the clinic (UTC+14)
+        now = datetime(2026, 3, 14, 12, tzinfo=dt_timezone.utc)
+        with mock.patch.object(timezone, 'now', return_value=now):
+            annotated = PatientProfile.objects.with_age().get(id=profile.id).age
+            self.assertEqual((profile.get_age(), annotated), (26, 26))
+
+
+class BookingTests(APITestCase):
+    """Double-booking is resolved by the insert, not a prior read"""
+
+    def setUp(self):
+        cache.clear()
+        self.doctor = make_user('doctor')
+        self.patient = make_user('patient')
+        self.client.force_authenticate(user=self.patient)
+        day = timezone.localdate() + timedelta(days=7 - timezone.localdate().weekday() + 7)
+        self.slot = timezone.make_aware(datetime.combine(day, time(9)))
+
+    def book(self, minutes=0, **extra):
+        return self.client.post('/api/appointments/', {
+            'patient_id': self.patient.id, 'doctor_id': self.doctor.id,
+            'date_time': (self.slot + timedelta(minutes=minutes)).isoformat(), 'reason': 'checkup', **extra,
+        }, format='json')
+
+    def test_taken_slot_returns_409_with_next_free_slots(self):
+        self.assertEqual(self.book().status_code, 201)
+
+        response = self.book()
+        self.assertEqual(response.status_code, 409)
+        next_starts = [slot['start'] for slot in response.data['next_available']]
+        self.assertEqual(next_starts[0], (self.slot + timedelta(minutes=30)).isoformat())
+        self.assertEqual(Appointment.objects.count(), 1)
+
+    def test_reminders_sent_cannot_be_set_by_clients(self):
+        response = self.book(reminders_sent=2)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Appointment.objects.get(id=response.data['id']).reminders_sent, 0)
+
+    def test_series_occurrence_cannot_be_set_by_clients(self):
+        other = make_user('patient', 1)
+        instance = AppointmentSeries.objects.create(
+            patient=other, doctor=self.doctor, start=self.slot + timedelta(days=7), frequency='weekly',
+            materialized_until=self.slot + timedelta(days=7),
+        )
+        response = self.book(series=instance.id, occurrence=0)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            Appointment.objects.filter(id=response.data['id']).values_list('series', 'occurrence').get(), (None, None)
+        )
+
+    def test_invalid_roles_rejected(self):
+        response = self.client.post('/api/appointments/', {
+            'patient_id': self.doctor.id, 'doctor_id': self.patient.id,
+            'date_time': self.slot.isoformat(),
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_partial_overlap_returns_409(self):
+        self.assertEqual(self.book(duration=60).status_code, 201)
+
+        self.assertEqual(self.book(15).status_code, 409)
+        self.assertEqual(self.book(-15, duration=30).status_code, 409)
+        self.assertEqual(self.book(60).status_code, 201)  # Back to back is fine
+        self.assertEqual(self.book(-30).status_code, 201)
+        self.assertEqual(Appointment.objects.count(), 3)
+
+    def test_moving_onto_a_longer_appointment_returns_409(self):
+        self.book(duration=90)
+        moved = Appointment.objects.get(id=self.book(120).data['id'])
+
+        response = self.client.put(f'/api/appointments/{moved.id}/', {
+            'patient_id': self.patient.id, 'doctor_id': self.doctor.id,
+            'date_time': (self.slot + timedelta(minutes=45)).isoformat(),
+        }, format='json')
+        self.assertEqual(response.status_code, 409)
+        moved.refresh_from_db()
+        self.assertEqual(moved.date_time, self.slot + timedelta(minutes=120))
+
+    def test_duration_is_bounded(self):
+        response = self.book(duration=settings.APPOINTMENT_MAX_MINUTES + 1)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('duration', response.data)
+
+    def test_long_appointments_block_availability_and_bulk_bookings(self):
+        self.book(duration=90)
+        day = self.slot.date()
+        starts = [start for start, _ in availability.get_available_slots(self.doctor.id, day, day)]
+        self.assertNotIn(self.slot + timedelta(minutes=60), starts)
+        self.assertIn(self.slot + timedelta(minutes=90), starts)
+
+        errors, planned = booking.plan_bulk_booking({
+            0: {'patient_id': self.patient.id, 'doctor_id': self.doctor.id, 'date_time': self.slot + timedelta(minutes=75)},
+            1: {'patient_id': self.patient.id, 'doctor_id': self.doctor.id, 'date_time': self.slot + timedelta(minutes=90),
+                'duration': 60},
+            2: {'patient_id': self.patient.id, 'doctor_id': self.doctor.id, 'date_time': self.slot + timedelta(minutes=120)},
+        })
+        self.assertEqual(set(errors), {0, 2})
+        self.assertEqual(list(planned), [1])
+
+    def test_overlap_lookup_is_a_bounded_index_range(self):
+        with CaptureQueriesContext(connection) as queries:
+            availability.nearby_intervals([(self.doctor.id, self.slot, self.slot + timedelta(minutes=30))])
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + queries[0]['sql'])
+            plan = ' '.join(str(row) for row in cursor.fetchall())
+        self.assertIn('(doctor_id=? AND date_time>? AND date_time<?)', plan)
+
+
+class AppointmentIndexTests(APITestCase):
+    """Active-slot uniqueness and the indexes behind the hot appointment filters"""
+
+    def setUp(self):
+        self.doctor = make_user('doctor')
+        self.patient = make_user('patient')
+        self.slot = timezone.now() + timedelta(days=2)
+
+    @skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN output is SQLite-specific')
+    def assertPlanUses(self, queryset, index, *terms):
+        plan = queryset.explain()
+        self.assertIn(index, plan)
+        for term in terms:
+            self.assertIn(term, plan)
+
+    def test_cancelled_slot_can_be_rebooked(self):
+        first = Appointment.objects.create(patient=self.patient, doctor=self.doctor, date_time=self.slot)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Appointment.objects.create(patient=self.patient, doctor=self.doctor, date_time=self.slot)
+
+        first.status = 'cancelled'
+        first.save()
+        Appointment.objects.create(patient=self.patient, doctor=self.doctor, date_time=self.slot)
+        self.assertEqual(Appointment.objects.filter(date_time=self.slot).count(), 2)
+
+    def test_conflict_scan_uses_covering_doctor_index(self):
+        queryset = Appointment.objects.filter(
+            doctor=self.doctor, status__in=Appointment.ACTIVE_STATUSES,
+            date_time__gt=self.slot, date_time__lt=self.slot + timedelta(days=1),
+        ).values_list('date_time', flat=True)
+        self.assertPlanUses(queryset, 'COVERING INDEX appointment_doctor_slot_idx', 'date_time>?')
+
+    def test_upcoming_uses_user_indexes(self):
+        for field, index in (('doctor', 'appointment_doctor_slot_idx'),
+                             ('patient', 'appointment_patient_slot_idx')):
+            queryset = Appointment.objects.filter(
+                **{field: getattr(self, field)},
+                date_time__gt=timezone.now(), status__in=Appointment.ACTIVE_STATUSES,
+            ).order_by('date_time', 'id')
+            self.assertPlanUses(queryset, index, 'date_time>?')
+
+
+class ClinicDayWindowTests(APITestCase):
+    """'today' is the clinic's local day, selected by an index range"""
+
+    def setUp(self):
+        self.doctor = make_user('doctor')
+        self.patient = make_user('patient')
+
+    @override_settings(CLINIC_TIME_ZONE='Africa/Nairobi')
+    def test_window_follows_clinic_timezone(self):
+        now = datetime(2025, 9, 1, 22, 30, tzinfo=dt_timezone.utc)
+        self.assertEqual(clinic_today(now).isoformat(), '2025-09-02')
+
+        start, end = day_window(clinic_today(now))
+        self.assertEqual(start, datetime(2025, 9, 1, 21, 0, tzinfo=dt_timezone.utc))
+        self.assertEqual(end - start, timedelta(days=1))
+
+    @override_settings(CLINIC_TIME_ZONE='Africa/Nairobi')
+    def test_today_endpoint_uses_half_open_clinic_day(self):
+        start, end = day_window(clinic_today())
+        inside = Appointment.objects.create(patient=self.patient, doctor=self.doctor, date_time=start)
+        Appointment.objects.create(patient=self.patient, doctor=self.doctor, date_time=end)
+
+        self.client.force_authenticate(user=self.doctor)
+        ids = [row['id'] for row in self.client.get('/api/appointments/today/').data['results']]
+        self.assertEqual(ids, [inside.id])
+
+    @skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN output is SQLite-specific')
+    def test_today_is_an_index_range_scan(self):
+        plan = Appointment.objects.filter(
+            doctor=self.doctor, status__in=Appointment.ACTIVE_STATUSES, **day_range_filter(clinic_today())
+        ).order_by('date_time', 'id').explain()
+        self.assertIn('appointment_doctor_slot_idx (doctor_id=? AND date_time>? AND date_time<?)', plan)
+
+
+class BulkBookingTests(QueryBudgetTestCase):
+    """Set-based validation and insert for POST /api/appointments/bulk/"""
+
+    def setUp(self):
+        cache.clear()
+        self.admin = make_user('admin')
+        self.doctor = make_user('doctor')
+        self.patients = [make_user('patient', i) for i in range(3)]
+        self.start = timezone.now().replace(microsecond=0) + timedelta(days=1)
+
+    def items(self, count, offset=0):
+        return [
+            {'patient_id': self.patients[i % 3].id, 'doctor_id': self.doctor.id,
+             'date_time': (self.start + timedelta(minutes=30 * (i + offset))).isoformat()}
+            for i in range(count)
+        ]
+
+    def test_batch_is_constant_query(self):
+        self.assertWithinBudget(AppointmentViewSet, 'bulk', 'post', '/api/appointments/bulk/', self.admin,
+                                {'appointments': self.items(2)})
+        self.assertWithinBudget(AppointmentViewSet, 'bulk', 'post', '/api/appointments/bulk/', self.admin,
+                                {'appointments': self.items(40, offset=2)})
+        self.assertEqual(Appointment.objects.count(), 42)
+
+    def test_all_or_nothing_rejects_whole_batch(self):
+        Appointment.objects.create(patient=self.patients[0], doctor=self.doctor, date_time=self.start)
+        items = self.items(3) + self.items(1, offset=1) + [{'patient_id': self.doctor.id, 'doctor_id': self.doctor.id,
+                                                          'date_time': self.items(1, offset=5)[0]['date_time']}]
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.post('/api/appointments/bulk/', {'appointments': items}, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['created'], 0)
+        self.assertEqual([r['status'] for r in response.data['results']],
+                         ['error', 'skipped', 'skipped', 'error', 'error'])
+        self.assertEqual(Appointment.objects.count(), 1)
+
+    def test_best_effort_books_what_it_can(self):
+        Appointment.objects.create(patient=self.patients[0], doctor=self.doctor, date_time=self.start)
+        items = self.items(3) + [{'patient_id': self.patients[0].id, 'doctor_id': self.doctor.id,
+                                  'date_time': 'yesterday'}]
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.post('/api/appointments/bulk/', {'mode': 'best_effort', 'appointments': items},
+                                    format='json')
+
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([r['status'] for r in response.data['results']], ['error', 'created', 'created', 'error'])
+        self.assertEqual(Appointment.objects.count(), 3)
+
+    def test_best_effort_falls_back_to_fresh_rows_after_a_lost_race(self):
+        items = {index: dict(item, date_time=parse_datetime(item['date_time']))
+                 for index, item in enumerate(self.items(3))}
+        errors, planned = booking.plan_bulk_booking(items)
+        self.assertEqual(errors, {})
+        # Booked after planning: the batch insert fails and each row is retried alone
+        Appointment.objects.create(patient=self.patients[0], doctor=self.doctor,
+                                   date_time=self.start + timedelta(minutes=45), duration=15)
+
+        other = make_user('doctor', 1)
+        save = Appointment.save
+
+        def save_after_a_competitor(appointment, *args, **kwargs):
+            if not Appointment.objects.filter(doctor=other).exists():
+                # Meanwhile another booking gets an id the rolled-back batch insert had handed out
+                Appointment.objects.bulk_create([Appointment(
+                    id=planned[2].pk, patient=self.patients[1], doctor=other, date_time=self.start
+                )])
+            return save(appointment, *args, **kwargs)
+
+        with mock.patch.object(Appointment, 'save', autospec=True, side_effect=save_after_a_competitor):
+            created, errors = booking.commit_bulk_booking(planned, all_or_nothing=False)
+        self.assertEqual((sorted(created), sorted(errors)), ([0, 2], [1]))
+        self.assertIsNone(planned[1].pk)
+        for appointment in created.values():
+            self.assertEqual(Appointment.objects.get(id=appointment.id).date_time, appointment.date_time)
+        self.assertEqual(Appointment.objects.count(), 4)
+
+
+class BulkStatusTests(QueryBudgetTestCase):
+    """Guarded conditional UPDATEs for POST /api/appointments/bulk-status/"""
+
+    def setUp(self):
+        self.doctor = make_user('doctor')
+        self.other_doctor = make_user('doctor', 1)
+        self.patient = make_user('patient')
+        start = timezone.now() + timedelta(days=1)
+        self.pending = [
+            Appointment.objects.create(patient=self.patient, doctor=self.doctor,
+                                       date_time=start + timedelta(minutes=30 * i))
+            for i in range(5)
+        ]
+        self.foreign = Appointment.objects.create(patient=self.patient, doctor=self.other_doctor, date_time=start)
+
+    def post(self, user, ids, target):
+        self.client.force_authenticate(user=user)
+        return self.client.post('/api/appointments/bulk-status/', {'ids': ids, 'status': target}, format='json')
+
+    def test_doctor_confirms_own_pending_only(self):
+        self.pending[0].status = 'completed'
+        self.pending[0].save()
+        ids = [a.id for a in self.pending] + [self.foreign.id]
+
+        response = self.post(self.doctor, ids, 'confirmed')
+        self.assertEqual(response.data['moved'], sorted(a.id for a in self.pending[1:]))
+        reasons = {r['id']: r['reason'] for r in response.data['rejected']}
+        self.assertEqual(reasons[self.foreign.id], 'Appointment not found')
+        self.assertIn('completed', reasons[self.pending[0].id])
+        self.assertEqual(Appointment.objects.filter(status='confirmed').count(), 4)
+
+    def test_cancel_moves_every_source_state_within_budget(self):
+        Appointment.objects.filter(id=self.pending[0].id).update(status='confirmed')
+        self.assertWithinBudget(AppointmentViewSet, 'bulk_status', 'post', '/api/appointments/bulk-status/',
+                                self.patient, {'ids': [a.id for a in self.pending], 'status': 'cancelled'})
+        self.assertEqual(Appointment.objects.filter(status='cancelled').count(), 5)
+
+    def test_patient_cannot_confirm(self):
+        response = self.post(self.patient, [self.pending[0].id], 'confirmed')
+        self.assertEqual(response.data['moved'], [])
+        self.assertEqual(Appointment.objects.get(id=self.pending[0].id).status, 'pending')
+
+
+class StatusTransitionTests(QueryBudgetTestCase):
+    """Compare-and-swap status moves and the transition log"""
+
+    def setUp(self):
+        self.admin = make_user('admin')
+        self.admin.is_staff = True
+        self.admin.save()
+        self.doctor = make_user('doctor')
+        self.patient = make_user('patient')
+        self.appointment = Appointment.objects.create(
+            patient=self.patient, doctor=self.doctor, date_time=timezone.now() + timedelta(days=1)
+        )
+
+    def post(self, user, action):
+        self.client.force_authenticate(user=user)
+        return self.client.post(f'/api/appointments/{self.appointment.id}/{action}/')
+
+    def test_only_one_concurrent_transition_wins(self):
+        first = Appointment.objects.get(id=self.appointment.id)
+        second = Appointment.objects.get(id=self.appointment.id)
+
+        self.assertTrue(transitions.transition(first, 'confirmed', self.doctor))
+        self.assertFalse(transitions.transition(second, 'cancelled', self.patient))
+        self.assertEqual(second.status, 'confirmed')
+        self.assertEqual(
+            list(AppointmentTransition.objects.values_list('from_status', 'to_status', 'actor')),
+            [('pending', 'confirmed', self.doctor.id)]
+        )
+
+    def test_losing_request_gets_409(self):
+        stale = Appointment.objects.get(id=self.appointment.id)
+        Appointment.objects.filter(id=stale.id).update(status='cancelled')
+        with mock.patch.object(AppointmentViewSet, 'get_object', return_value=stale):
+            response = self.post(self.doctor, 'confirm')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['appointment']['status'], 'cancelled')
+        self.assertFalse(AppointmentTransition.objects.exists())
+
+    def test_status_is_not_writable_through_update(self):
+        self.client.force_authenticate(user=self.patient)
+        response = self.client.put(f'/api/appointments/{self.appointment.id}/', {
+            'patient_id': self.patient.id, 'doctor_id': self.doctor.id,
+            'date_time': self.appointment.date_time.isoformat(), 'status': 'completed',
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Appointment.objects.get(id=self.appointment.id).status, 'pending')
+
+    def test_history_lists_each_move_within_budget(self):
+        self.assertEqual(self.post(self.doctor, 'confirm').status_code, 200)
+        self.assertEqual(self.post(self.doctor, 'complete').status_code, 200)
+
+        self.assertWithinBudget(
+            AppointmentViewSet, 'history', 'get', f'/api/appointments/{self.appointment.id}/history/', self.patient
+        )
+        history = self.client.get(f'/api/appointments/{self.appointment.id}/history/').data
+        self.assertEqual(
+            [(entry['from_status'], entry['to_status'], entry['actor_name']) for entry in history],
+            [('pending', 'confirmed', self.doctor.name), ('confirmed', 'completed', self.doctor.name)]
+        )
+
+    def test_sweeper_and_bulk_moves_are_logged(self):
+        stale = Appointment.objects.create(
+            patient=self.patient, doctor=self.doctor, date_time=timezone.now() - timedelta(hours=1)
+        )
+        with self.assertLogs('mainapp.sweeper', 'INFO'):
+            sweeper.sweep()
+        transitions.bulk_transition(Appointment.objects.all(), self.patient, [self.appointment.id], 'cancelled')
+
+        logged = AppointmentTransition.objects.values_list('appointment', 'to_status', 'actor')
+        self.assertEqual(
+            sorted(logged), sorted([(stale.id, 'cancelled', None), (self.appointment.id, 'cancelled', self.patient.id)])
+        )
+
+    def test_turnaround_aggregates_the_log_within_budget(self):
+        now = timezone.now()
+        AppointmentTransition.record(
+            [(self.appointment.id, 'pending', now - timedelta(hours=hours)) for hours in (2, 4)], 'confirmed', at=now
+        )
+        AppointmentTransition.record([(self.appointment.id, 'confirmed', now - timedelta(hours=1))], 'cancelled', at=now)
+
+        self.assertWithinBudget(DashboardViewSet, 'turnaround', 'get', '/api/dashboard/turnaround/', self.admin)
+        response = self.client.get('/api/dashboard/turnaround/')
+        self.assertEqual(
+            [(row['from_status'], row['to_status'], row['count'], row['average'], row['longest'])
+             for row in response.data['transitions']],
+            [('confirmed', 'cancelled', 1, timedelta(hours=1), timedelta(hours=1)),
+             ('pending', 'confirmed', 2, timedelta(hours=3), timedelta(hours=4))]
+        )
+        self.assertEqual(self.client.get('/api/dashboard/turnaround/?from=nope').status_code, 400)
+
+    @skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN output is SQLite-specific')
+    def test_log_queries_are_index_only(self):
+        now = timezone.now()
+        turnaround = AppointmentTransition.objects.filter(at__gte=now - timedelta(days=30), at__lt=now).values(
+            'from_status', 'to_status'
+        ).annotate(count=Count('id'), average=Avg('elapsed'))
+        self.assertIn('COVERING INDEX transition_turnaround_idx (at>? AND at<?)', turnaround.explain())
+        self.assertIn('INDEX transition_history_idx (appointment_id=?)', self.appointment.transitions.explain())
+
+
+class AppointmentSeriesTests(QueryBudgetTestCase):
+    """Lazy materialization and virtual reservations of recurring series"""
+
+    def setUp(self):
+        cache.clear()
+        self.doctor = make_user('doctor')
+        self.patient = make_user('patient')
+        monday = timezone.localdate() + timedelta(days=7 - timezone.localdate().weekday() + 7)
+        self.start = timezone.make_aware(datetime.combine(monday, time(9)))
+
+    def post_series(self, **extra):
+        self.client.force_authenticate(user=self.patient)
+        return self.client.post('/api/appointment-series/', {
+            'patient_id': self.patient.id, 'doctor_id': self.doctor.id,
+            'start': self.start.isoformat(), 'frequency': 'weekly', 'interval': 1, **extra,
+        }, format='json')
+
+    def create_series(self, **extra):
+        response = self.post_series(**extra)
+        self.assertEqual(response.status_code, 201, response.content)
+        return AppointmentSeries.objects.get(id=response.data['id'])
+
+    def test_only_the_horizon_is_materialized(self):
+        instance = self.create_series(count=20)
+        horizon = series.horizon_end()
+        dates = list(instance.appointments.values_list('date_time', flat=True))
+        self.assertTrue(dates and all(date_time < horizon for date_time in dates))
+        self.assertLess(len(dates), 20)
+        self.assertEqual(sorted(instance.appointments.values_list('occurrence', flat=True)),
+                         list(range(len(dates))))
+
+        # Advancing the horizon materializes the next occurrences exactly once
+        later = horizon + timedelta(days=14)
+        series.materialize(instance, until=later)
+        series.materialize(instance, until=later)
+        self.assertEqual(instance.appointments.count(), len(dates) + 2)
+
+    def test_virtual_occurrences_block_booking_and_availability(self):
+        instance = self.create_series()
+        virtual = series.occurrence_at(instance, 10)
+        self.assertGreater(virtual, instance.materialized_until)
+
+        response = self.client.post('/api/appointments/', {
+            'patient_id': self.patient.id, 'doctor_id': self.doctor.id, 'date_time': virtual.isoformat(),
+        }, format='json')
+        self.assertEqual(response.status_code, 409)
+
+        day = timezone.localdate(virtual)
+        starts = [start for start, _ in availability.get_available_slots(self.doctor.id, day, day)]
+        self.assertNotIn(virtual, starts)
+        self.assertIn(virtual + timedelta(minutes=30), starts)
+
+    def test_stop_cancels_upcoming_occurrences(self):
+        instance = self.create_series()
+        self.assertWithinBudget(AppointmentSeriesViewSet, 'stop', 'post',
+                                f'/api/appointment-series/{instance.id}/stop/', self.patient)
+        self.assertFalse(instance.appointments.filter(status__in=Appointment.ACTIVE_STATUSES).exists())
+        self.assertFalse(list(series.virtual_reservations([self.doctor.id], self.start, self.start + timedelta(days=365))))
+
+    def test_series_clashing_with_a_booking_is_refused(self):
+        # Far past the horizon, and overlapping the 9:00 occurrence without sharing its start
+        clash = self.start + timedelta(weeks=10)
+        Appointment.objects.create(patient=self.patient, doctor=self.doctor, date_time=clash + timedelta(minutes=15))
+        response = self.post_series()
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['conflicts'], [clash.isoformat()])
+        self.assertFalse(AppointmentSeries.objects.exists())
+        self.assertFalse(Appointment.objects.filter(series__isnull=False).exists())
+
+        # A bounded series that ends before it is fine
+        self.create_series(count=10)
+
+    def test_series_clashing_with_another_series_is_refused(self):
+        self.create_series()
+        # Daily at 9:15 from Tuesday first meets the weekly Monday 9:00 six days later
+        response = self.post_series(start=(self.start + timedelta(days=1, minutes=15)).isoformat(), frequency='daily')
+        self.assertEqual(response.status_code, 409)
+        # Against its materialized occurrences and the first virtual one
+        conflicts = [parse_datetime(date_time) for date_time in response.data['conflicts']]
+        self.assertEqual(conflicts[0], self.start + timedelta(days=7, minutes=15))
+        self.assertEqual({date_time.weekday() for date_time in conflicts}, {self.start.weekday()})
+        self.assertGreater(conflicts[-1], AppointmentSeries.objects.get().materialized_until)
+        self.create_series(start=(self.start + timedelta(days=1, minutes=30)).isoformat(), frequency='daily')
+
+    def test_materialize_reports_occurrences_it_skips(self):
+        instance = self.create_series()
+        horizon = series.horizon_end()
+        taken = series.occurrence_at(instance, (horizon - self.start).days // 7 + 1)
+        Appointment.objects.create(patient=make_user('patient', 1), doctor=self.doctor, date_time=taken)
+
+        written, skipped = series.materialize(instance, until=taken + timedelta(days=1))
+        self.assertEqual(skipped, [taken])
+        self.assertFalse(instance.appointments.filter(date_time=taken).exists())
+
+    def test_materialize_skips_occurrences_overlapping_a_booking(self):
+        instance = self.create_series(start=(self.start + timedelta(minutes=30)).isoformat())
+        horizon = series.horizon_end()
+        taken = series.occurrence_at(instance, (horizon - instance.start).days // 7 + 1)
+        # Starts half an hour earlier, so only the unique constraint would not notice
+        Appointment.objects.create(patient=make_user('patient', 1), doctor=self.doctor,
+                                   date_time=taken - timedelta(minutes=30), duration=60)
+
+        written, skipped = series.materialize(instance, until=taken + timedelta(days=8))
+        self.assertEqual(skipped, [taken])
+        self.assertEqual(written, 1)
+        self.assertEqual(list(instance.appointments.filter(date_time__gte=taken).values_list('duration', flat=True)),
+                         [instance.duration])
+
+    def test_virtual_occurrences_hold_the_series_duration(self):
+        instance = self.create_series(duration=90)
+        virtual = series.occurrence_at(instance, 10)
+        self.assertGreater(virtual, instance.materialized_until)
+
+        response = self.client.post('/api/appointments/', {
+            'patient_id': self.patient.id, 'doctor_id': self.doctor.id,
+            'date_time': (virtual + timedelta(minutes=60)).isoformat(),
+        }, format='json')
+        self.assertEqual(response.status_code, 409)
+
+        day = timezone.localdate(virtual)
+        starts = [start for start, _ in availability.get_available_slots(self.doctor.id, day, day)]
+        self.assertNotIn(virtual + timedelta(minutes=60), starts)
+        self.assertIn(virtual + timedelta(minutes=90), starts)
+
+
+class WaitlistTests(QueryBudgetTestCase):
+    """Freed slots go to the longest-waiting patient whose window fits"""
+
+    def setUp(self):
+        self.doctor = make_user('doctor')
+        self.patient = make_user('patient')
+        self.waiting = [make_user('patient', i) for i in range(1, 4)]
+        self.slot = timezone.now().replace(second=0, microsecond=0) + timedelta(days=2)
+        self.appointment = Appointment.objects.create(
+            patient=self.patient, doctor=self.doctor, date_time=self.slot, status='confirmed'
+        )
+
+    def wait(self, patient, earliest, latest, **extra):
+        return WaitlistEntry.objects.create(
+            patient=patient, doctor=self.doctor, earliest=earliest, latest=latest, **extra
+        )
+
+    def cancel(self):
+        self.client.force_authenticate(user=self.patient)
+        self.assertEqual(self.client.post(f'/api/appointments/{self.appointment.id}/cancel/').status_code, 200)
+
+    def test_match_slots_is_first_come_first_served(self):
+        hour = timedelta(hours=1)
+        narrow = self.wait(self.waiting[0], self.slot + hour, self.slot + 2 * hour)
+        first = self.wait(self.waiting[1], self.slot, self.slot + 3 * hour)
+        second = self.wait(self.waiting[2], self.slot, self.slot + 3 * hour)
+        entries = sorted([narrow, first, second], key=lambda entry: entry.earliest)
+
+        slots = [(self.slot, 30), (self.slot + hour, 30), (self.slot + 2 * hour, 30)]
+        matches = waitlist.match_slots(slots, entries)
+        self.assertEqual(matches, [(first, *slots[0]), (narrow, *slots[1]), (second, *slots[2])])
+
+    def test_freed_slot_keeps_the_cancelled_appointments_length(self):
+        Appointment.objects.filter(id=self.appointment.id).update(duration=60)
+        # Too short a window for the whole hour, so the next entry gets it
+        short = self.wait(self.waiting[0], self.slot, self.slot + timedelta(minutes=30))
+        entry = self.wait(self.waiting[1], self.slot, self.slot + timedelta(hours=1))
+        self.cancel()
+        short.refresh_from_db()
+        entry.refresh_from_db()
+        self.assertEqual(short.status, 'waiting')
+        self.assertEqual((entry.status, entry.offered_slot, entry.offered_duration), ('offered', self.slot, 60))
+
+        self.client.force_authenticate(user=self.waiting[1])
+        self.assertEqual(self.client.post(f'/api/waitlist/{entry.id}/accept/').status_code, 201)
+        entry.refresh_from_db()
+        self.assertEqual(entry.appointment.duration, 60)
+
+    def test_cancel_auto_books_the_waiting_patient(self):
+        entry = self.wait(self.waiting[0], self.slot - timedelta(hours=1), self.slot + timedelta(hours=1),
+                          auto_book=True)
+        self.assertWithinBudget(AppointmentViewSet, 'cancel', 'post',
+                                f'/api/appointments/{self.appointment.id}/cancel/', self.patient)
+
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, 'booked')
+        self.assertEqual(entry.appointment.patient, self.waiting[0])
+        self.assertEqual(entry.appointment.date_time, self.slot)
+
+    def test_offer_can_be_accepted_before_it_expires(self):
+        entry = self.wait(self.waiting[0], self.slot, self.slot + timedelta(hours=1))
+        self.cancel()
+        entry.refresh_from_db()
+        self.assertEqual((entry.status, entry.offered_slot), ('offered', self.slot))
+
+        self.assertWithinBudget(WaitlistViewSet, 'accept', 'post',
+                                f'/api/waitlist/{entry.id}/accept/', self.waiting[0])
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, 'booked')
+        self.assertTrue(Appointment.objects.filter(
+            patient=self.waiting[0], date_time=self.slot, status='pending').exists())
+
+    def test_expired_offer_returns_to_the_queue(self):
+        entry = self.wait(self.waiting[0], self.slot, self.slot + timedelta(hours=1))
+        self.cancel()
+        WaitlistEntry.objects.filter(id=entry.id).update(offer_expires_at=timezone.now() - timedelta(minutes=1))
+
+        self.client.force_authenticate(user=self.waiting[0])
+        response = self.client.post(f'/api/waitlist/{entry.id}/accept/')
+        self.assertEqual(response.status_code, 400)
+        entry.refresh_from_db()
+        self.assertEqual((entry.status, entry.offered_slot), ('waiting', None))
+
+    def test_lapsed_offer_moves_on_to_the_next_waiting_patient(self):
+        first = self.wait(self.waiting[0], self.slot, self.slot + timedelta(hours=1))
+        second = self.wait(self.waiting[1], self.slot, self.slot + timedelta(hours=1))
+        self.cancel()
+        first.refresh_from_db()
+        self.assertEqual((first.status, first.offered_slot), ('offered', self.slot))
+
+        # The periodic sweep hands it on even though nothing else was cancelled
+        with self.assertLogs('mainapp.sweeper', level='INFO'):
+            sweeper.sweep(now=first.offer_expires_at + timedelta(seconds=1))
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.status, first.offered_slot), ('waiting', None))
+        self.assertEqual((second.status, second.offered_slot), ('offered', self.slot))
+
+        # Once someone has booked it, a lapsed slot is not offered again
+        Appointment.objects.create(patient=self.patient, doctor=self.doctor, date_time=self.slot)
+        self.assertEqual(waitlist.backfill([], second.offer_expires_at), [])
+        first.refresh_from_db()
+        self.assertEqual(first.status, 'waiting')
+
+    def test_bulk_cancel_can_skip_backfill(self):
+        entry = self.wait(self.waiting[0], self.slot, self.slot + timedelta(hours=1), auto_book=True)
+        self.client.force_authenticate(user=self.doctor)
+        response = self.client.post('/api/appointments/bulk-status/', {
+            'ids': [self.appointment.id], 'status': 'cancelled', 'backfill': False,
+        }, format='json')
+        self.assertEqual(response.data['moved'], [self.appointment.id])
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, 'waiting')
+
+
+class CalendarFeedTests(QueryBudgetTestCase):
+    """Signed, streamed iCalendar feed with cheap conditional GETs"""
+
+    def setUp(self):
+        self.doctor = make_user('doctor')
+        self.patient = make_user('patient')
+        self.slot = timezone.now().replace(microsecond=0) + timedelta(days=1)
+        self.appointment = Appointment.objects.create(
+            patient=self.patient, doctor=self.doctor, date_time=self.slot, reason='Follow-up; bring results'
+        )
+        Appointment.objects.create(patient=self.patient, doctor=self.doctor,
+                                   date_time=self.slot + timedelta(hours=1), status='cancelled')
+        self.url = f'/api/calendar/{ical.feed_token(self.doctor.id)}.ics'
+
+    def test_doctor_gets_subscription_url(self):
+        self.assertWithinBudget(DoctorViewSet, 'calendar_feed', 'get',
+                                f'/api/doctors/{self.doctor.id}/calendar-feed/', self.doctor)
+        self.client.force_authenticate(user=self.patient)
+        response = self.client.get(f'/api/doctors/{self.doctor.id}/calendar-feed/')
+        self.assertEqual(response.status_code, 403)
+
+    def test_feed_streams_events(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        body = b''.join(response.streaming_content).decode()
+        self.assertTrue(body.startswith('BEGIN:VCALENDAR\r\n'))
+        self.assertEqual(body.count('BEGIN:VEVENT'), 2)
+        self.assertIn(f'UID:appointment-{self.appointment.id}@ehr', body)
+        self.assertIn('STATUS:CANCELLED', body)
+        self.assertIn('Follow-up\\; bring results', body)
+        self.assertTrue(all(len(line.encode()) <= 75 for line in body.split('\r\n')))
+
+    def test_unchanged_feed_is_a_two_query_304(self):
+        etag = self.client.get(self.url)['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        # The feed version lookup and the index-only aggregate
+        self.assertEqual(len(queries), 2)
+
+        self.appointment.status = 'confirmed'
+        self.appointment.save()
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_forged_token_is_rejected(self):
+        self.assertEqual(self.client.get(f'/api/calendar/{self.doctor.id}:forged.ics').status_code, 404)
+
+    def test_rotating_the_feed_revokes_old_urls(self):
+        url = f'/api/doctors/{self.doctor.id}/calendar-feed/'
+        self.assertWithinBudget(DoctorViewSet, 'calendar_feed', 'post', url, self.doctor)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+        fresh = self.client.get(url).data['url']
+        self.assertEqual(self.client.get(fresh).status_code, 200)
+        self.assertWithinBudget(DoctorViewSet, 'calendar_feed', 'post', url, self.doctor)
+        self.assertEqual(self.client.get(fresh).status_code, 404)
+        self.assertEqual(self.client.get(self.client.get(url).data['url']).status_code, 200)
+
+        self.client.force_authenticate(user=self.patient)
+        self.assertEqual(self.client.post(url).status_code, 403)
+
+    @skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN output is SQLite-specific')
+    def test_etag_aggregate_is_index_only(self):
+        queryset = ical.feed_queryset(self.doctor.id).values('doctor').annotate(latest=Max('updated_at'))
+        self.assertIn('COVERING INDEX appointment_doctor_slot_idx', queryset.explain())
+
+
+class AgendaCacheTests(QueryBudgetTestCase):
+    """Doctor-day agendas are served from the LRU and dropped per doctor-day"""
+
+    def setUp(self):
+        cache.clear()
+        agenda.clear()
+        self.doctor = make_user('doctor')
+        self.other_doctor = make_user('doctor', 1)
+        self.patient = make_user('patient')
+        self.day = clinic_today() + timedelta(days=3)
+        self.start = day_window(self.day)[0] + timedelta(hours=9)
+        self.appointments = [
+            Appointment.objects.create(patient=self.patient, doctor=self.doctor,
+                                       date_time=self.start + timedelta(minutes=30 * i))
+            for i in range(3)
+        ]
+        self.url = f'/api/appointments/agenda/?date={self.day.isoformat()}'
+
+    def read(self):
+        self.client.force_authenticate(user=self.doctor)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        return response, len(queries)
+
+    def test_warm_agenda_costs_no_queries(self):
+        before = agenda.agendas.stats()
+        response, cold = self.read()
+        self.assertEqual(cold, 1)
+        self.assertEqual([a['id'] for a in response.data['appointments']], [a.id for a in self.appointments])
+        self.assertTrue(all(a['is_upcoming'] for a in response.data['appointments']))
+
+        response, warm = self.read()
+        self.assertEqual(warm, 0)
+
+        admin = make_user('admin')
+        admin.is_staff = True
+        admin.save()
+        self.assertWithinBudget(DashboardViewSet, 'agenda_cache', 'get', '/api/dashboard/agenda-cache/', admin)
+        stats = self.client.get('/api/dashboard/agenda-cache/').data
+        self.assertEqual((stats['hits'] - before['hits'], stats['misses'] - before['misses']), (1, 1))
+
+    def test_changes_drop_only_their_doctor_day(self):
+        self.read()
+        next_day = self.start + timedelta(days=1)
+        Appointment.objects.create(patient=self.patient, doctor=self.other_doctor, date_time=self.start)
+        Appointment.objects.create(patient=self.patient, doctor=self.doctor, date_time=next_day)
+        self.assertEqual(self.read()[1], 0)
+
+        self.appointments[1].status = 'cancelled'
+        self.appointments[1].save()
+        response, queries = self.read()
+        self.assertEqual(queries, 1)
+        self.assertNotIn(self.appointments[1].id, [a['id'] for a in response.data['appointments']])
+
+    def test_bulk_transition_invalidates(self):
+        self.read()
+        self.client.post('/api/appointments/bulk-status/', {
+            'ids': [self.appointments[0].id], 'status': 'cancelled',
+        }, format='json')
+        response, queries = self.read()
+        self.assertEqual(queries, 1)
+        self.assertEqual(len(response.data['appointments']), 2)
+
+    def test_lru_evicts_least_recently_used(self):
+        lru = agenda.LRUCache(2)
+        lru.set('a', 0, 1)
+        lru.set('b', 0, 2)
+        lru.get('a', 0)
+        lru.set('c', 0, 3)
+        self.assertIsNone(lru.get('b', 0))
+        self.assertEqual((lru.get('a', 0), lru.get('c', 0)), (1, 3))
+        self.assertIsNone(lru.get('a', 1))
+        self.assertEqual(lru.stats()['evictions'], 1)
+
+    def test_lru_entries_expire_after_max_age(self):
+        lru = agenda.LRUCache(2, max_age=60)
+        with mock.patch.object(agenda.time, 'monotonic', return_value=1000):
+            lru.set('a', 0, 1)
+        with mock.patch.object(agenda.time, 'monotonic', return_value=1060):
+            self.assertEqual(lru.get('a', 0), 1)
+        with mock.patch.object(agenda.time, 'monotonic', return_value=1061):
+            self.assertIsNone(lru.get('a', 0))
+
+
+class MonthCalendarTests(QueryBudgetTestCase):
+    """Month calendars count appointments per clinic day and status, cached per scope and month"""
+
+    def setUp(self):
+        cache.clear()
+        self.admin = make_user('admin')
+        self.doctor = make_user('doctor')
+        self.other_doctor = make_user('doctor', 1)
+        self.patient = make_user('patient')
+        self.month = date(2030, 3, 1)
+        self.start = day_window(self.month)[0] + timedelta(hours=9)
+
+    def book(self, doctor, date_time, status='pending'):
+        return Appointment.objects.create(patient=self.patient, doctor=doctor, date_time=date_time, status=status)
+
+    def read(self, user, query='?month=2030-03'):
+        self.client.force_authenticate(user=user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/api/appointments/calendar/{query}')
+        return response, len(queries)
+
+    def test_counts_per_day_and_status(self):
+        self.book(self.doctor, self.start)
+        self.book(self.doctor, self.start + timedelta(hours=1), 'confirmed')
+        self.book(self.doctor, self.start + timedelta(hours=2), 'confirmed')
+        self.book(self.other_doctor, self.start + timedelta(days=4), 'cancelled')
+        # Clinic-local edges of the month
+        self.book(self.doctor, day_window(date(2030, 3, 31))[1] - timedelta(minutes=30))
+        self.book(self.doctor, day_window(date(2030, 4, 1))[0])
+
+        response, _ = self.read(self.admin)
+        self.assertEqual(response.data['days'], {
+            '2030-03-01': {'pending': 1, 'confirmed': 2},
+            '2030-03-05': {'cancelled': 1},
+            '2030-03-31': {'pending': 1},
+        })
+        self.assertEqual(response.data['totals'], {'pending': 2, 'confirmed': 2, 'cancelled': 1})
+        self.assertEqual((response.data['month'], response.data['doctor_id']), ('2030-03', None))
+
+        response, _ = self.read(self.admin, f'?month=2030-03&doctor_id={self.other_doctor.id}')
+        self.assertEqual(response.data['days'], {'2030-03-05': {'cancelled': 1}})
+        # Doctors always see their own month
+        response, _ = self.read(self.doctor, f'?month=2030-03&doctor_id={self.other_doctor.id}')
+        self.assertEqual(response.data['doctor_id'], self.doctor.id)
+        self.assertEqual(response.data['totals'], {'pending': 2, 'confirmed': 2})
+
+    def test_warm_month_costs_no_queries(self):
+        self.book(self.doctor, self.start)
+        self.assertWithinBudget(AppointmentViewSet, 'calendar', 'get', '/api/appointments/calendar/', self.admin)
+        self.assertEqual(self.read(self.admin)[1], 1)
+        self.assertEqual(self.read(self.doctor)[1], 1)
+        self.assertEqual(self.read(self.admin)[1], 0)
+        self.assertEqual(self.read(self.doctor)[1], 0)
+
+    def test_changes_retire_only_their_months(self):
+        appointment = self.book(self.doctor, self.start)
+        self.read(self.admin)
+        self.read(self.doctor)
+
+        self.book(self.doctor, self.start + timedelta(days=40))
+        self.book(self.other_doctor, self.start)
+        self.assertEqual(self.read(self.doctor)[1], 0)
+        response, queries = self.read(self.admin)
+        self.assertEqual((queries, response.data['totals']), (1, {'pending': 2}))
+
+        transitions.transition(appointment, 'confirmed')
+        response, queries = self.read(self.doctor)
+        self.assertEqual((queries, response.data['totals']), (1, {'confirmed': 1}))
+
+        # Moving an appointment out of the month retires the month it left
+        appointment.date_time += timedelta(days=41)
+        appointment.save()
+        response, queries = self.read(self.doctor)
+        self.assertEqual((queries, response.data['days']), (1, {}))
+
+    def test_bad_requests(self):
+        self.assertEqual(self.read(self.patient)[0].status_code, 403)
+        for query in ('?month=2030-13', '?month=march', '?doctor_id=abc'):
+            self.assertEqual(self.read(self.admin, query)[0].status_code, 400, query)
+
+    @skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN output is SQLite-specific')
+    def test_counts_read_only_an_index(self):
+        for doctor_id, index in ((None, 'appointment_status_slot_idx'), (self.doctor.id, 'appointment_doctor_slot_idx')):
+            with CaptureQueriesContext(connection) as queries:
+                monthly.query(self.month, doctor_id)
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + queries[0]['sql'])
+                plan = ' '.join(str(row[-1]) for row in cursor.fetchall())
+            self.assertIn(f'COVERING INDEX {index}', plan)
+
+
+class LiveStatusTests(APITestCase):
+    """Status changes fan out to SSE subscribers, serialized once"""
+
+    def setUp(self):
+        self.doctor = make_user('doctor')
+        self.patient = make_user('patient')
+        self.appointment = Appointment.objects.create(
+            patient=self.patient, doctor=self.doctor, date_time=timezone.now() + timedelta(days=1)
+        )
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def subscribe(self, *topics):
+        async def subscribe():
+            return live.broker.subscribe(topics)
+        subscriber = self.loop.run_until_complete(subscribe())
+        self.addCleanup(live.broker.unsubscribe, subscriber)
+        return subscriber
+
+    def receive(self, subscriber):
+        return self.loop.run_until_complete(asyncio.wait_for(subscriber.queue.get(), 1))
+
+    def test_frame_is_rendered_once_for_every_subscriber(self):
+        screens = [self.subscribe(live.CLINIC_TOPIC) for _ in range(3)]
+        desk = self.subscribe(live.doctor_topic(self.doctor.id))
+        # Writers publish from their own thread
+        thread = threading.Thread(target=live.broker.publish, args=(
+            'appointment', {'id': 1, 'status': 'confirmed'}, [live.CLINIC_TOPIC, live.doctor_topic(self.doctor.id)]
+        ))
+        thread.start()
+        thread.join()
+
+        frames = [self.receive(subscriber) for subscriber in screens + [desk]]
+        self.assertTrue(all(frame is frames[0] for frame in frames))
+        self.assertIn(b'event: appointment\ndata: {"id":1,"status":"confirmed"}\n\n', frames[0])
+
+    def test_status_changes_are_published_after_commit(self):
+        desk = self.subscribe(live.doctor_topic(self.doctor.id))
+        other = self.subscribe(live.doctor_topic(self.doctor.id + 100))
+        self.client.force_authenticate(user=self.doctor)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/appointments/bulk-status/',
+                             {'ids': [self.appointment.id], 'status': 'confirmed'}, format='json')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.appointment.refresh_from_db()
+            self.appointment.notes = 'no status change'
+            self.appointment.save()
+            self.appointment.status = 'completed'
+            self.appointment.save()
+
+        self.assertIn(b'"status":"confirmed"', self.receive(desk))
+        self.assertIn(b'"status":"completed"', self.receive(desk))
+        self.assertTrue(desk.queue.empty())
+        self.assertTrue(other.queue.empty())
+
+    def test_slow_subscriber_is_dropped(self):
+        subscriber = self.subscribe(live.CLINIC_TOPIC)
+        for i in range(live.broker.queue_size + 1):
+            live.broker.publish('appointment', {'id': i}, [live.CLINIC_TOPIC])
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.assertIsNone(self.receive(subscriber))
+
+    async def test_stream_endpoint(self):
+        token = live.stream_token(self.doctor.id)
+        response = await self.async_client.get(f'/api/live/appointments/?token={token}')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        frames = aiter(response.streaming_content)
+        self.assertTrue((await anext(frames)).startswith(b'retry:'))
+
+        live.broker.publish('appointment', {'id': 7}, [live.doctor_topic(self.doctor.id)])
+        self.assertIn(b'data: {"id":7}', await asyncio.wait_for(anext(frames), 1))
+        for subscriber in set().union(*live.broker.topics.values()):
+            live.broker.unsubscribe(subscriber)
+
+    async def test_disconnect_unsubscribes(self):
+        frames = live.stream([live.CLINIC_TOPIC])
+        await anext(frames)
+        pending = asyncio.ensure_future(anext(frames))
+        await asyncio.sleep(0)
+        self.assertEqual(live.broker.subscriber_count(), 1)
+        # The ASGI handler cancels the response task when the client goes away
+        pending.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await pending
+        self.assertEqual(live.broker.subscriber_count(), 0)
+
+    async def test_stream_rejects_patients_and_forged_or_expired_tokens(self):
+        response = await self.async_client.get(f'/api/live/appointments/?token={live.stream_token(self.patient.id)}')
+        self.assertEqual(response.status_code, 403)
+        response = await self.async_client.get(f'/api/live/appointments/?token={self.doctor.id}:forged')
+        self.assertEqual(response.status_code, 401)
+        token = live.stream_token(self.doctor.id)
+        with override_settings(LIVE_TOKEN_MAX_AGE=-1):
+            response = await self.async_client.get(f'/api/live/appointments/?token={token}')
+        self.assertEqual(response.status_code, 401)
+
+
+class TriageQueueTests(QueryBudgetTestCase):
+    """Walk-ins are called by priority then arrival, consistently across workers"""
+
+    def setUp(self):
+        triage.queue.reset()
+        self.addCleanup(triage.queue.reset)
+        self.admin = make_user('admin')
+        self.doctor = make_user('doctor')
+        self.arrival = timezone.now() - timedelta(hours=1)
+
+    def arrive(self, name, priority, minutes):
+        return triage.enqueue(name=name, priority=priority, arrived_at=self.arrival + timedelta(minutes=minutes))
+
+    def test_priority_then_arrival_order(self):
+        late_urgent = self.arrive('late urgent', 2, 30)
+        early_standard = self.arrive('early standard', 4, 0)
+        early_urgent = self.arrive('early urgent', 2, 10)
+        self.assertEqual(triage.queue.ordered(), [early_urgent.id, late_urgent.id, early_standard.id])
+
+        self.assertTrue(triage.reprioritize(early_standard.id, 1))
+        self.assertEqual(triage.call_next(self.doctor), early_standard.id)
+        self.assertEqual(triage.call_next(self.doctor), early_urgent.id)
+        self.assertFalse(triage.reprioritize(early_urgent.id, 5))
+
+    def test_workers_share_the_log_and_restart_loses_nothing(self):
+        first = self.arrive('first', 3, 0)
+        second = self.arrive('second', 3, 5)
+        other_worker = triage.TriageQueue()
+        other_worker.sync()
+        self.assertEqual(other_worker.ordered(), [first.id, second.id])
+
+        # This worker calls the first patient; the other worker never calls them again
+        self.assertEqual(triage.call_next(self.doctor), first.id)
+        third = self.arrive('third', 1, 10)
+        other_worker.sync()
+        self.assertEqual(other_worker.ordered(), [third.id, second.id])
+
+        restarted = triage.TriageQueue()
+        restarted.sync()
+        self.assertEqual(restarted.ordered(), other_worker.ordered())
+
+    def test_stale_heap_never_calls_twice(self):
+        walk_in = self.arrive('only', 3, 0)
+        stale_worker = triage.TriageQueue()
+        stale_worker.sync()
+        WalkIn.objects.filter(id=walk_in.id).update(status='called')
+        self.assertEqual(stale_worker.peek(), walk_in.id)
+        self.assertIsNone(triage.call_next(self.doctor))
+
+    def test_api_within_budget(self):
+        for minutes in range(5):
+            self.arrive(f'walk-in {minutes}', 4, minutes)
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.post('/api/walk-ins/', {'name': 'New', 'priority': 2, 'complaint': 'chest pain'},
+                                    format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        new_id = response.data['id']
+
+        count = self.assertWithinBudget(WalkInViewSet, 'list', 'get', '/api/walk-ins/', self.admin)
+        response = self.client.get('/api/walk-ins/')
+        self.assertEqual((response.data[0]['id'], response.data[0]['position']), (new_id, 1))
+        self.arrive('one more', 5, 20)
+        self.assertEqual(self.assertWithinBudget(WalkInViewSet, 'list', 'get', '/api/walk-ins/', self.admin), count)
+
+        last = response.data[-1]['id']
+        self.assertWithinBudget(WalkInViewSet, 'reprioritize', 'post', f'/api/walk-ins/{last}/reprioritize/',
+                                self.admin, {'priority': 1})
+        self.assertWithinBudget(WalkInViewSet, 'call_next', 'post', '/api/walk-ins/call-next/', self.doctor)
+        self.assertEqual(WalkIn.objects.get(id=last).doctor, self.doctor)
+        self.assertWithinBudget(WalkInViewSet, 'leave', 'post', f'/api/walk-ins/{new_id}/leave/', self.admin)
+
+        self.client.force_authenticate(user=make_user('patient'))
+        self.assertEqual(self.client.get('/api/walk-ins/').status_code, 403)
+
+
+class RecordingTransport(reminders.Transport):
+    def __init__(self, fail=()):
+        self.sent = []
+        self.fail = set(fail)
+
+    def send(self, batch):
+        delivered = [reminder for reminder in batch if reminder.appointment_id not in self.fail]
+        self.sent.extend(delivered)
+        return [reminder.appointment_id for reminder in delivered]
+
+
+@override_settings(APPOINTMENT_REMINDER_MINUTES=[24 * 60, 2 * 60])
+class ReminderTests(APITestCase):
+    """Due reminders are found by an index range scan and marked sent per batch"""
+
+    def setUp(self):
+        self.doctor = make_user('doctor')
+        self.patient = make_user('patient')
+        self.now = timezone.now()
+
+    def book(self, hours, **extra):
+        return Appointment.objects.create(
+            patient=self.patient, doctor=self.doctor, date_time=self.now + timedelta(hours=hours), **extra
+        )
+
+    def send(self, now=None, **kwargs):
+        transport = RecordingTransport(**kwargs)
+        totals = reminders.send_due(now or self.now, transport=transport, batch_size=2, workers=2)
+        return transport, totals
+
+    def test_each_stage_goes_out_once(self):
+        tomorrow = self.book(20)
+        soon = self.book(1)
+        later = self.book(30)
+        self.book(10, status='cancelled')
+
+        transport, totals = self.send()
+        self.assertEqual(totals, {'sent': 2, 'failed': 0, 'skipped': 0})
+        # A late booking only gets the reminder that still makes sense
+        self.assertEqual(sorted((r.appointment_id, r.minutes_before) for r in transport.sent),
+                         sorted([(tomorrow.id, 1440), (soon.id, 120)]))
+        self.assertEqual(self.send()[1]['sent'], 0)
+
+        transport, _ = self.send(self.now + timedelta(hours=19))
+        self.assertEqual([(r.appointment_id, r.minutes_before) for r in transport.sent],
+                         [(tomorrow.id, 120), (later.id, 1440)])
+
+    def test_failed_sends_are_retried(self):
+        first = self.book(3)
+        second = self.book(4)
+        _, totals = self.send(fail=[first.id])
+        self.assertEqual(totals, {'sent': 1, 'failed': 1, 'skipped': 0})
+        transport, _ = self.send()
+        self.assertEqual([r.appointment_id for r in transport.sent], [first.id])
+        self.assertEqual(Appointment.objects.get(id=second.id).reminders_sent, 1)
+
+    def test_patients_without_email_are_skipped_not_retried(self):
+        reachable = self.book(4)
+        self.patient = make_user('patient', 1)
+        User.objects.filter(id=self.patient.id).update(email='')
+        unreachable = self.book(3)
+
+        transport, totals = self.send()
+        self.assertEqual(totals, {'sent': 1, 'failed': 0, 'skipped': 1})
+        self.assertEqual([r.appointment_id for r in transport.sent], [reachable.id])
+        self.assertEqual(Appointment.objects.get(id=unreachable.id).reminders_sent, 1)
+        self.assertEqual(self.send()[1], {'sent': 0, 'failed': 0, 'skipped': 0})
+
+    def test_transport_errors_are_logged_and_retried(self):
+        appointment = self.book(3)
+        transport = RecordingTransport()
+        with mock.patch.object(transport, 'send', side_effect=ConnectionError('SMTP down')):
+            with self.assertLogs('mainapp.reminders', 'ERROR') as logs:
+                totals = reminders.send_due(self.now, transport=transport, batch_size=2, workers=2)
+        self.assertEqual(totals, {'sent': 0, 'failed': 1, 'skipped': 0})
+        self.assertIn('SMTP down', logs.output[0])
+        self.assertEqual([r.appointment_id for r in self.send()[0].sent], [appointment.id])
+
+    def test_transport_must_implement_send(self):
+        with self.assertRaises(TypeError):
+            reminders.Transport()
+
+    def test_rescheduling_resets_reminders(self):
+        appointment = self.book(3)
+        self.send()
+        appointment.refresh_from_db()
+        appointment.date_time += timedelta(days=2)
+        appointment.save()
+        self.assertEqual(Appointment.objects.get(id=appointment.id).reminders_sent, 0)
+
+    def test_file_transport_writes_outbox(self):
+        appointment = self.book(3)
+        with tempfile.TemporaryDirectory() as directory:
+            outbox = os.path.join(directory, 'outbox.jsonl')
+            with override_settings(REMINDER_OUTBOX=outbox):
+                reminders.send_due(self.now, transport=reminders.FileTransport())
+            with open(outbox) as lines:
+                self.assertIn(f'"appointment_id": {appointment.id}', lines.read())
+
+    @skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN output is SQLite-specific')
+    def test_due_scan_uses_partial_index(self):
+        plan = reminders.due_query(0, 1440, self.now).explain()
+        self.assertIn('appointment_reminder_due_idx', plan)
+        self.assertIn('date_time>?', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+
+class PendingSweeperTests(APITestCase):
+    """Stale pending appointments are cancelled in chunks"""
+
+    def setUp(self):
+        cache.clear()
+        self.doctor = make_user('doctor')
+        self.patient = make_user('patient')
+        self.now = timezone.now()
+
+    def book(self, hours, created_hours_ago=0, **extra):
+        appointment = Appointment.objects.create(
+            patient=self.patient, doctor=self.doctor, date_time=self.now + timedelta(hours=hours), **extra
+        )
+        Appointment.objects.filter(id=appointment.id).update(created_at=self.now - timedelta(hours=created_hours_ago))
+        return appointment
+
+    def sweep(self, **kwargs):
+        with self.assertLogs('mainapp.sweeper', 'INFO') as logs:
+            result = sweeper.sweep(self.now, max_age=timedelta(hours=72), **kwargs)
+        return result, logs.output
+
+    def test_expires_past_and_old_pending_only(self):
+        past = [self.book(-hours) for hours in (1, 2, 3)]
+        old = self.book(24, created_hours_ago=100)
+        fresh = self.book(25, created_hours_ago=1)
+        confirmed = self.book(-5, status='confirmed')
+
+        result, logs = self.sweep(chunk_size=2)
+        self.assertEqual((result['expired'], result['chunks']), (4, 3))
+        self.assertIn('Expired 4 pending appointments in 3 chunks', logs[0])
+
+        statuses = dict(Appointment.objects.values_list('id', 'status'))
+        self.assertEqual({statuses[a.id] for a in past + [old]}, {'cancelled'})
+        self.assertEqual((statuses[fresh.id], statuses[confirmed.id]), ('pending', 'confirmed'))
+        self.assertEqual(self.sweep()[0]['expired'], 0)
+
+    def test_expired_slot_is_free_again(self):
+        old = self.book(24, created_hours_ago=100)
+        day = clinic_today() + timedelta(days=1)
+        availability.get_available_slots(self.doctor.id, day, day)  # warm the cache
+        self.sweep()
+
+        self.client.force_authenticate(user=self.patient)
+        response = self.client.post('/api/appointments/', {
+            'patient_id': self.patient.id, 'doctor_id': self.doctor.id, 'date_time': old.date_time.isoformat(),
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+
+    def test_stale_rows_are_found_through_indexes(self):
+        for queryset in sweeper.stale_querysets(self.now, timedelta(hours=72)):
+            plan = queryset.values_list('id', 'doctor_id', 'date_time')[:500].explain()
+            self.assertRegex(plan, r'USING INDEX appointment_status_(slot|created)_idx \(status=\? AND \w+<\?\)')
+
+    def test_command_reports_counts(self):
+        self.book(-1)
+        out = StringIO()
+        with self.assertLogs('mainapp.sweeper', 'INFO'):
+            call_command('expire_pending', '--chunk-size', '10', stdout=out)
+        self.assertIn('Expired 1 pending appointments in 1 chunks', out.getvalue())
+
+    def test_zero_max_age_expires_every_pending_appointment(self):
+        fresh = self.book(25)
+        out = StringIO()
+        with self.assertLogs('mainapp.sweeper', 'INFO'):
+            call_command('expire_pending', '--max-age-hours', '0', stdout=out)
+        self.assertIn('Expired 1 pending appointments', out.getvalue())
+        fresh.refresh_from_db()
+        self.assertEqual(fresh.status, 'cancelled')
+
+    def test_periodic_sweeper_starts_with_the_app_only_when_configured(self):
+        config = apps.get_app_config('mainapp')
+        with mock.patch.object(sweeper, 'start_periodic') as start:
+            config.ready()
+            start.assert_not_called()
+            with override_settings(SWEEP_INTERVAL_SECONDS=60):
+                config.ready()
+            start.assert_called_once_with()
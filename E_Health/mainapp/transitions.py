@@ -0,0 +1,144 @@
+"""
+Appointment status transitions.
+
+Every move follows ``Appointment.STATUS_TRANSITIONS`` and is a
+compare-and-swap: one conditional ``UPDATE ... WHERE status=<expected>``
+that touches only the status columns, so of two concurrent transitions
+exactly one wins and a row whose status changed in the meantime is never
+overwritten. Each won move appends to the ``AppointmentTransition`` log in
+the same transaction. Bulk moves pick eligible rows with one read and move
+each source status with one UPDATE.
+"""
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import waitlist
+from .models import Appointment, AppointmentTransition
+from .signals import appointments_changed, statuses_changed
+
+
+TRANSITIONS = Appointment.STATUS_TRANSITIONS
+
+# Statuses only the appointment's doctor may move it to
+DOCTOR_TARGETS = ('confirmed', 'completed', 'no_show')
+
+
+def transition(appointment, target, user=None, now=None, guard=None):
+    """
+    Move ``appointment`` from the status it was loaded with to ``target``.
+
+    Returns True if this call won. False means the row left that status (or
+    no longer matches ``guard``) first; the instance is then refreshed so the
+    caller can report the current status.
+    """
+    if not appointment.can_transition(target):
+        raise ValueError(f'Cannot move a {appointment.status} appointment to {target}')
+    now = now or timezone.now()
+    source = appointment.status
+    with transaction.atomic():
+        won = Appointment.objects.filter(guard or Q(), id=appointment.id, status=source).update(
+            status=target, status_changed_at=now, updated_at=now
+        )
+        if won:
+            AppointmentTransition.record([(appointment.id, source, appointment.status_changed_at)], target, user, now)
+
+    # Computed flags annotated at load time may no longer hold either way
+    for name in Appointment.FLAG_ANNOTATIONS:
+        appointment.__dict__.pop(name, None)
+    if not won:
+        appointment.refresh_from_db(fields=['status', 'status_changed_at', 'updated_at'])
+        return False
+    appointment.status = appointment._loaded_status = target
+    appointment.status_changed_at = appointment.updated_at = now
+    appointments_changed([(appointment.doctor_id, appointment.date_time)])
+    statuses_changed([(appointment.id, appointment.doctor_id, appointment.date_time, target)])
+    return True
+
+
+def ownership_filter(user, target):
+    """Return the Q selecting rows ``user`` may move to ``target``, or None if none"""
+    if target in DOCTOR_TARGETS:
+        # Only the assigned doctor can confirm, complete or mark a no-show
+        return Q(doctor=user) if user.is_doctor() else None
+    if user.is_admin():
+        return Q()
+    return Q(patient=user) | Q(doctor=user)
+
+
+def rejection_reason(row, user, target, now):
+    """Explain why ``row`` (a dict of id, status, doctor_id, patient_id, date_time) cannot move"""
+    if target in DOCTOR_TARGETS:
+        if not user.is_doctor() or row['doctor_id'] != user.id:
+            return f'Only the assigned doctor can move appointments to {target}'
+    elif not (user.is_admin() or user.id in (row['doctor_id'], row['patient_id'])):
+        return 'You can only cancel your own appointments'
+
+    if row['status'] not in TRANSITIONS[target]:
+        return f'Cannot move a {row["status"]} appointment to {target}'
+    if target == 'cancelled' and row['date_time'] <= now:
+        return 'This appointment cannot be cancelled'
+    if target == 'no_show' and row['date_time'] > now:
+        return 'This appointment has not started yet'
+    return None
+
+
+def bulk_transition(queryset, user, ids, target, now=None, backfill=True):
+    """
+    Move the appointments ``ids`` within ``queryset`` (the caller's visible
+    rows) to ``target``. Slots freed by cancellation go to the waitlist unless
+    ``backfill`` is off (e.g. the doctor is unavailable). Returns (moved ids,
+    {id: reason} for rejected ids).
+    """
+    now = now or timezone.now()
+    ids = set(ids)
+    rows = {
+        row['id']: row
+        for row in queryset.filter(id__in=ids).values(
+            'id', 'status', 'doctor_id', 'patient_id', 'date_time', 'duration', 'status_changed_at'
+        )
+    }
+
+    rejected = {pk: 'Appointment not found' for pk in ids - rows.keys()}
+    eligible = {}
+    for pk, row in rows.items():
+        reason = rejection_reason(row, user, target, now)
+        if reason:
+            rejected[pk] = reason
+        else:
+            eligible.setdefault(row['status'], []).append(pk)
+
+    guard = ownership_filter(user, target)
+    if guard is None:
+        # The user may move no row to ``target``: rejection_reason turned every one down
+        eligible = {}
+    elif target == 'cancelled':
+        guard &= Q(date_time__gt=now)
+    elif target == 'no_show':
+        guard &= Q(date_time__lte=now)
+
+    moved = []
+    with transaction.atomic():
+        for source, source_ids in eligible.items():
+            updated = Appointment.objects.filter(guard, id__in=source_ids, status=source).update(
+                status=target, status_changed_at=now, updated_at=now
+            )
+            if updated == len(source_ids):
+                won = source_ids
+            else:
+                # Lost a race for some rows: report the ones that did not move
+                current = dict(Appointment.objects.filter(id__in=source_ids).values_list('id', 'updated_at'))
+                won = [pk for pk in source_ids if current.get(pk) == now]
+                for pk in set(source_ids) - set(won):
+                    rejected[pk] = 'Status changed concurrently'
+            moved.extend(won)
+            AppointmentTransition.record(
+                [(pk, source, rows[pk]['status_changed_at']) for pk in won], target, user, now
+            )
+
+    slots = [(rows[pk]['doctor_id'], rows[pk]['date_time']) for pk in moved]
+    appointments_changed(slots)
+    statuses_changed((pk, rows[pk]['doctor_id'], rows[pk]['date_time'], target) for pk in moved)
+    if target == 'cancelled' and backfill:
+        waitlist.backfill([(*slot, rows[pk]['duration']) for slot, pk in zip(slots, moved)], now)
+    return sorted(moved), rejected
@@ -0,0 +1,141 @@
+"""
+Walk-in triage queue.
+
+Each worker keeps the waiting walk-ins in a binary heap keyed on
+(priority, arrived_at, id). Every operation is written ahead to the
+database before any heap changes: the ``WalkIn`` row and a ``TriageEvent``
+log entry commit together, and workers then replay the log after the last
+event they applied. So every process follows changes made by any other with
+one indexed read, and a restarted worker rebuilds its heap from the waiting
+rows and loses nothing.
+
+Reprioritizing pushes a fresh heap entry and leaves the stale one to be
+skipped when it surfaces, so enqueue, dequeue and reprioritize are all
+O(log n). Calling the next patient is a conditional UPDATE on the row still
+being ``waiting``, so doctors on different workers never call the same
+patient. The log relies on event ids becoming visible in commit order, which
+holds on SQLite, where writers commit one at a time.
+"""
+import heapq
+import threading
+
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import TriageEvent, WalkIn
+
+
+class TriageQueue:
+    """One worker's in-memory view of the queue, kept current from the event log"""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.heap = []
+        # walk_in_id -> its current heap key; heap keys not in here are stale
+        self.entries = {}
+        self.last_event = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def push(self, walk_in_id, priority, arrived_at):
+        key = (priority, arrived_at, walk_in_id)
+        self.entries[walk_in_id] = key
+        heapq.heappush(self.heap, key)
+
+    def discard(self, walk_in_id):
+        self.entries.pop(walk_in_id, None)
+        # Keep stale keys from outnumbering live ones
+        if len(self.heap) > 2 * len(self.entries) + 64:
+            self.heap = list(self.entries.values())
+            heapq.heapify(self.heap)
+
+    def peek(self):
+        """Return the id of the walk-in to call next, or None if nobody waits"""
+        while self.heap and self.entries.get(self.heap[0][2]) != self.heap[0]:
+            heapq.heappop(self.heap)
+        return self.heap[0][2] if self.heap else None
+
+    def ordered(self):
+        """Waiting walk-in ids in calling order"""
+        return [key[2] for key in sorted(self.entries.values())]
+
+    def reset(self):
+        """Forget the local heap; the next sync rebuilds it from the database"""
+        with self.lock:
+            self.heap, self.entries, self.last_event = [], {}, None
+
+    def rebuild(self):
+        """Load the waiting rows and the log position they reflect"""
+        with transaction.atomic():
+            last_event = TriageEvent.objects.aggregate(last=Max('id'))['last'] or 0
+            rows = list(WalkIn.objects.filter(status='waiting').values_list('priority', 'arrived_at', 'id'))
+        self.entries = {key[2]: key for key in rows}
+        self.heap = rows
+        heapq.heapify(self.heap)
+        self.last_event = last_event
+
+    def sync(self):
+        """Apply log events written since the last sync (by any worker)"""
+        with self.lock:
+            if self.last_event is None:
+                self.rebuild()
+                return
+            events = TriageEvent.objects.filter(id__gt=self.last_event).order_by('id').values_list(
+                'id', 'walk_in_id', 'kind', 'priority', 'walk_in__arrived_at'
+            )
+            for event_id, walk_in_id, kind, priority, arrived_at in events:
+                if kind in ('enqueue', 'reprioritize'):
+                    self.push(walk_in_id, priority, arrived_at)
+                else:
+                    self.discard(walk_in_id)
+                self.last_event = event_id
+
+
+queue = TriageQueue()
+
+
+def enqueue(**fields):
+    """Add a walk-in to the queue"""
+    with transaction.atomic():
+        walk_in = WalkIn.objects.create(**fields)
+        TriageEvent.objects.create(walk_in=walk_in, kind='enqueue', priority=walk_in.priority)
+    queue.sync()
+    return walk_in
+
+
+def _move(walk_in_id, kind, now=None, **changes):
+    """Apply ``changes`` to a still-waiting walk-in and log ``kind``; False if it no longer waits"""
+    now = now or timezone.now()
+    with transaction.atomic():
+        moved = WalkIn.objects.filter(id=walk_in_id, status='waiting').update(updated_at=now, **changes)
+        if moved:
+            TriageEvent.objects.create(walk_in_id=walk_in_id, kind=kind, priority=changes.get('priority'))
+    queue.sync()
+    return bool(moved)
+
+
+def reprioritize(walk_in_id, priority):
+    """Change a waiting walk-in's triage priority"""
+    return _move(walk_in_id, 'reprioritize', priority=priority)
+
+
+def leave(walk_in_id):
+    """Take a walk-in who left without being seen out of the queue"""
+    return _move(walk_in_id, 'leave', status='left')
+
+
+def call_next(doctor, now=None):
+    """Call the most urgent, longest-waiting walk-in for ``doctor``; None if nobody waits"""
+    now = now or timezone.now()
+    with queue.lock:
+        queue.sync()
+        while True:
+            walk_in_id = queue.peek()
+            if walk_in_id is None:
+                return None
+            if _move(walk_in_id, 'call', now, status='called', doctor=doctor, called_at=now):
+                return walk_in_id
+            # Another worker called them first; its log entry is applied by now
+            queue.discard(walk_in_id)
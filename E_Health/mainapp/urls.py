@@ -5,9 +5,15 @@ from . import views
 # Create a router and register our viewsets with it
 router = DefaultRouter()
 router.register(r'users', views.UserViewSet, basename='user')
+router.register(r'doctors', views.DoctorViewSet, basename='doctor')
 router.register(r'auth', views.AuthViewSet, basename='auth')
 router.register(r'patient-profiles', views.PatientProfileViewSet, basename='patient-profile')
+router.register(r'doctor-profiles', views.DoctorProfileViewSet, basename='doctor-profile')
 router.register(r'appointments', views.AppointmentViewSet, basename='appointment')
+router.register(r'resources', views.ResourceViewSet, basename='resource')
+router.register(r'appointment-series', views.AppointmentSeriesViewSet, basename='appointment-series')
+router.register(r'waitlist', views.WaitlistViewSet, basename='waitlist')
+router.register(r'walk-ins', views.WalkInViewSet, basename='walk-in')
 router.register(r'medical-records', views.MedicalRecordViewSet, basename='medical-record')
 router.register(r'dashboard', views.DashboardViewSet, basename='dashboard')
 
@@ -18,6 +24,8 @@ urlpatterns = [
     
     # Custom URL patterns (if needed)
     path('health-check/', views.health_check, name='health-check'),
+    path('calendar/<str:token>.ics', views.calendar_feed, name='calendar-feed'),
+    path('live/appointments/', views.appointment_events, name='appointment-events'),
 ]
 
 # Add custom actions to the router
@@ -25,8 +33,31 @@ urlpatterns = [
 # POST /api/appointments/{id}/confirm/
 # POST /api/appointments/{id}/complete/
 # POST /api/appointments/{id}/cancel/
+# POST /api/appointments/{id}/no-show/
+# GET /api/appointments/{id}/history/
+# POST /api/appointments/bulk/
+# POST /api/appointments/bulk-status/
 # GET /api/appointments/upcoming/
 # GET /api/appointments/today/
+# GET /api/appointments/agenda/?date=2025-09-01
+# GET /api/appointments/calendar/?month=2025-09&doctor_id=3
+# GET /api/appointments/no-show-risk/?date=2025-09-01&doctor_id=3
+# GET /api/appointments/live-token/
+# GET /api/live/appointments/ (Server-Sent Events)
+# POST /api/appointment-series/{id}/stop/
+# POST /api/waitlist/{id}/accept/
+# POST /api/walk-ins/call-next/
+# POST /api/walk-ins/{id}/reprioritize/
+# POST /api/walk-ins/{id}/leave/
+# GET /api/doctors/{id}/availability/?from=2025-09-01&to=2025-09-07
+# GET /api/doctors/earliest/?specialty=cardiology&count=5
+# GET|PUT /api/doctors/{id}/working-hours/
+# POST /api/doctors/{id}/reschedule/
+# GET /api/resources/availability/?resource_ids=1,2&doctor_id=3&minutes=60
+# GET /api/doctors/{id}/calendar-feed/
+# GET /api/calendar/{token}.ics
 # GET /api/medical-records/patient-history/?patient_id=123
 # GET /api/dashboard/stats/
 # GET /api/dashboard/recent-activity/
+# GET /api/dashboard/turnaround/?from=2025-09-01&to=2025-09-30
+# GET /api/dashboard/agenda-cache/
@@ -1,18 +1,43 @@
-from rest_framework import viewsets, status, permissions
+from rest_framework import mixins, viewsets, status, permissions
 from rest_framework.decorators import action, api_view
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
-from django.db.models import Count, Q
+from django.conf import settings
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.db import transaction
+from django.db.models import Avg, Count, F, Max, Q
 from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.views.decorators.http import condition, require_safe
+from collections import Counter
 from datetime import datetime, timedelta
 
 from authuser.models import User
-from .models import Appointment, MedicalRecord, PatientProfile
+from . import (
+    agenda, availability, booking, ical, live, monthly, reschedule, resources, schedule, series, transitions, triage,
+    waitlist
+)
+from .clinic_time import clinic_today, day_range_filter
+from .models import (
+    Appointment, AppointmentSeries, AppointmentTransition, DoctorProfile, MedicalRecord, PatientProfile,
+    Resource, WaitlistEntry, WalkIn
+)
+from .pagination import KeysetPagination
 from .serializers import (
-    UserSerializer, UserLoginSerializer, PatientProfileSerializer,
+    UserSerializer, UserLoginSerializer, PatientProfileSerializer, DoctorProfileSerializer,
     AppointmentSerializer, MedicalRecordSerializer, AppointmentListSerializer,
-    MedicalRecordListSerializer, DashboardStatsSerializer
+    MedicalRecordListSerializer, DashboardStatsSerializer, AppointmentBulkSerializer,
+    AppointmentBulkItemSerializer, AppointmentBulkStatusSerializer, AppointmentSeriesSerializer,
+    WaitlistEntrySerializer, WalkInSerializer, WalkInPrioritySerializer, AppointmentTransitionSerializer,
+    WorkingHoursSerializer, ResourceSerializer, RescheduleSerializer
+)
+
+# Relations read by the medical record serializers (the nested appointment
+# serializer also reads the appointment's patient and doctor)
+MEDICAL_RECORD_RELATED = (
+    'patient', 'doctor', 'appointment', 'appointment__patient', 'appointment__doctor'
 )
 
 
@@ -26,6 +51,77 @@ def health_check(request):
     })
 
 
+def request_now(request):
+    """The request's single "now", shared by every annotation and check made for it"""
+    if not hasattr(request, 'now'):
+        request.now = timezone.now()
+    return request.now
+
+
+def parse_flag(value):
+    """Parse a true/false query parameter; None if it is neither"""
+    return {'true': True, 'false': False}.get(value.lower())
+
+
+def calendar_feed_etag(request, token):
+    doctor_id = ical.doctor_id_for_token(token)
+    return ical.feed_etag(doctor_id) if doctor_id else None
+
+
+@require_safe
+@condition(etag_func=calendar_feed_etag)
+def calendar_feed(request, token):
+    """Doctor's appointments as an iCalendar feed, authenticated by the signed token in the URL"""
+    doctor_id = ical.doctor_id_for_token(token)
+    if doctor_id is None:
+        raise Http404('Unknown calendar feed')
+    
+    response = StreamingHttpResponse(ical.stream_feed(doctor_id), content_type='text/calendar; charset=utf-8')
+    response['Content-Disposition'] = 'inline; filename="appointments.ics"'
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+async def appointment_events(request):
+    """
+    Stream appointment status changes as Server-Sent Events.
+    
+    Doctors follow their own schedule; admins follow ?doctor_id= or the whole
+    clinic. Browsers authenticate with their session, other clients with a
+    ?token= from /api/appointments/live-token/.
+    """
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+    
+    token = request.GET.get('token')
+    if token:
+        user_id = live.user_id_for_token(token)
+        user = await User.objects.filter(id=user_id, is_active=True).afirst() if user_id else None
+    else:
+        user = await request.auser()
+        if not user.is_authenticated:
+            user = None
+    if user is None:
+        return JsonResponse({'error': 'Authentication credentials were not provided'}, status=401)
+    
+    doctor_id = request.GET.get('doctor_id')
+    if user.is_doctor():
+        if doctor_id and doctor_id != str(user.id):
+            return JsonResponse({'error': 'You can only follow your own schedule'}, status=403)
+        topics = [live.doctor_topic(user.id)]
+    elif user.is_admin():
+        if doctor_id and not doctor_id.isdigit():
+            return JsonResponse({'error': 'doctor_id must be an integer'}, status=400)
+        topics = [live.doctor_topic(int(doctor_id)) if doctor_id else live.CLINIC_TOPIC]
+    else:
+        return JsonResponse({'error': 'Only doctors and admins can follow live updates'}, status=403)
+    
+    response = StreamingHttpResponse(live.stream(topics), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Let reverse proxies flush every event
+    return response
+
+
 class UserViewSet(viewsets.ModelViewSet):
     """
     ViewSet for user management (registration, profile updates)
@@ -95,27 +191,343 @@ class AuthViewSet(viewsets.ViewSet):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class DoctorViewSet(viewsets.GenericViewSet):
+    """
+    ViewSet for doctor scheduling lookups
+    """
+    queryset = User.objects.filter(role='doctor')
+    permission_classes = [IsAuthenticated]
+    # Maximum SQL queries per action, independent of range size (enforced in tests)
+    query_budget = {'availability': 4, 'earliest': 16, 'working_hours': 11, 'reschedule': 17, 'calendar_feed': 4}
+    
+    @action(detail=True, methods=['get'])
+    def availability(self, request, pk=None):
+        """Get the doctor's free slots between ?from= and ?to= (inclusive dates)"""
+        doctor = self.get_object()
+        
+        today = clinic_today()
+        date_from = request.query_params.get('from')
+        date_to = request.query_params.get('to')
+        try:
+            date_from = parse_date(date_from) if date_from else today
+            date_to = parse_date(date_to) if date_to else date_from
+        except ValueError:
+            date_from = date_to = None
+        
+        if date_from is None or date_to is None:
+            return Response(
+                {'error': 'from and to must be dates in YYYY-MM-DD format'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if date_to < date_from or (date_to - date_from).days >= settings.AVAILABILITY_MAX_DAYS:
+            return Response(
+                {'error': f'to must be on or after from and within {settings.AVAILABILITY_MAX_DAYS} days'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        slots = availability.get_available_slots(doctor.id, max(date_from, today), date_to)
+        return Response({
+            'doctor_id': doctor.id,
+            'from': date_from,
+            'to': date_to,
+            'slot_minutes': settings.APPOINTMENT_SLOT_MINUTES,
+            'slots': [{'start': start, 'end': end} for start, end in slots]
+        })
+    
+    @action(detail=False, methods=['get'])
+    def earliest(self, request):
+        """Get the earliest free slots across the doctors of ?specialty= (optionally at ?facility=)"""
+        specialty = request.query_params.get('specialty', '').strip().lower()
+        if not specialty:
+            return Response(
+                {'error': 'specialty is required'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        now = request_now(request)
+        after = request.query_params.get('after')
+        try:
+            count = int(request.query_params.get('count', 5))
+            minutes = int(request.query_params.get('minutes', settings.APPOINTMENT_SLOT_MINUTES))
+            after = parse_datetime(after) if after else now
+        except ValueError:
+            after = None
+        if after is None or timezone.is_naive(after):
+            return Response(
+                {'error': 'after must be an ISO 8601 datetime with a time zone, count and minutes whole numbers'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not (1 <= count <= 50 and 1 <= minutes <= settings.APPOINTMENT_MAX_MINUTES):
+            return Response(
+                {'error': f'count must be 1 to 50 and minutes 1 to {settings.APPOINTMENT_MAX_MINUTES}'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        doctors = DoctorProfile.objects.filter(specialty=specialty)
+        if request.query_params.get('facility'):
+            doctors = doctors.filter(facility=request.query_params['facility'])
+        doctors = {
+            user_id: (name, facility)
+            for user_id, name, facility in doctors.values_list('user_id', 'user__name', 'facility')
+        }
+        
+        length = timedelta(minutes=minutes)
+        slots = schedule.earliest(list(doctors), max(after, now), minutes, count, settings.AVAILABILITY_MAX_DAYS)
+        return Response({
+            'specialty': specialty,
+            'minutes': minutes,
+            'slots': [
+                {
+                    'start': start,
+                    'end': start + length,
+                    'doctor_id': doctor_id,
+                    'doctor_name': doctors[doctor_id][0],
+                    'facility': doctors[doctor_id][1],
+                }
+                for start, doctor_id in slots
+            ]
+        })
+    
+    @action(detail=True, methods=['get', 'put'], url_path='working-hours')
+    def working_hours(self, request, pk=None):
+        """Get or update the doctor's weekly working hours and their date exceptions (from today on)"""
+        doctor = self.get_object()
+        
+        if request.method == 'PUT':
+            if not (request.user == doctor or request.user.is_admin()):
+                return Response(
+                    {'error': 'You can only change your own working hours'}, 
+                    status=status.HTTP_403_FORBIDDEN
+                )
+            serializer = WorkingHoursSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            schedule.save_hours(
+                doctor.id,
+                serializer.validated_data.get('weekly'),
+                {
+                    exception['date']: (exception['hours'], exception['reason'])
+                    for exception in serializer.validated_data.get('exceptions', [])
+                },
+            )
+            availability.invalidate_doctor(doctor.id)
+        
+        return Response({'doctor_id': doctor.id, **schedule.hours(doctor.id, clinic_today())})
+    
+    @action(detail=True, methods=['post'])
+    def reschedule(self, request, pk=None):
+        """Move the doctor's upcoming appointments out of a date range (e.g. leave), or preview it with dry_run"""
+        if not request.user.is_admin():
+            return Response(
+                {'error': "Only admins can reschedule a doctor's appointments"}, 
+                status=status.HTTP_403_FORBIDDEN
+            )
+        doctor = self.get_object()
+        
+        serializer = RescheduleSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        data = serializer.validated_data
+        
+        colleagues = None
+        if data['mode'] == 'reassign':
+            specialty = DoctorProfile.objects.filter(user=doctor).values_list('specialty', flat=True).first()
+            if specialty is None:
+                return Response(
+                    {'error': 'The doctor has no profile, so there are no colleagues of their specialty'}, 
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            colleagues = DoctorProfile.objects.filter(specialty=specialty).exclude(user=doctor).values_list(
+                'user_id', flat=True
+            )
+        
+        moves, unplaced = reschedule.plan(doctor.id, data['start_date'], data['end_date'], colleagues)
+        if moves and not data['dry_run']:
+            reschedule.commit(moves)
+        
+        return Response({
+            'doctor_id': doctor.id,
+            'start_date': data['start_date'],
+            'end_date': data['end_date'],
+            'mode': data['mode'],
+            'dry_run': data['dry_run'],
+            'moved': len(moves),
+            'changes': [
+                {
+                    'id': move.appointment.id,
+                    'patient_id': move.appointment.patient_id,
+                    'from': {'doctor_id': move.appointment.doctor_id, 'date_time': move.appointment.date_time},
+                    'to': {'doctor_id': move.doctor_id, 'date_time': move.date_time},
+                }
+                for move in moves
+            ],
+            'unplaced': [
+                {
+                    'id': appointment.id,
+                    'patient_id': appointment.patient_id,
+                    'date_time': appointment.date_time,
+                    'reason': reason,
+                }
+                for appointment, reason in unplaced
+            ]
+        })
+    
+    @action(detail=True, methods=['get', 'post'], url_path='calendar-feed')
+    def calendar_feed(self, request, pk=None):
+        """Get the doctor's private iCalendar subscription URL (POST issues a new one, revoking the old)"""
+        doctor = self.get_object()
+        
+        if not (request.user == doctor or request.user.is_admin()):
+            return Response(
+                {'error': 'You can only view your own calendar feed'}, 
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        token = ical.rotate_feed(doctor.id) if request.method == 'POST' else ical.feed_token(doctor.id)
+        path = reverse('calendar-feed', args=[token])
+        return Response({
+            'doctor_id': doctor.id,
+            'url': request.build_absolute_uri(path)
+        })
+
+
+class DoctorProfileViewSet(viewsets.ModelViewSet):
+    """
+    ViewSet for doctor profile management
+    """
+    queryset = DoctorProfile.objects.all()
+    serializer_class = DoctorProfileSerializer
+    permission_classes = [IsAuthenticated]
+    # Maximum SQL queries per action, independent of result size (enforced in tests)
+    query_budget = {'list': 1, 'retrieve': 1}
+    
+    def get_queryset(self):
+        """Anyone can browse doctors (?specialty= filters); only the doctor or an admin can change a profile"""
+        queryset = DoctorProfile.objects.select_related('user')
+        
+        specialty = self.request.query_params.get('specialty')
+        if specialty:
+            queryset = queryset.filter(specialty=specialty.strip().lower())
+        
+        if self.request.method in permissions.SAFE_METHODS or self.request.user.is_admin():
+            return queryset
+        return queryset.filter(user=self.request.user)
+    
+    def create(self, request, *args, **kwargs):
+        """Doctors create their own profile, once"""
+        if not request.user.is_doctor():
+            return Response(
+                {'error': 'Only doctors can create a doctor profile'}, 
+                status=status.HTTP_403_FORBIDDEN
+            )
+        if DoctorProfile.objects.filter(user=request.user).exists():
+            return Response(
+                {'error': 'You already have a doctor profile'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return super().create(request, *args, **kwargs)
+    
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+
+
+class ResourceViewSet(viewsets.ModelViewSet):
+    """
+    ViewSet for rooms and equipment that appointments reserve
+    """
+    queryset = Resource.objects.all()
+    serializer_class = ResourceSerializer
+    # Maximum SQL queries per action, independent of result size (enforced in tests)
+    query_budget = {'list': 1, 'retrieve': 1, 'availability': 6}
+    
+    def get_permissions(self):
+        """Everyone signed in can browse resources; only admins manage them"""
+        if self.request.method in permissions.SAFE_METHODS:
+            return [IsAuthenticated()]
+        return [IsAdminUser()]
+    
+    def get_queryset(self):
+        """Filter by ?kind= (room/equipment)"""
+        queryset = Resource.objects.all()
+        kind = self.request.query_params.get('kind')
+        if kind:
+            queryset = queryset.filter(kind=kind)
+        return queryset
+    
+    @action(detail=False, methods=['get'])
+    def availability(self, request):
+        """Get the first free slots when all of ?resource_ids= (and ?doctor_id=, if given) are free"""
+        now = request_now(request)
+        after = request.query_params.get('after')
+        try:
+            resource_ids = sorted({int(pk) for pk in request.query_params.get('resource_ids', '').split(',')})
+            doctor_id = request.query_params.get('doctor_id')
+            doctor_id = int(doctor_id) if doctor_id else None
+            count = int(request.query_params.get('count', 5))
+            minutes = int(request.query_params.get('minutes', settings.APPOINTMENT_SLOT_MINUTES))
+            after = parse_datetime(after) if after else now
+        except ValueError:
+            after = None
+        if after is None or timezone.is_naive(after):
+            return Response(
+                {'error': 'resource_ids must be comma-separated ids, after an ISO 8601 datetime with a time zone, '
+                          'doctor_id, count and minutes whole numbers'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not (len(resource_ids) <= settings.APPOINTMENT_MAX_RESOURCES and 1 <= count <= 50
+                and 1 <= minutes <= settings.APPOINTMENT_MAX_MINUTES):
+            return Response(
+                {'error': f'at most {settings.APPOINTMENT_MAX_RESOURCES} resource_ids, count 1 to 50 '
+                          f'and minutes 1 to {settings.APPOINTMENT_MAX_MINUTES}'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if Resource.objects.filter(id__in=resource_ids, active=True).count() != len(resource_ids):
+            return Response(
+                {'error': 'Invalid or inactive resource ID'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if doctor_id is not None and not User.objects.filter(id=doctor_id, role='doctor').exists():
+            return Response(
+                {'error': 'Invalid doctor ID'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        length = timedelta(minutes=minutes)
+        starts = resources.next_free(resource_ids, max(after, now), minutes, count, doctor_id)
+        return Response({
+            'resource_ids': resource_ids,
+            'doctor_id': doctor_id,
+            'minutes': minutes,
+            'slots': [{'start': start, 'end': start + length} for start in starts]
+        })
+
+
 class PatientProfileViewSet(viewsets.ModelViewSet):
     """
     ViewSet for patient profile management
     """
     queryset = PatientProfile.objects.all()
     serializer_class = PatientProfileSerializer
-    permission_classes = [IsAuthenticated()]
+    permission_classes = [IsAuthenticated]
+    # Maximum SQL queries per action, independent of result size (enforced in tests)
+    query_budget = {'list': 1, 'retrieve': 1}
     
     def get_queryset(self):
         """Filter queryset based on user role"""
+        queryset = PatientProfile.objects.select_related('user').with_age(clinic_today(request_now(self.request)))
+        
         if self.request.user.is_admin():
-            return PatientProfile.objects.all()  # Admins see all
+            return queryset  # Admins see all
         elif self.request.user.is_doctor():
             # Doctors see profiles of their patients
             patient_ids = Appointment.objects.filter(
                 doctor=self.request.user
             ).values_list('patient_id', flat=True).distinct()
-            return PatientProfile.objects.filter(user_id__in=patient_ids)
+            return queryset.filter(user_id__in=patient_ids)
         else:
             # Patients only see their own profile
-            return PatientProfile.objects.filter(user=self.request.user)
+            return queryset.filter(user=self.request.user)
     
     def perform_create(self, serializer):
         """Ensure profile is created for the authenticated user"""
@@ -131,7 +543,26 @@ class AppointmentViewSet(viewsets.ModelViewSet):
     """
     queryset = Appointment.objects.all()
     serializer_class = AppointmentSerializer
-    permission_classes = [IsAuthenticated()]
+    permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+    # Maximum SQL queries per action, independent of page size (enforced in tests)
+    query_budget = {
+        'list': 1,
+        'retrieve': 1,
+        'upcoming': 1,
+        'today': 1,
+        'agenda': 1,
+        'calendar': 1,
+        'no_show_risk': 1,
+        'live_token': 0,
+        'history': 2,
+        'confirm': 5,
+        'complete': 5,
+        'no_show': 5,
+        'cancel': 12,
+        'bulk': 7,
+        'bulk_status': 11,
+    }
     
     def get_serializer_class(self):
         """Use different serializers for different actions"""
@@ -141,14 +572,19 @@ class AppointmentViewSet(viewsets.ModelViewSet):
     
     def get_queryset(self):
         """Filter appointments based on user role"""
+        queryset = Appointment.objects.select_related('patient', 'doctor').with_flags(request_now(self.request))
+        return queryset.filter(self.visibility_filter())
+    
+    def visibility_filter(self):
+        """Q selecting the appointments the current user may see"""
         user = self.request.user
         
         if user.is_admin():
-            return Appointment.objects.all()  # Admins see all
+            return Q()  # Admins see all
         elif user.is_doctor():
-            return Appointment.objects.filter(doctor=user)  # Doctor's appointments
+            return Q(doctor=user)  # Doctor's appointments
         else:
-            return Appointment.objects.filter(patient=user)  # Patient's appointments
+            return Q(patient=user)  # Patient's appointments
     
     def perform_create(self, serializer):
         """Set patient automatically if user is a patient"""
@@ -157,6 +593,34 @@ class AppointmentViewSet(viewsets.ModelViewSet):
         else:
             serializer.save()
     
+    def list(self, request, *args, **kwargs):
+        """List appointments, optionally filtered by ?upcoming= and ?cancellable= (true/false)"""
+        queryset = self.filter_queryset(self.get_queryset())
+        for flag in Appointment.FLAG_ANNOTATIONS:
+            value = request.query_params.get(flag)
+            if value is None:
+                continue
+            if parse_flag(value) is None:
+                return Response(
+                    {'error': f'{flag} must be true or false'}, 
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            queryset = queryset.filter(**{flag: parse_flag(value)})
+        
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+    
+    def lost_race(self, appointment):
+        """409 for a transition another request won first"""
+        return Response(
+            {
+                'error': 'Appointment status changed concurrently',
+                'appointment': AppointmentSerializer(appointment).data
+            }, 
+            status=status.HTTP_409_CONFLICT
+        )
+    
     @action(detail=True, methods=['post'])
     def confirm(self, request, pk=None):
         """Doctor confirms an appointment"""
@@ -174,8 +638,8 @@ class AppointmentViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        appointment.status = 'confirmed'
-        appointment.save()
+        if not transitions.transition(appointment, 'confirmed', request.user):
+            return self.lost_race(appointment)
         
         return Response({
             'message': 'Appointment confirmed successfully',
@@ -199,14 +663,40 @@ class AppointmentViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        appointment.status = 'completed'
-        appointment.save()
+        if not transitions.transition(appointment, 'completed', request.user):
+            return self.lost_race(appointment)
         
         return Response({
             'message': 'Appointment completed successfully',
             'appointment': AppointmentSerializer(appointment).data
         })
     
+    @action(detail=True, methods=['post'], url_path='no-show')
+    def no_show(self, request, pk=None):
+        """Doctor records that the patient did not turn up"""
+        appointment = self.get_object()
+        
+        if not request.user.is_doctor() or appointment.doctor != request.user:
+            return Response(
+                {'error': 'Only the assigned doctor can record a no-show'}, 
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        now = timezone.now()
+        if appointment.status != 'confirmed' or appointment.date_time > now:
+            return Response(
+                {'error': 'Only confirmed appointments that have started can be recorded as no-shows'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if not transitions.transition(appointment, 'no_show', request.user, now, guard=Q(date_time__lte=now)):
+            return self.lost_race(appointment)
+        
+        return Response({
+            'message': 'No-show recorded successfully',
+            'appointment': AppointmentSerializer(appointment).data
+        })
+    
     @action(detail=True, methods=['post'])
     def cancel(self, request, pk=None):
         """Cancel an appointment"""
@@ -227,36 +717,468 @@ class AppointmentViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        appointment.status = 'cancelled'
-        appointment.save()
+        now = timezone.now()
+        if not transitions.transition(appointment, 'cancelled', request.user, now, guard=Q(date_time__gt=now)):
+            return self.lost_race(appointment)
+        waitlist.backfill([(appointment.doctor_id, appointment.date_time, appointment.duration)], now)
         
         return Response({
             'message': 'Appointment cancelled successfully',
             'appointment': AppointmentSerializer(appointment).data
         })
     
+    @action(detail=True, methods=['get'])
+    def history(self, request, pk=None):
+        """Get the appointment's status changes, oldest first"""
+        appointment = self.get_object()
+        entries = appointment.transitions.select_related('actor')
+        return Response(AppointmentTransitionSerializer(entries, many=True).data)
+    
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """Book many appointments at once, all-or-nothing or best-effort"""
+        serializer = AppointmentBulkSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        all_or_nothing = serializer.validated_data['mode'] == 'all_or_nothing'
+        errors, items = {}, {}
+        for index, item in enumerate(serializer.validated_data['appointments']):
+            if request.user.is_patient():
+                item = {**item, 'patient_id': request.user.id}  # Patients book for themselves
+            item_serializer = AppointmentBulkItemSerializer(data=item)
+            if item_serializer.is_valid():
+                items[index] = item_serializer.validated_data
+            else:
+                errors[index] = item_serializer.errors
+        
+        conflicts, planned = booking.plan_bulk_booking(items) if items else ({}, {})
+        errors.update(conflicts)
+        
+        created = {}
+        if planned and not (all_or_nothing and errors):
+            created, conflicts = booking.commit_bulk_booking(planned, all_or_nothing)
+            errors.update(conflicts)
+        
+        results = []
+        for index in range(len(serializer.validated_data['appointments'])):
+            if index in created:
+                results.append({'index': index, 'status': 'created', 'id': created[index].id})
+            elif index in errors:
+                results.append({'index': index, 'status': 'error', 'errors': errors[index]})
+            else:
+                results.append({'index': index, 'status': 'skipped'})
+        
+        if not errors:
+            response_status = status.HTTP_201_CREATED
+        elif all_or_nothing:
+            response_status = status.HTTP_400_BAD_REQUEST
+        else:
+            response_status = status.HTTP_207_MULTI_STATUS
+        
+        return Response({
+            'mode': serializer.validated_data['mode'],
+            'created': len(created),
+            'failed': len(errors),
+            'results': results
+        }, status=response_status)
+    
+    @action(detail=False, methods=['post'], url_path='bulk-status')
+    def bulk_status(self, request):
+        """Confirm, complete or cancel many appointments at once"""
+        serializer = AppointmentBulkStatusSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        target = serializer.validated_data['status']
+        moved, rejected = transitions.bulk_transition(
+            Appointment.objects.filter(self.visibility_filter()),
+            request.user,
+            serializer.validated_data['ids'],
+            target,
+            backfill=serializer.validated_data['backfill']
+        )
+        
+        return Response({
+            'status': target,
+            'moved': moved,
+            'rejected': [{'id': pk, 'reason': reason} for pk, reason in sorted(rejected.items())]
+        })
+    
     @action(detail=False, methods=['get'])
     def upcoming(self, request):
         """Get upcoming appointments"""
-        queryset = self.get_queryset().filter(
-            date_time__gt=timezone.now(),
-            status__in=['pending', 'confirmed']
-        ).order_by('date_time')
+        queryset = self.get_queryset().filter(upcoming=True, status__in=['pending', 'confirmed']).order_by('date_time')
         
-        serializer = AppointmentListSerializer(queryset, many=True)
-        return Response(serializer.data)
+        page = self.paginate_queryset(queryset)
+        serializer = AppointmentListSerializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
     
     @action(detail=False, methods=['get'])
     def today(self, request):
-        """Get today's appointments"""
-        today = timezone.now().date()
+        """Get today's appointments (the clinic's local day)"""
+        if request.user.is_doctor() and not request.query_params.get(KeysetPagination.cursor_query_param):
+            # A doctor's day normally fits on one page, straight from the precomputed agenda
+            results = agenda.get(request.user.id, clinic_today())
+            if len(results) <= self.paginator.get_page_size(request):
+                return Response({'next': None, 'previous': None, 'results': results})
+        
         queryset = self.get_queryset().filter(
-            date_time__date=today,
+            **day_range_filter(clinic_today()),
             status__in=['pending', 'confirmed']
         ).order_by('date_time')
         
-        serializer = AppointmentListSerializer(queryset, many=True)
-        return Response(serializer.data)
+        page = self.paginate_queryset(queryset)
+        serializer = AppointmentListSerializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+    
+    @action(detail=False, methods=['get'])
+    def agenda(self, request):
+        """Get the doctor's agenda for ?date= (the clinic's local day, default today)"""
+        if not request.user.is_doctor():
+            return Response(
+                {'error': 'Only doctors have an agenda'}, 
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        day = request.query_params.get('date')
+        try:
+            day = parse_date(day) if day else clinic_today()
+        except ValueError:
+            day = None
+        if day is None:
+            return Response(
+                {'error': 'date must be in YYYY-MM-DD format'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        return Response({
+            'date': day,
+            'appointments': agenda.get(request.user.id, day)
+        })
+    
+    @action(detail=False, methods=['get'])
+    def calendar(self, request):
+        """Get per-day, per-status appointment counts for ?month=YYYY-MM (admins may pass ?doctor_id=)"""
+        user = request.user
+        if not (user.is_doctor() or user.is_admin()):
+            return Response(
+                {'error': 'Only doctors and admins can view the calendar'}, 
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        month = request.query_params.get('month')
+        month = monthly.parse_month(month) if month else monthly.month_of(clinic_today())
+        if month is None:
+            return Response(
+                {'error': 'month must be in YYYY-MM format'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        doctor_id = user.id if user.is_doctor() else request.query_params.get('doctor_id')
+        if doctor_id is not None:
+            try:
+                doctor_id = int(doctor_id)
+            except ValueError:
+                return Response(
+                    {'error': 'doctor_id must be an integer'}, 
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        
+        days = monthly.counts(month, doctor_id)
+        totals = Counter()
+        for day in days.values():
+            totals.update(day)
+        return Response({
+            'month': month.strftime('%Y-%m'),
+            'doctor_id': doctor_id,
+            'days': days,
+            'totals': totals
+        })
+    
+    @action(detail=False, methods=['get'], url_path='no-show-risk')
+    def no_show_risk(self, request):
+        """Get the scored no-show risk of the active appointments on ?date= (admins may pass ?doctor_id=)"""
+        user = request.user
+        if not (user.is_doctor() or user.is_admin()):
+            return Response(
+                {'error': 'Only doctors and admins can view no-show risk'}, 
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        day = request.query_params.get('date')
+        try:
+            day = parse_date(day) if day else clinic_today()
+        except ValueError:
+            day = None
+        if day is None:
+            return Response(
+                {'error': 'date must be in YYYY-MM-DD format'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        appointments = Appointment.objects.filter(
+            self.visibility_filter(), status__in=Appointment.ACTIVE_STATUSES, **day_range_filter(day)
+        )
+        doctor_id = request.query_params.get('doctor_id')
+        if doctor_id and user.is_admin():
+            try:
+                appointments = appointments.filter(doctor_id=int(doctor_id))
+            except ValueError:
+                return Response(
+                    {'error': 'doctor_id must be an integer'}, 
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        
+        # Appointments booked since the last scoring run have no score yet (null risk)
+        rows = appointments.order_by('date_time', 'id').values(
+            'id', 'date_time', 'doctor_id', 'patient_id', 'status',
+            risk=F('no_show_score__risk'), scored_at=F('no_show_score__scored_at')
+        )
+        return Response({'date': day, 'appointments': list(rows)})
+    
+    @action(detail=False, methods=['get'], url_path='live-token')
+    def live_token(self, request):
+        """Get a short-lived token for the live status stream"""
+        if not (request.user.is_doctor() or request.user.is_admin()):
+            return Response(
+                {'error': 'Only doctors and admins can follow live updates'}, 
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        return Response({
+            'token': live.stream_token(request.user.id),
+            'expires_in': settings.LIVE_TOKEN_MAX_AGE
+        })
+
+
+class AppointmentSeriesViewSet(mixins.CreateModelMixin,
+                               mixins.ListModelMixin,
+                               mixins.RetrieveModelMixin,
+                               viewsets.GenericViewSet):
+    """
+    ViewSet for recurring appointment series
+    """
+    queryset = AppointmentSeries.objects.all()
+    serializer_class = AppointmentSeriesSerializer
+    permission_classes = [IsAuthenticated]
+    # Maximum SQL queries per action, independent of result size (enforced in tests)
+    query_budget = {'list': 1, 'retrieve': 1, 'stop': 12}
+    
+    def get_queryset(self):
+        """Filter series based on user role"""
+        user = self.request.user
+        
+        if user.is_admin():
+            return AppointmentSeries.objects.all()  # Admins see all
+        elif user.is_doctor():
+            return AppointmentSeries.objects.filter(doctor=user)  # Doctor's series
+        else:
+            return AppointmentSeries.objects.filter(patient=user)  # Patient's series
+    
+    def perform_create(self, serializer):
+        """
+        Set patient automatically if user is a patient, refuse a series that
+        clashes with existing bookings (409), then fill the booking horizon
+        """
+        # Checked after the insert, in its transaction, like a single booking
+        with transaction.atomic():
+            if self.request.user.is_patient():
+                instance = serializer.save(patient=self.request.user)
+            else:
+                instance = serializer.save()
+            clashes = series.conflicts(instance)
+            if clashes:
+                raise series.series_conflict(clashes)
+            series.materialize(instance)
+    
+    @action(detail=True, methods=['post'])
+    def stop(self, request, pk=None):
+        """End a series and cancel its upcoming occurrences"""
+        instance = self.get_object()
+        
+        if not instance.active:
+            return Response(
+                {'error': 'This series has already been stopped'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        slots = series.stop(instance)
+        waitlist.backfill(slots)
+        return Response({
+            'message': 'Series stopped successfully',
+            'cancelled_appointments': len(slots),
+            'series': AppointmentSeriesSerializer(instance).data
+        })
+
+
+class WaitlistViewSet(mixins.CreateModelMixin,
+                      mixins.ListModelMixin,
+                      mixins.RetrieveModelMixin,
+                      mixins.DestroyModelMixin,
+                      viewsets.GenericViewSet):
+    """
+    ViewSet for the cancellation waitlist
+    """
+    queryset = WaitlistEntry.objects.all()
+    serializer_class = WaitlistEntrySerializer
+    permission_classes = [IsAuthenticated]
+    # Maximum SQL queries per action, independent of result size (enforced in tests)
+    query_budget = {'list': 1, 'retrieve': 1, 'accept': 7}
+    
+    def get_queryset(self):
+        """Filter waitlist entries based on user role"""
+        user = self.request.user
+        
+        queryset = WaitlistEntry.objects.select_related('patient', 'doctor')
+        
+        if user.is_admin():
+            return queryset  # Admins see all
+        elif user.is_doctor():
+            return queryset.filter(doctor=user)  # Doctor's waitlist
+        else:
+            return queryset.filter(patient=user)  # Patient's entries
+    
+    def perform_create(self, serializer):
+        """Set patient automatically if user is a patient"""
+        if self.request.user.is_patient():
+            serializer.save(patient=self.request.user)
+        else:
+            serializer.save()
+    
+    @action(detail=True, methods=['post'])
+    def accept(self, request, pk=None):
+        """Patient accepts the slot currently offered to them"""
+        entry = self.get_object()
+        
+        if entry.patient_id != request.user.id:
+            return Response(
+                {'error': 'Only the waiting patient can accept an offer'}, 
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        if entry.status != 'offered':
+            return Response(
+                {'error': 'No slot is currently offered for this entry'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        now = timezone.now()
+        if entry.offer_expires_at <= now:
+            # Back to the queue, and the slot on to the next waiting patient
+            waitlist.backfill([], now)
+            return Response(
+                {'error': 'This offer has expired'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            with booking.claiming_slot(entry.doctor_id, entry.offered_slot, entry.offered_duration):
+                appointment = Appointment.objects.create(
+                    patient=entry.patient,
+                    doctor=entry.doctor,
+                    date_time=entry.offered_slot,
+                    duration=entry.offered_duration or settings.APPOINTMENT_SLOT_MINUTES,
+                    reason=entry.reason or 'Booked from waitlist'
+                )
+        except booking.SlotUnavailable:
+            # Someone else booked the slot first; keep the patient in the queue
+            entry.status = 'waiting'
+            entry.offered_slot = entry.offered_duration = entry.offer_expires_at = None
+            entry.save()
+            raise
+        
+        entry.status = 'booked'
+        entry.appointment = appointment
+        entry.save()
+        
+        return Response({
+            'message': 'Offer accepted successfully',
+            'appointment': AppointmentSerializer(appointment).data
+        }, status=status.HTTP_201_CREATED)
+
+
+class IsClinicStaff(permissions.BasePermission):
+    """Doctors and admins (the front desk)"""
+    message = 'Only clinic staff can manage the walk-in queue'
+    
+    def has_permission(self, request, view):
+        user = request.user
+        return bool(user and user.is_authenticated and (user.is_doctor() or user.is_admin()))
+
+
+class WalkInViewSet(mixins.CreateModelMixin,
+                    mixins.ListModelMixin,
+                    mixins.RetrieveModelMixin,
+                    viewsets.GenericViewSet):
+    """
+    ViewSet for the walk-in triage queue (nurse desk and doctors)
+    """
+    queryset = WalkIn.objects.select_related('patient', 'doctor')
+    serializer_class = WalkInSerializer
+    permission_classes = [IsClinicStaff]
+    pagination_class = None
+    # Maximum SQL queries per action, independent of queue length (enforced in tests)
+    query_budget = {'list': 2, 'retrieve': 1, 'reprioritize': 7, 'leave': 7, 'call_next': 7}
+    
+    def list(self, request, *args, **kwargs):
+        """Get the people waiting, in calling order"""
+        triage.queue.sync()
+        ids = triage.queue.ordered()
+        walk_ins = self.get_queryset().in_bulk(ids)
+        serializer = self.get_serializer([walk_ins[pk] for pk in ids if pk in walk_ins], many=True)
+        return Response([
+            {**data, 'position': position} for position, data in enumerate(serializer.data, start=1)
+        ])
+    
+    def perform_create(self, serializer):
+        """Register the walk-in through the queue's write-ahead log"""
+        serializer.instance = triage.enqueue(**serializer.validated_data)
+    
+    @action(detail=True, methods=['post'])
+    def reprioritize(self, request, pk=None):
+        """Change a waiting patient's triage priority"""
+        walk_in = self.get_object()
+        serializer = WalkInPrioritySerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        if not triage.reprioritize(walk_in.id, serializer.validated_data['priority']):
+            return Response(
+                {'error': 'Only waiting patients can be reprioritized'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        walk_in.refresh_from_db()
+        return Response(WalkInSerializer(walk_in).data)
+    
+    @action(detail=True, methods=['post'])
+    def leave(self, request, pk=None):
+        """Take a patient who left without being seen out of the queue"""
+        walk_in = self.get_object()
+        if not triage.leave(walk_in.id):
+            return Response(
+                {'error': 'Only waiting patients can leave the queue'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        walk_in.refresh_from_db()
+        return Response(WalkInSerializer(walk_in).data)
+    
+    @action(detail=False, methods=['post'], url_path='call-next')
+    def call_next(self, request):
+        """Doctor calls the most urgent, longest-waiting patient"""
+        if not request.user.is_doctor():
+            return Response(
+                {'error': 'Only doctors can call patients'}, 
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        walk_in_id = triage.call_next(request.user)
+        if walk_in_id is None:
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        
+        return Response(WalkInSerializer(self.get_queryset().get(id=walk_in_id)).data)
 
 
 class MedicalRecordViewSet(viewsets.ModelViewSet):
@@ -265,7 +1187,9 @@ class MedicalRecordViewSet(viewsets.ModelViewSet):
     """
     queryset = MedicalRecord.objects.all()
     serializer_class = MedicalRecordSerializer
-    permission_classes = [IsAuthenticated()]
+    permission_classes = [IsAuthenticated]
+    # Maximum SQL queries per action, independent of result size (enforced in tests)
+    query_budget = {'list': 1, 'retrieve': 1, 'patient_history': 1}
     
     def get_serializer_class(self):
         """Use different serializers for different actions"""
@@ -276,13 +1200,14 @@ class MedicalRecordViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         """Filter medical records based on user role"""
         user = self.request.user
+        queryset = MedicalRecord.objects.select_related(*MEDICAL_RECORD_RELATED)
         
         if user.is_admin():
-            return MedicalRecord.objects.all()  # Admins see all
+            return queryset  # Admins see all
         elif user.is_doctor():
-            return MedicalRecord.objects.filter(doctor=user)  # Doctor's records
+            return queryset.filter(doctor=user)  # Doctor's records
         else:
-            return MedicalRecord.objects.filter(patient=user)  # Patient's records
+            return queryset.filter(patient=user)  # Patient's records
     
     def perform_create(self, serializer):
         """Set doctor automatically if user is a doctor"""
@@ -324,6 +1249,8 @@ class MedicalRecordViewSet(viewsets.ModelViewSet):
             # Admins can see all records
             queryset = MedicalRecord.objects.filter(patient_id=patient_id)
         
+        queryset = queryset.select_related(*MEDICAL_RECORD_RELATED)
+        
         serializer = MedicalRecordSerializer(queryset, many=True)
         return Response(serializer.data)
 
@@ -332,7 +1259,9 @@ class DashboardViewSet(viewsets.ViewSet):
     """
     ViewSet for admin dashboard statistics
     """
-    permission_classes = [IsAdminUser()]
+    permission_classes = [IsAdminUser]
+    # Maximum SQL queries per action, independent of table size (enforced in tests)
+    query_budget = {'stats': 7, 'recent_activity': 2, 'turnaround': 1, 'agenda_cache': 0}
     
     @action(detail=False, methods=['get'])
     def stats(self, request):
@@ -373,14 +1302,43 @@ class DashboardViewSet(viewsets.ViewSet):
         # Recent appointments
         recent_appointments = Appointment.objects.select_related(
             'patient', 'doctor'
-        ).order_by('-created_at')[:10]
+        ).with_flags(request_now(request)).order_by('-created_at')[:10]
         
         # Recent medical records
         recent_records = MedicalRecord.objects.select_related(
-            'patient', 'doctor'
+            'patient', 'doctor', 'appointment'
         ).order_by('-created_at')[:10]
         
         return Response({
             'recent_appointments': AppointmentListSerializer(recent_appointments, many=True).data,
             'recent_records': MedicalRecordListSerializer(recent_records, many=True).data
-        })
\ No newline at end of file
+        })
+    
+    @action(detail=False, methods=['get'])
+    def turnaround(self, request):
+        """Get time spent before each kind of status change on clinic days ?from= to ?to= (default the last 30 days)"""
+        first, last = request.query_params.get('from'), request.query_params.get('to')
+        try:
+            last = parse_date(last) if last else clinic_today()
+            first = parse_date(first) if first else last and last - timedelta(days=29)
+        except ValueError:
+            first = last = None
+        if first is None or last is None or first > last:
+            return Response(
+                {'error': 'from and to must be dates in YYYY-MM-DD format, from not after to'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        # Answered from the (at, from_status, to_status, elapsed) index alone
+        rows = AppointmentTransition.objects.filter(
+            **day_range_filter(first, last, field='at')
+        ).values('from_status', 'to_status').annotate(
+            count=Count('id'), average=Avg('elapsed'), longest=Max('elapsed')
+        ).order_by('from_status', 'to_status')
+        
+        return Response({'from': first, 'to': last, 'transitions': list(rows)})
+    
+    @action(detail=False, methods=['get'], url_path='agenda-cache')
+    def agenda_cache(self, request):
+        """Get this process's agenda cache counters"""
+        return Response(agenda.agendas.stats())
\ No newline at end of file
@@ -0,0 +1,150 @@
+"""
+Cancellation waitlist matcher.
+
+When appointments are cancelled, their freed slots go to the waitlist in one
+pass: a single query over the partial (doctor, earliest, latest) index loads
+every waiting entry whose window can cover any freed slot of that doctor,
+then a sweep over the slots in time order keeps the entries that have opened
+(``earliest`` reached) in a heap ordered by arrival, discarding those whose
+window has closed. Each slot goes to the longest-waiting entry that fits, so
+matching a batch costs O((slots + entries) log entries), however many slots a
+mass cancellation frees.
+"""
+import heapq
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from . import availability, booking
+from .models import Appointment, WaitlistEntry
+
+
+def match_slots(slots, entries):
+    """
+    Assign sorted (date_time, minutes) slots to entries (sorted by
+    ``earliest``), first come first served. Returns [(entry, date_time, minutes)].
+    """
+    matches = []
+    opened = []
+    i = 0
+    for date_time, minutes in slots:
+        end = date_time + timedelta(minutes=minutes)
+        while i < len(entries) and entries[i].earliest <= date_time:
+            entry = entries[i]
+            heapq.heappush(opened, (entry.created_at, entry.id, entry))
+            i += 1
+        # A doctor's freed slots do not overlap, so they only end later and
+        # an entry too short for this one is done
+        while opened and opened[0][2].latest < end:
+            heapq.heappop(opened)
+        if opened:
+            matches.append((heapq.heappop(opened)[2], date_time, minutes))
+    return matches
+
+
+def expire_offers(now):
+    """
+    Return lapsed offers to the waiting queue; returns [(entry_id, doctor_id,
+    offered_slot, offered_duration)] of them
+    """
+    lapsed = list(WaitlistEntry.objects.filter(status='offered', offer_expires_at__lte=now).values_list(
+        'id', 'doctor_id', 'offered_slot', 'offered_duration'
+    ))
+    # Guarded again: an offer accepted since the read is no longer lapsed
+    WaitlistEntry.objects.filter(
+        id__in=[pk for pk, _, _, _ in lapsed], status='offered', offer_expires_at__lte=now
+    ).update(status='waiting', offered_slot=None, offered_duration=None, offer_expires_at=None, updated_at=now)
+    return lapsed
+
+
+def still_free(slots):
+    """The (doctor_id, date_time, minutes) ``slots`` no active appointment has taken since they were freed"""
+    windows = [
+        (doctor_id, date_time, date_time + timedelta(minutes=minutes)) for doctor_id, date_time, minutes in slots
+    ]
+    busy = availability.nearby_intervals(windows)
+    return [
+        slot for slot, (doctor_id, start, end) in zip(slots, windows)
+        if not availability.collides(busy[doctor_id], start, end)
+    ]
+
+
+def backfill(slots, now=None):
+    """
+    Hand freed (doctor_id, date_time, minutes) slots to waiting patients.
+
+    Entries with ``auto_book`` get the appointment straight away; the others
+    are offered the slot for ``WAITLIST_OFFER_MINUTES``. Slots of offers that
+    lapsed unanswered are handed on too, to someone else, if still free.
+    Returns [(entry, date_time)].
+    """
+    now = now or timezone.now()
+    lapsed = expire_offers(now)
+    # Offers made before their length was recorded held one slot
+    reoffered = still_free([
+        (doctor_id, date_time, minutes or settings.APPOINTMENT_SLOT_MINUTES)
+        for _, doctor_id, date_time, minutes in lapsed if date_time > now
+    ])
+    freed = defaultdict(set)
+    for doctor_id, date_time, minutes in [*slots, *reoffered]:
+        if date_time > now:
+            freed[doctor_id].add((date_time, minutes))
+    if not freed:
+        return []
+
+    window = Q()
+    for doctor_id, doctor_slots in freed.items():
+        window |= Q(
+            doctor_id=doctor_id,
+            earliest__lte=max(date_time for date_time, _ in doctor_slots),
+            latest__gte=min(date_time + timedelta(minutes=minutes) for date_time, minutes in doctor_slots),
+        )
+    candidates = defaultdict(list)
+    # Whoever just let an offer lapse is not offered a slot again in the same pass
+    waiting = WaitlistEntry.objects.filter(window, status='waiting').exclude(id__in=[pk for pk, _, _, _ in lapsed])
+    for entry in waiting.order_by('earliest'):
+        candidates[entry.doctor_id].append(entry)
+
+    matches = []
+    for doctor_id, doctor_slots in freed.items():
+        matches.extend(match_slots(sorted(doctor_slots), candidates[doctor_id]))
+    if not matches:
+        return []
+
+    planned = {
+        entry.id: Appointment(
+            patient_id=entry.patient_id,
+            doctor_id=entry.doctor_id,
+            date_time=date_time,
+            duration=minutes,
+            reason=entry.reason or 'Booked from waitlist',
+        )
+        for entry, date_time, minutes in matches if entry.auto_book
+    }
+    created = booking.commit_bulk_booking(planned, all_or_nothing=False)[0] if planned else {}
+
+    offer_expires_at = now + timedelta(minutes=settings.WAITLIST_OFFER_MINUTES)
+    placed = []
+    for entry, date_time, minutes in matches:
+        if entry.auto_book:
+            if entry.id not in created:
+                continue  # Slot was taken concurrently; keep waiting
+            entry.status = 'booked'
+            entry.appointment = created[entry.id]
+        else:
+            entry.status = 'offered'
+            entry.offered_slot = date_time
+            entry.offered_duration = minutes
+            entry.offer_expires_at = offer_expires_at
+        entry.updated_at = now
+        placed.append((entry, date_time))
+
+    WaitlistEntry.objects.bulk_update(
+        [entry for entry, _ in placed],
+        ['status', 'appointment', 'offered_slot', 'offered_duration', 'offer_expires_at', 'updated_at'],
+        batch_size=500,
+    )
+    return placed